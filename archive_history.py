@@ -0,0 +1,25 @@
+import argparse
+from run import create_app
+from model.archive import archive_history, archive_stats
+
+"""
+Moves notes and study sessions from whole months older than ARCHIVE_AFTER_DAYS into compressed
+monthly archive blocks. Runs in small committed batches, safe to stop and re-run (e.g. nightly from cron).
+"""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive old notes and study sessions.")
+    parser.add_argument('--days', type=int, help="archive months older than this (default ARCHIVE_AFTER_DAYS)")
+    parser.add_argument('--batch', type=int, help="rows per transaction (default ARCHIVE_BATCH_ROWS)")
+    args = parser.parse_args()
+
+    app = create_app(routes=False)
+    with app.app_context():
+        report = archive_history(days=args.days or app.config['ARCHIVE_AFTER_DAYS'],
+                                 batch_size=args.batch or app.config['ARCHIVE_BATCH_ROWS'])
+        print(f"Archived {report['message']} notes and {report['session']} sessions before {report['cutoff']} "
+              f"into {report['blocks']} blocks: {report['raw_bytes']} bytes -> {report['stored_bytes']} "
+              f"({report['saved_bytes']} saved).")
+        for kind, totals in archive_stats().items():
+            print(f"  {kind}: {totals['rows']} rows in {totals['blocks']} blocks, "
+                  f"{totals['raw_bytes']} -> {totals['stored_bytes']} bytes")
@@ -0,0 +1,111 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+from flask import current_app, url_for, send_from_directory, abort
+from compression import brotli, negotiate
+
+"""
+Fingerprinted, precompressed static assets for W Notes+.
+build_assets.py copies every file in static/ to the dist folder as name.<hash>.ext, with .gz
+(and .br when the brotli package is installed) siblings, plus a manifest.
+asset_url() in templates points at the fingerprinted names, served from /assets/ with a year-long
+immutable Cache-Control, so browsers never revalidate them - a changed file gets a new URL.
+Without a build (dev) asset_url falls back to the plain static URL.
+"""
+
+MANIFEST = 'manifest.json'
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.map')
+ONE_YEAR = 31536000
+
+def dist_folder(app):
+    return app.config.get('ASSETS_DIST_DIR') or os.path.join(app.static_folder, 'dist')
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+def build(static_folder, dist):
+    """
+    Fingerprints and precompresses every file under static_folder into dist.
+    Returns (manifest {name: hashed name}, sizes {name: {raw, gzip, br}}).
+    """
+    manifest, sizes = {}, {}
+    dist = os.path.abspath(dist)
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) != dist)
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+            stem, ext = os.path.splitext(rel)
+            hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+            out = os.path.join(dist, hashed)
+            _write(out, data)
+            sizes[rel] = {'raw': len(data)}
+            if ext in COMPRESSIBLE:
+                packed = gzip.compress(data, compresslevel=9, mtime=0)
+                _write(out + '.gz', packed)
+                sizes[rel]['gzip'] = len(packed)
+                if brotli:
+                    packed = brotli.compress(data, quality=11)
+                    _write(out + '.br', packed)
+                    sizes[rel]['br'] = len(packed)
+            manifest[rel] = hashed
+    _write(os.path.join(dist, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest, sizes
+
+class Assets:
+    """Manifest lookups for asset_url and the /assets/ view."""
+
+    def __init__(self):
+        self._manifests = {}  # dist folder -> manifest, read once
+
+    def init_app(self, app):
+        app.add_url_rule('/assets/<path:filename>', 'assets', self.serve)
+        app.jinja_env.globals['asset_url'] = self.url
+
+    def manifest(self):
+        dist = dist_folder(current_app)
+        if dist not in self._manifests:
+            try:
+                with open(os.path.join(dist, MANIFEST)) as f:
+                    self._manifests[dist] = json.load(f)
+            except FileNotFoundError:
+                self._manifests[dist] = {}
+        return self._manifests[dist]
+
+    def reload(self):
+        """Forget loaded manifests (after a rebuild)."""
+        self._manifests.clear()
+
+    def url(self, filename):
+        """Fingerprinted URL for a static file, or the plain static URL when it hasn't been built."""
+        hashed = self.manifest().get(filename)
+        if hashed is None:
+            return url_for('static', filename=filename)
+        return url_for('assets', filename=hashed)
+
+    def serve(self, filename):
+        """Serves a built file, precompressed if the client takes it, cached for a year."""
+        if filename not in self.manifest().values():
+            abort(404)
+        dist = dist_folder(current_app)
+        encodings = [e for e in ('br', 'gzip') if os.path.exists(os.path.join(dist, filename + ('.br' if e == 'br' else '.gz')))]
+        encoding = negotiate(encodings) if encodings else None
+        suffix = {'br': '.br', 'gzip': '.gz'}.get(encoding, '')
+        response = send_from_directory(dist, filename + suffix, max_age=ONE_YEAR,
+                                       mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if encodings:
+            response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+assets = Assets()
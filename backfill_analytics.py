@@ -0,0 +1,10 @@
+from run import create_app
+from model.analytics import backfill_rollups
+
+"""Rebuilds the study analytics rollups from existing sessions and completed tasks in batches."""
+
+if __name__ == "__main__":
+    app = create_app(routes=False)
+    with app.app_context():
+        processed = backfill_rollups()
+        print(f"Backfilled rollups from {processed} rows.")
@@ -0,0 +1,477 @@
+import argparse
+import gzip
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from sqlalchemy import event, func
+from extensions import db
+from run import create_app
+from model.models import User, Subject, SubjectMember, Task, Priority, lookup_data
+from model.synthetic import generate, SYNTHETIC_PASSWORD
+from model.lookups import lookups
+from model.scheduler import plan_cache
+from cache import fragment_cache
+from model.calendar import new_calendar_token
+from passwords import password_hasher
+from compression import brotli
+
+"""
+Benchmark suite for W Notes+.
+Seeds a separate database with synthetic data, times every page in routes/main.py, routes/tasks.py and
+routes/auth.py (and the JSON API) through the Flask test client (latency percentiles, queries per request, peak memory,
+bytes rendered vs sent compressed),
+and writes JSON that can be compared against a saved baseline to catch regressions.
+
+    python benchmark.py --users 50 --iterations 30 --output bench.json --baseline baseline.json
+
+Also measures login throughput under concurrency (logins/sec per hashing core) and cold start time.
+"""
+
+DEFAULT_DATABASE = 'sqlite:///benchmark.db'
+DEFAULT_TOLERANCE = 0.25  # 25% slower than baseline counts as a regression
+NOISE_FLOOR_MS = 1.0      # ignore latency changes smaller than this
+
+SCENARIOS = []
+
+def scenario(name, login=True, before=None):
+    """
+    Registers a timed request. fn(client, ctx, i) makes one request and returns the response.
+    before(ctx) runs once, untimed, ahead of the scenario's requests.
+    """
+    def register(fn):
+        SCENARIOS.append((name, login, before, fn))
+        return fn
+    return register
+
+# routes/main.py (the notes SSE stream is long-lived by design, so it isn't latency-timed)
+@scenario('main.index', login=False)
+def _index(client, ctx, i):
+    return client.get('/')
+
+@scenario('main.dashboard')
+def _dashboard(client, ctx, i):
+    return client.get('/dashboard')
+
+@scenario('main.add_subject_form')
+def _add_subject_form(client, ctx, i):
+    return client.get('/add_subject')
+
+@scenario('main.add_subject')
+def _add_subject(client, ctx, i):
+    return client.post('/add_subject', data={'name': f"bench scratch {ctx['run']}-{i}", 'color_id': 1})
+
+@scenario('main.view_subject')
+def _view_subject(client, ctx, i):
+    return client.get(f"/subject/{ctx['subject_id']}")
+
+@scenario('main.log_session')
+def _log_session(client, ctx, i):
+    return client.post(f"/log_session/{ctx['subject_id']}", data={'duration': '30'})
+
+@scenario('main.send_message')
+def _send_message(client, ctx, i):
+    return client.post(f"/send_message/{ctx['subject_id']}", data={'content': f'benchmark note {i}'})
+
+@scenario('main.message_feed')
+def _message_feed(client, ctx, i):
+    return client.get(f"/subject/{ctx['subject_id']}/messages")
+
+@scenario('main.invite_user')
+def _invite_user(client, ctx, i):
+    others = ctx['other_usernames']
+    return client.post(f"/invite_user/{ctx['subject_id']}", data={'username': others[i % len(others)]})
+
+@scenario('main.suggest_users')
+def _suggest_users(client, ctx, i):
+    # 'bench' matches every synthetic user, so this is the widest range the index has to serve
+    return client.get('/users/suggest', query_string={'q': 'bench'[:1 + i % 5]})
+
+@scenario('main.accept_invite')
+def _accept_invite(client, ctx, i):
+    invites = ctx['invite_ids']
+    return client.get(f"/accept_invite/{invites[i % len(invites)]}")
+
+def _load_scratch(ctx):
+    ctx['scratch'] = [row[0] for row in db.session.query(Subject.subject_id)
+                      .filter(Subject.user_id == ctx['user_id'], Subject.name.like(f"bench scratch {ctx['run']}-%"))
+                      .order_by(Subject.subject_id)]
+
+@scenario('main.delete_subject', before=_load_scratch)
+def _delete_subject(client, ctx, i):
+    # Deletes the scratch subjects main.add_subject made, never the seeded ones
+    scratch = ctx['scratch']
+    return client.get(f"/delete_subject/{scratch.pop() if scratch else 0}")
+
+# routes/tasks.py
+@scenario('tasks.add_task_form')
+def _add_task_form(client, ctx, i):
+    return client.get('/add_task')
+
+@scenario('tasks.add_task')
+def _add_task(client, ctx, i):
+    return client.post('/add_task', data={'title': f'bench task {i}', 'subject_id': ctx['subject_id'],
+                                          'priority_id': ctx['priority_id'], 'tag_ids': ctx['tag_ids'][:2],
+                                          'due_date_str': ctx['due_date'], 'estimated_minutes': '45'})
+
+@scenario('tasks.complete_task')
+def _complete_task(client, ctx, i):
+    pending = ctx['pending_task_ids']
+    return client.get(f"/complete_task/{pending.pop() if pending else ctx['done_task_id']}")
+
+@scenario('tasks.agenda')
+def _agenda(client, ctx, i):
+    return client.get('/agenda?days=14')
+
+@scenario('tasks.agenda_json')
+def _agenda_json(client, ctx, i):
+    return client.get('/agenda.json?days=14')
+
+@scenario('tasks.batch')
+def _batch(client, ctx, i):
+    return client.post('/tasks/batch', data={'task_ids': ctx['batch_task_ids'], 'action': 'set_priority',
+                                             'priority_id': ctx['priority_id']})
+
+@scenario('tasks.plan')
+def _plan(client, ctx, i):
+    return client.get('/plan')
+
+@scenario('tasks.plan_json')
+def _plan_json(client, ctx, i):
+    return client.get('/plan.json')
+
+@scenario('tasks.calendar_feed', login=False)
+def _calendar_feed(client, ctx, i):
+    return client.get(f"/calendar/{ctx['calendar_token']}.ics")
+
+# routes/api.py
+@scenario('api_v1.tasks')
+def _api_tasks(client, ctx, i):
+    return client.get('/api/v1/tasks?limit=100')
+
+@scenario('api_v1.notes')
+def _api_notes(client, ctx, i):
+    return client.get(f"/api/v1/notes?subject_id={ctx['subject_id']}&fields=id,sender,content&limit=100")
+
+# routes/auth.py
+@scenario('auth.signup_form', login=False)
+def _signup_form(client, ctx, i):
+    return client.get('/signup')
+
+@scenario('auth.signup', login=False)
+def _signup(client, ctx, i):
+    name = f"new{ctx['run']}{i}"[-20:]
+    return client.post('/signup', data={'username': name, 'email': f'{name}@example.com', 'password': SYNTHETIC_PASSWORD})
+
+@scenario('auth.signin_form', login=False)
+def _signin_form(client, ctx, i):
+    return client.get('/signin')
+
+@scenario('auth.signin', login=False)
+def _signin(client, ctx, i):
+    return client.post('/signin', data={'username or email': ctx['username'], 'password': SYNTHETIC_PASSWORD})
+
+@scenario('auth.logout')
+def _logout(client, ctx, i):
+    return client.get('/logout')
+
+def seed(app, users, seed_value, ratios=None):
+    """Rebuilds the benchmark database from scratch and fills it. Returns row counts."""
+    from migrate_db import stamp_latest
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        stamp_latest()
+        lookups.invalidate()
+        plan_cache.invalidate()
+        fragment_cache.clear()
+        lookup_data()
+        return generate(users=users, seed=seed_value, ratios=ratios)
+
+def build_context(app, iterations):
+    """Picks the busiest user/subject and the ids the write scenarios need."""
+    with app.app_context():
+        user_id, _ = (db.session.query(SubjectMember.user_id, func.count())
+                      .filter_by(status='accepted')
+                      .group_by(SubjectMember.user_id)
+                      .order_by(func.count().desc(), SubjectMember.user_id)
+                      .first())
+        user = db.session.get(User, user_id)
+        subject_id = (db.session.query(Subject.subject_id).filter_by(user_id=user_id)
+                      .order_by((Subject.active_task_count + Subject.message_count).desc()).limit(1).scalar())
+        # Reads pay for the full subject, complete_task needs one fresh pending task per call
+        pending = [row[0] for row in db.session.query(Task.task_id)
+                   .filter_by(user_id=user_id, status_id=1).order_by(Task.task_id).limit(iterations * 2 + 20)]
+        done_task_id = db.session.query(Task.task_id).filter_by(user_id=user_id, status_id=2).limit(1).scalar()
+        # Pending invites first, re-accepting their own memberships still exercises the route
+        invite_ids = [row[0] for row in db.session.query(SubjectMember.id).filter_by(user_id=user_id)
+                      .order_by(SubjectMember.status.desc(), SubjectMember.id)]
+        others = [row[0] for row in db.session.query(User.username).filter(User.user_id != user_id).limit(iterations + 1)]
+        user.calendar_token = user.calendar_token or new_calendar_token()
+        db.session.commit()
+        return {
+            'run': datetime.now().strftime('%H%M%S'),
+            'user_id': user_id,
+            'username': user.username,
+            'subject_id': subject_id,
+            'priority_id': db.session.query(func.min(Priority.id)).scalar(),
+            'tag_ids': [t.tag_id for t in lookups.tags()],
+            'due_date': datetime.now().strftime('%Y-%m-%d'),
+            'batch_task_ids': pending[-10:],
+            'pending_task_ids': pending[:-10],
+            'done_task_id': done_task_id or 0,
+            'invite_ids': invite_ids,
+            'other_usernames': others or [user.username],
+            'calendar_token': user.calendar_token,
+        }
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+def run_scenarios(app, ctx, iterations=20, names=None):
+    """Times each scenario `iterations` times. Returns {name: metrics}."""
+    with app.app_context():
+        engine = db.engine
+    statements = []
+    def _count(conn, cursor, statement, params, context, executemany):
+        statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', _count)
+
+    results = {}
+    try:
+        client = app.test_client()
+        # Ask for compression like a browser does, so timings include it and sizes are what goes over the wire
+        client.environ_base['HTTP_ACCEPT_ENCODING'] = 'br, gzip'
+        for name, login, before, fn in SCENARIOS:
+            if names and name not in names:
+                continue
+            if before:
+                with app.app_context():
+                    before(ctx)
+
+            def call(i):
+                with client.session_transaction() as sess:
+                    sess.clear()
+                    if login:
+                        sess['user_id'] = ctx['user_id']
+                return fn(client, ctx, i)
+
+            call(-1)  # warm up templates and caches
+            timings, queries, statuses = [], [], set()
+            for i in range(iterations):
+                statements.clear()
+                start = time.perf_counter()
+                response = call(i)
+                response.get_data()  # drain streamed bodies inside the timing
+                timings.append((time.perf_counter() - start) * 1000)
+                queries.append(len(statements))
+                statuses.add(response.status_code)
+
+            # Separate pass for memory, tracemalloc slows everything down too much to time under it
+            tracemalloc.start()
+            response = call(iterations)
+            body = response.get_data()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            results[name] = {
+                'requests': iterations,
+                'p50_ms': round(percentile(timings, 50), 3),
+                'p95_ms': round(percentile(timings, 95), 3),
+                'p99_ms': round(percentile(timings, 99), 3),
+                'mean_ms': round(sum(timings) / len(timings), 3),
+                'queries': round(sum(queries) / len(queries), 2),
+                'peak_kb': round(peak / 1024, 1),
+                'raw_kb': round(len(decode_body(response, body)) / 1024, 1),
+                'sent_kb': round(len(body) / 1024, 1),
+                'statuses': sorted(statuses),
+            }
+    finally:
+        event.remove(engine, 'before_cursor_execute', _count)
+    return results
+
+def decode_body(response, body):
+    """Body as the app rendered it, before Content-Encoding."""
+    encoding = response.headers.get('Content-Encoding')
+    if encoding == 'gzip':
+        return gzip.decompress(body)
+    if encoding == 'br':
+        return brotli.decompress(body)
+    return body
+
+def measure_logins(app, ctx, seconds=3.0, concurrency=8):
+    """
+    Signs in from `concurrency` threads at once for `seconds`, all through the password hashing pool.
+    Reports successful logins per second, per core doing the hashing, and how many got a 503.
+    """
+    statuses = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+    form = {'username or email': ctx['username'], 'password': SYNTHETIC_PASSWORD}
+
+    def worker():
+        client = app.test_client()
+        counts = {}
+        while time.perf_counter() < deadline:
+            status = client.post('/signin', data=form).status_code
+            counts[status] = counts.get(status, 0) + 1
+            if status == 503:
+                time.sleep(0.05)  # back off like a browser would, a tight retry loop just steals the CPU
+        with lock:
+            for status, count in counts.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    client = app.test_client()
+    client.post('/signin', data=form)  # warm up (and upgrade the hash if the method changed)
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    cores = min(password_hasher.workers, os.cpu_count() or 1)
+    per_second = statuses.get(302, 0) / elapsed
+    return {
+        'method': password_hasher.method,
+        'concurrency': concurrency,
+        'cores': cores,
+        'logins_per_sec': round(per_second, 1),
+        'logins_per_sec_per_core': round(per_second / cores, 1),
+        'rejected_503': statuses.get(503, 0),
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+    }
+
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE, noise_floor_ms=NOISE_FLOOR_MS):
+    """
+    Lists regressions of `current` against `baseline` (both results dicts).
+    Latency and memory may drift within tolerance, any extra query per request is flagged.
+    """
+    regressions = []
+    for name, now in sorted(current['scenarios'].items()):
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms'):
+            if now[metric] > before[metric] * (1 + tolerance) and now[metric] - before[metric] > noise_floor_ms:
+                regressions.append(f"{name}: {metric} {before[metric]} -> {now[metric]}")
+        if now['queries'] > before['queries']:
+            regressions.append(f"{name}: queries {before['queries']} -> {now['queries']}")
+        if now['peak_kb'] > before['peak_kb'] * (1 + tolerance):
+            regressions.append(f"{name}: peak_kb {before['peak_kb']} -> {now['peak_kb']}")
+        if 'sent_kb' in before and now['sent_kb'] > before['sent_kb'] * (1 + tolerance) and now['sent_kb'] - before['sent_kb'] > 1:
+            regressions.append(f"{name}: sent_kb {before['sent_kb']} -> {now['sent_kb']}")
+    for name, ms in sorted(current.get('startup', {}).items()):
+        before = baseline.get('startup', {}).get(name)
+        if before is not None and ms > before * (1 + tolerance) and ms - before > noise_floor_ms:
+            regressions.append(f"startup {name}: {before} -> {ms}")
+    now, before = current.get('logins'), baseline.get('logins')
+    if now and before and now['logins_per_sec_per_core'] < before['logins_per_sec_per_core'] * (1 - tolerance):
+        regressions.append(f"logins_per_sec_per_core {before['logins_per_sec_per_core']} -> {now['logins_per_sec_per_core']}")
+    return regressions
+
+def run_benchmark(app, users=50, seed_value=42, iterations=20, names=None, ratios=None,
+                  login_seconds=0, login_concurrency=8):
+    """Seeds, runs every scenario (and the login throughput run if login_seconds) and returns the results document."""
+    rows = seed(app, users, seed_value, ratios)
+    ctx = build_context(app, iterations)
+    scenarios = run_scenarios(app, ctx, iterations, names)
+    results = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'users': users,
+            'seed': seed_value,
+            'iterations': iterations,
+            'rows': rows,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'database': app.config['SQLALCHEMY_DATABASE_URI'],
+        },
+        'scenarios': scenarios,
+    }
+    if login_seconds:
+        results['logins'] = measure_logins(app, ctx, login_seconds, login_concurrency)
+    return results
+
+# Fresh interpreter each run: imports + create_app, what every worker/CLI start pays
+STARTUP_SNIPPETS = {
+    'app': "from run import create_app; create_app()",
+    'cli_app': "from run import create_app; create_app(routes=False)",
+}
+
+def measure_startup(runs=5):
+    """Median cold start in ms for a full app and a DB-only (CLI) app."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for name, code in STARTUP_SNIPPETS.items():
+        samples = []
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, '-c', f"import time; t = time.perf_counter(); {code}; print(time.perf_counter() - t)"],
+                                 capture_output=True, text=True, check=True, cwd=here)
+            samples.append(float(out.stdout.split()[-1]) * 1000)
+        results[f'{name}_ms'] = round(percentile(samples, 50), 1)
+    return results
+
+def print_table(results):
+    print(f"{'scenario':<26}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'peak kb':>10}{'raw kb':>9}{'sent kb':>9}")
+    for name, m in results['scenarios'].items():
+        print(f"{name:<26}{m['p50_ms']:>9}{m['p95_ms']:>9}{m['p99_ms']:>9}{m['queries']:>9}{m['peak_kb']:>10}"
+              f"{m['raw_kb']:>9}{m['sent_kb']:>9}")
+    for name, ms in results.get('startup', {}).items():
+        print(f"startup {name}: {ms}")
+    logins = results.get('logins')
+    if logins:
+        print(f"logins: {logins['logins_per_sec']}/s, {logins['logins_per_sec_per_core']}/s per core "
+              f"({logins['method']}, {logins['concurrency']} clients, {logins['rejected_503']} rejected)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark W Notes+ routes against synthetic data.")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--scenario', action='append', help="only run these (repeatable), e.g. main.dashboard")
+    parser.add_argument('--database', default=DEFAULT_DATABASE, help="never point this at real data, it gets wiped")
+    parser.add_argument('--output', help="write results JSON here")
+    parser.add_argument('--baseline', help="compare against this results JSON, exit 1 on regressions")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--startup-runs', type=int, default=5, help="cold start samples (0 to skip)")
+    parser.add_argument('--login-seconds', type=float, default=3.0, help="login throughput run length (0 to skip)")
+    parser.add_argument('--login-concurrency', type=int, default=8)
+    args = parser.parse_args(argv)
+
+    # No in-process job workers, their polling would show up in every scenario's query count
+    app = create_app(overrides={'SQLALCHEMY_DATABASE_URI': args.database, 'JOBS_WORKER_THREADS': 0})
+
+    results = run_benchmark(app, args.users, args.seed, args.iterations, args.scenario,
+                            login_seconds=args.login_seconds, login_concurrency=args.login_concurrency)
+    if args.startup_runs:
+        results['startup'] = measure_startup(args.startup_runs)
+    print_table(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            return 1
+        print("No regressions against", args.baseline)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+import argparse
+from run import create_app
+from assets import build, dist_folder
+from compression import brotli
+
+"""
+Fingerprints and precompresses static/ into static/dist (or ASSETS_DIST_DIR) for asset_url().
+Run it on deploy, after any change under static/. Old fingerprinted files are left in place
+so pages cached before the deploy still find theirs.
+"""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build fingerprinted, precompressed static assets.")
+    parser.add_argument('--out', help="output folder (default ASSETS_DIST_DIR or static/dist)")
+    args = parser.parse_args()
+
+    app = create_app(routes=False)
+    out = args.out or dist_folder(app)
+    manifest, sizes = build(app.static_folder, out)
+    print(f"Built {len(manifest)} assets into {out}" + ("" if brotli else " (no brotli package, gzip only)"))
+    for name, hashed in manifest.items():
+        size = sizes[name]
+        packed = ', '.join(f"{enc} {size[enc]}" for enc in ('gzip', 'br') if enc in size)
+        print(f"  {name} -> {hashed}: {size['raw']} bytes" + (f" ({packed})" if packed else ""))
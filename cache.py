@@ -0,0 +1,96 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from markupsafe import Markup
+from werkzeug.utils import import_string
+
+"""
+Rendered HTML fragment cache for W Notes+.
+Fragments (task lists, notes feeds, subject cards) are keyed by the subject's version stamp,
+so a write never has to invalidate anything - it just moves the key.
+The default backend is an in-process LRU; any object with get/set/clear (e.g. a cachelib
+RedisCache) can be plugged in through FRAGMENT_CACHE_BACKEND to share fragments between workers.
+"""
+
+FRAGMENT_CACHE_SIZE = 2000
+
+class LRUBackend:
+    """Bounded thread-safe LRU, same get/set/delete/clear shape as cachelib caches."""
+
+    def __init__(self, maxsize=FRAGMENT_CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.maxsize = maxsize
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        return True
+
+    def __len__(self):
+        return len(self._entries)
+
+class FragmentCache:
+    """Get-or-render front end over a backend, with hit/miss counters."""
+
+    def __init__(self, backend=None):
+        self.backend = backend or LRUBackend()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        """
+        FRAGMENT_CACHE_BACKEND: None for the in-process LRU, a backend object,
+        or an import string ('package.module:name') of a backend instance or factory.
+        """
+        backend = app.config.get('FRAGMENT_CACHE_BACKEND')
+        if isinstance(backend, str):
+            backend = import_string(backend)
+            backend = backend() if callable(backend) else backend
+        self.backend = backend or LRUBackend(app.config.get('FRAGMENT_CACHE_SIZE', FRAGMENT_CACHE_SIZE))
+
+    @staticmethod
+    def key(*parts):
+        """Short, backend-safe key (no spaces, bounded length) from any mix of parts."""
+        return 'frag:' + hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def render(self, parts, render_fn):
+        """Returns the cached fragment for parts, rendering and storing it on a miss."""
+        key = self.key(*parts)
+        html = self.backend.get(key)
+        if html is None:
+            self.misses += 1
+            html = str(render_fn())
+            self.backend.set(key, html)
+        else:
+            self.hits += 1
+        return Markup(html)
+
+    def missing(self, parts_by_id):
+        """Ids from {id: parts} whose fragment isn't cached, so callers can load just those rows in one go."""
+        return [item_id for item_id, parts in parts_by_id.items() if self.backend.get(self.key(*parts)) is None]
+
+    def clear(self):
+        """Needed whenever version stamps restart (database reset)."""
+        self.backend.clear()
+
+fragment_cache = FragmentCache()
@@ -0,0 +1,107 @@
+import gzip
+import threading
+import zlib
+from collections import defaultdict
+from flask import request, current_app
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+"""
+Negotiated response compression for W Notes+.
+HTML/JSON bodies over COMPRESS_MIN_SIZE are gzip (or brotli) encoded when the client accepts it.
+Streamed responses are skipped by the hook, views that want them compressed wrap their body in encode_stream.
+Raw vs sent bytes are totalled per endpoint for /metrics and the benchmark.
+"""
+
+def available_encodings():
+    """Encodings we can produce, preferred first."""
+    return ('br', 'gzip') if brotli else ('gzip',)
+
+def negotiate(encodings=None):
+    """Best encoding the client accepts out of encodings, or None for identity."""
+    return request.accept_encodings.best_match(encodings or available_encodings())
+
+def encode(data, encoding, level=6, brotli_quality=5):
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_quality)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+def encode_stream(chunks, encoding, level=6, brotli_quality=5):
+    """Compresses a streamed body chunk by chunk, memory stays flat whatever its length."""
+    if encoding == 'br':
+        packer = brotli.Compressor(quality=brotli_quality)
+        pack, finish = packer.process, packer.finish
+    else:
+        packer = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+        pack, finish = packer.compress, packer.flush
+    for chunk in chunks:
+        data = pack(chunk.encode() if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield finish()
+
+class RouteBytes:
+    def __init__(self):
+        self.responses = 0
+        self.compressed = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+class Compressor:
+    """after_request hook that compresses eligible responses and keeps per-endpoint byte counts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = defaultdict(RouteBytes)
+
+    def init_app(self, app):
+        app.after_request(self._compress)
+
+    def _compress(self, response):
+        config = current_app.config
+        if (not config.get('COMPRESS_ENABLED') or response.mimetype not in config['COMPRESS_MIMETYPES']
+                or response.direct_passthrough or response.is_streamed):
+            return response
+        response.vary.add('Accept-Encoding')
+        if response.status_code != 200 or request.method == 'HEAD' or 'Content-Encoding' in response.headers:
+            return response
+
+        data = response.get_data()
+        encoding = negotiate() if len(data) >= config['COMPRESS_MIN_SIZE'] else None
+        if encoding:
+            response.set_data(encode(data, encoding, config['COMPRESS_LEVEL'], config['COMPRESS_BROTLI_QUALITY']))
+            response.headers['Content-Encoding'] = encoding
+            # Same resource, different bytes: a strong ETag would claim they're identical
+            etag, weak = response.get_etag()
+            if etag and not weak:
+                response.set_etag(etag, weak=True)
+
+        with self._lock:
+            stats = self.routes[request.endpoint or 'unmatched']
+            stats.responses += 1
+            stats.compressed += bool(encoding)
+            stats.raw_bytes += len(data)
+            stats.sent_bytes += response.content_length or 0
+        return response
+
+    def stats(self):
+        """{endpoint: {responses, compressed, raw_bytes, sent_bytes, saved_bytes}}"""
+        with self._lock:
+            return {name: dict(vars(s), saved_bytes=s.raw_bytes - s.sent_bytes) for name, s in sorted(self.routes.items())}
+
+    def render_metrics(self):
+        """Prometheus lines for /metrics (registered as an instrumentation collector)."""
+        lines = ["# HELP studyplanner_response_bytes_total Response body bytes before and after compression.",
+                 "# TYPE studyplanner_response_bytes_total counter"]
+        for name, s in self.stats().items():
+            lines.append(f'studyplanner_response_bytes_total{{endpoint="{name}",stage="raw"}} {s["raw_bytes"]}')
+            lines.append(f'studyplanner_response_bytes_total{{endpoint="{name}",stage="sent"}} {s["sent_bytes"]}')
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self.routes.clear()
+
+compressor = Compressor()
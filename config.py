@@ -0,0 +1,163 @@
+import os
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+"""
+Configuration layer for W Notes+.
+Defaults live in Config (or one of the PROFILES built on it), then get overridden by an optional settings file
+(STUDYPLANNER_SETTINGS=/path/to/settings.py) and STUDYPLANNER_* environment variables.
+"""
+
+class Config:
+    """Default settings. Every key can be overridden without code edits."""
+    SECRET_KEY = 'readingthiskeys'
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///database.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # SQLite connection pragmas, applied on every new connection
+    SQLITE_JOURNAL_MODE = 'WAL'       # readers don't block behind chat posts/task updates
+    SQLITE_SYNCHRONOUS = 'NORMAL'     # safe with WAL, far fewer fsyncs than FULL
+    SQLITE_BUSY_TIMEOUT_MS = 5000     # wait for the write lock instead of "database is locked"
+    SQLITE_MMAP_SIZE = 268435456      # 256MB memory mapped reads
+    SQLITE_CACHE_SIZE = -20000        # negative = KiB, so ~20MB page cache per connection
+    SQLITE_TEMP_STORE = 'MEMORY'      # temp b-trees for ORDER BY/GROUP BY stay off disk
+
+    # Notes stream: reconnect window and keepalive comment interval (seconds)
+    FEED_STREAM_SECONDS = 300
+    FEED_KEEPALIVE_SECONDS = 15
+
+    # Largest request body accepted (413 beyond it), caps the in-request CSV/NDJSON import
+    MAX_CONTENT_LENGTH = 20 * 1024 * 1024
+
+    # archive_history.py moves notes/sessions from whole months older than this into compressed blocks
+    ARCHIVE_AFTER_DAYS = 180
+    ARCHIVE_BATCH_ROWS = 1000  # rows per archive transaction
+
+    # Subjects with more child rows than this are deleted by the background purge worker
+    LARGE_SUBJECT_ROWS = 5000
+
+    # Rendered fragment cache: None = in-process LRU of FRAGMENT_CACHE_SIZE entries,
+    # or a shared backend object / import string with get/set/clear (e.g. cachelib's RedisCache)
+    FRAGMENT_CACHE_BACKEND = None
+    FRAGMENT_CACHE_SIZE = 2000
+
+    # Opt-in per-request timing: Server-Timing headers, slow request log, /metrics
+    INSTRUMENTATION_ENABLED = False
+    INSTRUMENTATION_SLOW_MS = 500
+
+    # Password hashing pool (passwords.py). Changing the method upgrades stored hashes as users sign in.
+    PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+    PASSWORD_POOL_WORKERS = None   # None = one per CPU
+    PASSWORD_POOL_QUEUE = None     # jobs allowed to wait for a worker, None = 4 per worker; beyond that -> 503
+    PASSWORD_POOL_TIMEOUT = 10     # seconds a request waits for its hash before giving up with a 503
+    PASSWORD_POOL_KIND = 'thread'  # or 'process'
+
+    # Durable job queue (jobs.py). Worker threads run inside the web process,
+    # set JOBS_WORKER_THREADS = 0 and run `python worker.py` to keep them out of it
+    JOBS_WORKER_THREADS = 1
+    JOBS_POLL_SECONDS = 1.0          # idle workers re-check this often (enqueues wake them sooner)
+    JOBS_BACKOFF_SECONDS = 2         # first retry delay, doubles every attempt
+    JOBS_MAX_BACKOFF_SECONDS = 600
+    JOBS_STALE_SECONDS = 600         # 'running' for longer than this means its worker died, requeue it
+    JOBS_KEEP_DONE_DAYS = 7          # finished jobs are pruned after this
+    JOBS_OUTBOX_DIR = None           # notification outbox, None = <instance>/outbox
+
+    # Negotiated gzip/brotli for HTML/JSON responses (compression.py), brotli needs the brotli package
+    COMPRESS_ENABLED = True
+    COMPRESS_MIN_SIZE = 1024   # bytes, smaller bodies go out as they are
+    COMPRESS_LEVEL = 6         # gzip
+    COMPRESS_BROTLI_QUALITY = 5
+    COMPRESS_MIMETYPES = ('text/html', 'application/json', 'text/plain', 'text/csv')
+
+    # Fingerprinted static files written by build_assets.py, None = static/dist
+    ASSETS_DIST_DIR = None
+
+    # Pool tuning (ignored for in-memory SQLite, which uses a single shared connection)
+    DB_POOL_SIZE = 5
+    DB_MAX_OVERFLOW = 10
+    DB_POOL_TIMEOUT = 30
+    DB_POOL_RECYCLE = 1800
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+
+class TestingConfig(Config):
+    """Throwaway in-memory database unless the tests point it at a file."""
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SERVER_NAME = 'localhost'
+    # Deliberately weak, a real scrypt per signup/signin would dominate the suite
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    # Tests drain the job queue themselves with job_queue.run_pending()
+    JOBS_WORKER_THREADS = 0
+
+class ProductionConfig(Config):
+    SESSION_COOKIE_SECURE = True
+    PREFERRED_URL_SCHEME = 'https'
+
+# create_app('testing') etc., STUDYPLANNER_PROFILE picks one when none is given
+PROFILES = {
+    'default': Config,
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
+
+def build_engine_options(config):
+    """Turns the DB_* settings into SQLAlchemy engine options suited to the database URI."""
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    options = {'pool_pre_ping': not url.drivername.startswith('sqlite')}
+
+    # In-memory SQLite can't be pooled, Flask-SQLAlchemy picks a static pool for it
+    if url.drivername.startswith('sqlite') and url.database in (None, '', ':memory:'):
+        return options
+
+    options.update({
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+    })
+    if url.drivername.startswith('sqlite'):
+        # Let the busy timeout do the waiting, and allow pooled connections across threads
+        options['connect_args'] = {'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000, 'check_same_thread': False}
+    return options
+
+def load_config(app, profile=None, overrides=None):
+    """Populates app.config from a profile's defaults, settings file, environment and explicit overrides."""
+    profile = profile or os.environ.get('STUDYPLANNER_PROFILE', 'default')
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown config profile: {profile}")
+    app.config.from_object(PROFILES[profile])
+    app.config.from_envvar('STUDYPLANNER_SETTINGS', silent=True)
+    app.config.from_prefixed_env('STUDYPLANNER')
+    if overrides:
+        app.config.update(overrides)
+    # Explicit engine options win, otherwise derive them from the pool settings
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', build_engine_options(app.config))
+
+def sqlite_pragmas(config):
+    """PRAGMA statements for a new connection, built from config values."""
+    return [
+        f"PRAGMA journal_mode = {config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous = {config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA mmap_size = {int(config['SQLITE_MMAP_SIZE'])}",
+        f"PRAGMA cache_size = {int(config['SQLITE_CACHE_SIZE'])}",
+        f"PRAGMA temp_store = {config['SQLITE_TEMP_STORE']}",
+    ]
+
+def register_engine_hooks(app, db):
+    """Hooks the connect event so every pooled SQLite connection gets the pragmas."""
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas(app.config)
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
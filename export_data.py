@@ -0,0 +1,25 @@
+import argparse
+import sys
+from run import create_app
+from model.models import User
+from model.transfer import export_csv, export_ndjson
+
+"""Streams an export to stdout: python export_data.py --format csv [--user NAME] > out.csv"""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export subjects, tasks, notes and sessions.")
+    parser.add_argument('--format', choices=('csv', 'ndjson'), default='ndjson')
+    parser.add_argument('--user', help="only subjects this username can see (default: everything)")
+    args = parser.parse_args()
+
+    app = create_app(routes=False)
+    with app.app_context():
+        user_id = None
+        if args.user:
+            user = User.query.filter_by(username=args.user).first()
+            if not user:
+                sys.exit(f"User '{args.user}' not found.")
+            user_id = user.user_id
+        chunks = export_csv(user_id) if args.format == 'csv' else export_ndjson(user_id)
+        for chunk in chunks:
+            sys.stdout.write(chunk)
@@ -0,0 +1,23 @@
+import argparse
+import sys
+from run import create_app
+from model.models import User
+from model.transfer import import_records, read_records
+
+"""Bulk imports a CSV/NDJSON file for a user: python import_data.py data.csv --user NAME"""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import subjects, tasks, notes and sessions.")
+    parser.add_argument('path')
+    parser.add_argument('--user', required=True, help="username that will own the imported rows")
+    args = parser.parse_args()
+
+    app = create_app(routes=False)
+    with app.app_context():
+        user = User.query.filter_by(username=args.user).first()
+        if not user:
+            sys.exit(f"User '{args.user}' not found.")
+        fmt = 'csv' if args.path.lower().endswith('.csv') else 'ndjson'
+        with open(args.path, encoding='utf-8', newline='') as handle:
+            report = import_records(user.user_id, read_records(handle, fmt))
+        print(report)
@@ -0,0 +1,183 @@
+import json
+import threading
+import time
+from collections import defaultdict
+from flask import g, request, current_app, has_request_context, before_render_template, template_rendered, Response, abort
+from sqlalchemy import event
+
+"""
+Opt-in request instrumentation for W Notes+ (INSTRUMENTATION_ENABLED).
+Engine events and Flask signals record per request: query count, SQL time, slowest statements,
+template render time and total latency. Each response gets a Server-Timing header, slow requests
+log one JSON line, and per-endpoint totals are served at /metrics in Prometheus text format.
+"""
+
+# Prometheus histogram buckets for request latency (seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SLOWEST_KEPT = 3
+
+class RequestStats:
+    """What one request spent its time on."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.slowest = []  # (seconds, statement), longest first
+        self._template_started = []
+
+    def add_query(self, statement, seconds):
+        self.queries += 1
+        self.sql_seconds += seconds
+        self.slowest.append((seconds, statement))
+        self.slowest.sort(key=lambda item: item[0], reverse=True)
+        del self.slowest[SLOWEST_KEPT:]
+
+class EndpointMetrics:
+    """Running totals for one endpoint."""
+
+    def __init__(self):
+        self.requests = defaultdict(int)  # by status code
+        self.seconds = 0.0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.queries = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+class Instrumentation:
+    """Wires the hooks onto an app and its engine. Everything is skipped unless the app opts in."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints = defaultdict(EndpointMetrics)
+        self.collectors = []  # extra fn() -> [lines] appended to /metrics
+
+    def init_app(self, app, db):
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', self._before_cursor)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def _stats(self):
+        """The current request's stats, or None (disabled, background thread, CLI)."""
+        return g.get('_instrumentation') if has_request_context() else None
+
+    def _start(self):
+        if current_app.config.get('INSTRUMENTATION_ENABLED'):
+            g._instrumentation = RequestStats()
+
+    def _before_cursor(self, conn, cursor, statement, params, context, executemany):
+        if self._stats() is not None:
+            conn.info.setdefault('_query_started', []).append(time.perf_counter())
+
+    def _after_cursor(self, conn, cursor, statement, params, context, executemany):
+        stats = self._stats()
+        started = conn.info.get('_query_started')
+        if stats is not None and started:
+            stats.add_query(statement, time.perf_counter() - started.pop())
+
+    def _before_render(self, sender, template, context, **extra):
+        stats = self._stats()
+        if stats is not None:
+            stats._template_started.append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        stats = self._stats()
+        if stats is not None and stats._template_started:
+            stats.template_seconds += time.perf_counter() - stats._template_started.pop()
+
+    def _finish(self, response):
+        stats = self._stats()
+        if stats is None:
+            return response
+        total = time.perf_counter() - stats.started
+        endpoint = request.endpoint or 'unmatched'
+
+        response.headers['Server-Timing'] = ", ".join([
+            f'db;dur={stats.sql_seconds * 1000:.2f};desc="{stats.queries} queries"',
+            f'tpl;dur={stats.template_seconds * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ])
+
+        with self._lock:
+            metrics = self.endpoints[endpoint]
+            metrics.requests[response.status_code] += 1
+            metrics.seconds += total
+            metrics.sql_seconds += stats.sql_seconds
+            metrics.template_seconds += stats.template_seconds
+            metrics.queries += stats.queries
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if total <= bound:
+                    metrics.buckets[i] += 1
+
+        if total * 1000 >= current_app.config.get('INSTRUMENTATION_SLOW_MS', 500):
+            current_app.logger.warning("slow request %s", json.dumps({
+                'endpoint': endpoint,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'total_ms': round(total * 1000, 2),
+                'sql_ms': round(stats.sql_seconds * 1000, 2),
+                'template_ms': round(stats.template_seconds * 1000, 2),
+                'queries': stats.queries,
+                'slowest': [{'ms': round(seconds * 1000, 2), 'sql': " ".join(statement.split())[:300]}
+                            for seconds, statement in stats.slowest],
+            }))
+        return response
+
+    def add_collector(self, fn):
+        """Adds fn() -> list of Prometheus lines to the /metrics output."""
+        if fn not in self.collectors:
+            self.collectors.append(fn)
+
+    def render_metrics(self):
+        """Prometheus text exposition of the per-endpoint totals."""
+        lines = [
+            "# HELP studyplanner_requests_total Requests handled, by endpoint and status.",
+            "# TYPE studyplanner_requests_total counter",
+        ]
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            for name, m in endpoints:
+                for status, count in sorted(m.requests.items()):
+                    lines.append(f'studyplanner_requests_total{{endpoint="{name}",status="{status}"}} {count}')
+
+            lines += ["# HELP studyplanner_request_duration_seconds Request latency.",
+                      "# TYPE studyplanner_request_duration_seconds histogram"]
+            for name, m in endpoints:
+                count = sum(m.requests.values())
+                for bound, bucket in zip(LATENCY_BUCKETS, m.buckets):
+                    lines.append(f'studyplanner_request_duration_seconds_bucket{{endpoint="{name}",le="{bound}"}} {bucket}')
+                lines.append(f'studyplanner_request_duration_seconds_bucket{{endpoint="{name}",le="+Inf"}} {count}')
+                lines.append(f'studyplanner_request_duration_seconds_sum{{endpoint="{name}"}} {m.seconds:.6f}')
+                lines.append(f'studyplanner_request_duration_seconds_count{{endpoint="{name}"}} {count}')
+
+            for metric, attr, help_text in (
+                    ('studyplanner_db_queries_total', 'queries', "SQL statements executed."),
+                    ('studyplanner_db_seconds_total', 'sql_seconds', "Time spent in SQL."),
+                    ('studyplanner_template_seconds_total', 'template_seconds', "Time spent rendering templates.")):
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+                for name, m in endpoints:
+                    value = getattr(m, attr)
+                    lines.append(f'{metric}{{endpoint="{name}"}} {value if isinstance(value, int) else f"{value:.6f}"}')
+        for collector in self.collectors:
+            lines += collector()
+        return "\n".join(lines) + "\n"
+
+    def metrics_view(self):
+        """/metrics, only there when instrumentation is switched on."""
+        if not current_app.config.get('INSTRUMENTATION_ENABLED'):
+            abort(404)
+        return Response(self.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+    def reset(self):
+        with self._lock:
+            self.endpoints.clear()
+
+instrumentation = Instrumentation()
@@ -0,0 +1,306 @@
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from flask import current_app
+from sqlalchemy import event, func, update, delete
+from sqlalchemy.orm import Session
+from werkzeug.utils import import_string
+from extensions import db
+from model.models import Job, get_nzt_now
+from model.analytics import dialect_insert
+
+"""
+Durable background jobs for W Notes+.
+Write routes enqueue follow-up work into the job table inside their own transaction, so a job exists
+exactly when the write committed, and return straight away. Worker threads started with the app (or
+worker.py as its own process) claim due jobs, run the handler and retry failures with exponential backoff.
+Jobs of one kind are claimed together, up to the handler's batch size.
+Delivery is at-least-once: a worker that dies mid-job has it requeued, so handlers must be safe to re-run.
+"""
+
+# Modules that register handlers, imported by anything that runs jobs
+HANDLER_MODULES = (
+    'model.deletion',
+    'model.notifications',
+)
+
+DEFAULT_MAX_ATTEMPTS = 5
+SWEEP_SECONDS = 60  # how often a worker requeues stale jobs and prunes finished ones
+
+def _now():
+    """Naive NZ time, the same shape SQLite hands DateTime columns back in."""
+    return get_nzt_now().replace(tzinfo=None)
+
+def load_handlers():
+    for module in HANDLER_MODULES:
+        import_string(module)
+
+class Handler:
+    def __init__(self, fn, batch_size, max_attempts):
+        self.fn = fn
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+
+class KindMetrics:
+    """Running totals for one job kind in this process."""
+
+    def __init__(self):
+        self.batches = 0
+        self.succeeded = 0
+        self.retried = 0
+        self.failed = 0
+        self.run_seconds = 0.0
+        self.latency_seconds = 0.0  # enqueue -> done, summed over succeeded jobs
+        self.latency_max = 0.0
+
+class JobQueue:
+    """Enqueue, claim and run jobs stored in the job table."""
+
+    def __init__(self):
+        self.handlers = {}
+        self.metrics = defaultdict(KindMetrics)
+        self.poll_seconds = 1.0
+        self.backoff_seconds = 2
+        self.max_backoff_seconds = 600
+        self.stale_seconds = 600
+        self.keep_done_days = 7
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def init_app(self, app):
+        self.poll_seconds = app.config.get('JOBS_POLL_SECONDS', 1.0)
+        self.backoff_seconds = app.config.get('JOBS_BACKOFF_SECONDS', 2)
+        self.max_backoff_seconds = app.config.get('JOBS_MAX_BACKOFF_SECONDS', 600)
+        self.stale_seconds = app.config.get('JOBS_STALE_SECONDS', 600)
+        self.keep_done_days = app.config.get('JOBS_KEEP_DONE_DAYS', 7)
+
+    def handler(self, kind, batch_size=1, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        Registers fn(payloads) for a job kind. It always gets a list of payload dicts,
+        up to batch_size of them, and should raise to have the whole batch retried.
+        """
+        def register(fn):
+            self.handlers[kind] = Handler(fn, batch_size, max_attempts)
+            return fn
+        return register
+
+    def enqueue(self, kind, payload=None, key=None, delay=0):
+        """
+        Adds a job in the caller's session, it commits or rolls back with the route's own changes.
+        A job with an idempotency key is only ever stored once, repeats are ignored.
+        """
+        now = _now()
+        stmt = dialect_insert(Job.__table__).values(
+            kind=kind, payload=json.dumps(payload or {}), idempotency_key=key, status='queued',
+            attempts=0, run_at=now + timedelta(seconds=delay), created_at=now)
+        if key is not None:
+            stmt = stmt.on_conflict_do_nothing(index_elements=['idempotency_key'])
+        db.session.execute(stmt)
+        # Picked up by the after_commit hook below to wake the workers
+        db.session.info['jobs_enqueued'] = True
+
+    def claim(self):
+        """Marks the next due batch (one kind, oldest first) as running. Returns (kind, rows)."""
+        now = _now()
+        kind = db.session.execute(
+            db.select(Job.kind)
+            .where(Job.status == 'queued', Job.run_at <= now, Job.kind.in_(list(self.handlers)))
+            .order_by(Job.run_at, Job.job_id)
+            .limit(1)).scalar()
+        # End the read so the claim below starts from the latest snapshot
+        db.session.commit()
+        if kind is None:
+            return None, []
+
+        due = (db.select(Job.job_id)
+               .where(Job.status == 'queued', Job.run_at <= now, Job.kind == kind)
+               .order_by(Job.run_at, Job.job_id)
+               .limit(self.handlers[kind].batch_size))
+        # status = 'queued' again in the UPDATE, so two workers can never claim the same job
+        rows = db.session.execute(
+            update(Job)
+            .where(Job.job_id.in_(due), Job.status == 'queued')
+            .values(status='running', started_at=now, attempts=Job.attempts + 1)
+            .returning(Job.job_id, Job.payload, Job.created_at, Job.attempts)
+            .execution_options(synchronize_session=False)).all()
+        db.session.commit()
+        return kind, rows
+
+    def run_once(self):
+        """Claims and runs one batch. Returns how many jobs it ran."""
+        kind, rows = self.claim()
+        if not rows:
+            return 0
+        handler = self.handlers[kind]
+        ids = [row.job_id for row in rows]
+        started = time.perf_counter()
+        try:
+            handler.fn([json.loads(row.payload) for row in rows])
+            # Handler writes and the done mark commit together
+            finished = _now()
+            db.session.execute(update(Job).where(Job.job_id.in_(ids))
+                               .values(status='done', finished_at=finished, last_error=None)
+                               .execution_options(synchronize_session=False))
+            db.session.commit()
+        except Exception as error:
+            db.session.rollback()
+            current_app.logger.exception("Job batch %s %s failed", kind, ids)
+            self._retry_or_fail(kind, handler, rows, error)
+        else:
+            with self._lock:
+                metrics = self.metrics[kind]
+                metrics.succeeded += len(rows)
+                for row in rows:
+                    latency = (finished - row.created_at).total_seconds()
+                    metrics.latency_seconds += latency
+                    metrics.latency_max = max(metrics.latency_max, latency)
+        with self._lock:
+            self.metrics[kind].batches += 1
+            self.metrics[kind].run_seconds += time.perf_counter() - started
+        return len(rows)
+
+    def _retry_or_fail(self, kind, handler, rows, error):
+        """Requeues each job with exponential backoff (plus jitter), or fails it after max_attempts."""
+        now = _now()
+        message = f"{type(error).__name__}: {error}"[:1000]
+        retried = failed = 0
+        for row in rows:
+            if row.attempts >= handler.max_attempts:
+                values = {'status': 'failed', 'finished_at': now}
+                failed += 1
+            else:
+                delay = min(self.backoff_seconds * 2 ** (row.attempts - 1), self.max_backoff_seconds)
+                values = {'status': 'queued', 'run_at': now + timedelta(seconds=delay * random.uniform(1, 1.25))}
+                retried += 1
+            db.session.execute(update(Job).where(Job.job_id == row.job_id)
+                               .values(last_error=message, **values)
+                               .execution_options(synchronize_session=False))
+        db.session.commit()
+        with self._lock:
+            self.metrics[kind].retried += retried
+            self.metrics[kind].failed += failed
+
+    def run_pending(self, max_batches=None):
+        """Runs due jobs until none are left (or max_batches). Returns how many jobs ran."""
+        total = batches = 0
+        while max_batches is None or batches < max_batches:
+            ran = self.run_once()
+            if not ran:
+                break
+            total += ran
+            batches += 1
+        return total
+
+    def sweep(self):
+        """Requeues jobs stuck in 'running' (their worker died) and prunes old finished ones."""
+        now = _now()
+        requeued = db.session.execute(
+            update(Job)
+            .where(Job.status == 'running', Job.started_at < now - timedelta(seconds=self.stale_seconds))
+            .values(status='queued', run_at=now)
+            .execution_options(synchronize_session=False)).rowcount
+        pruned = db.session.execute(
+            delete(Job)
+            .where(Job.status == 'done', Job.finished_at < now - timedelta(days=self.keep_done_days))
+            .execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+        return requeued, pruned
+
+    def start(self, app, threads=None):
+        """Starts worker threads (JOBS_WORKER_THREADS unless given) that run jobs until stop()."""
+        load_handlers()
+        count = app.config.get('JOBS_WORKER_THREADS', 1) if threads is None else threads
+        with self._lock:
+            self._stop.clear()
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), count):
+                thread = threading.Thread(target=self._work, args=(app,), name=f'jobs-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _work(self, app):
+        last_sweep = 0
+        # Give the app a moment to finish starting (run.py creates the tables after create_app)
+        self._stop.wait(self.poll_seconds)
+        while not self._stop.is_set():
+            with app.app_context():
+                try:
+                    if time.monotonic() - last_sweep > SWEEP_SECONDS:
+                        self.sweep()
+                        last_sweep = time.monotonic()
+                    ran = self.run_once()
+                except Exception:
+                    app.logger.exception("Job worker loop failed")
+                    db.session.rollback()
+                    ran = 0
+            if not ran:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+
+    def depth(self):
+        """{kind: {status: count}} for unfinished and failed jobs, plus the oldest queued job's age in seconds."""
+        counts = defaultdict(dict)
+        for kind, status, count in (db.session.query(Job.kind, Job.status, func.count())
+                                    .filter(Job.status.in_(('queued', 'running', 'failed')))
+                                    .group_by(Job.kind, Job.status)):
+            counts[kind][status] = count
+        oldest = db.session.query(func.min(Job.created_at)).filter(Job.status == 'queued').scalar()
+        age = (_now() - oldest).total_seconds() if oldest else 0.0
+        return dict(counts), age
+
+    def stats(self):
+        """Queue depth from the table and this process's per-kind totals, as plain dicts."""
+        counts, oldest_age = self.depth()
+        with self._lock:
+            kinds = {kind: dict(vars(m)) for kind, m in self.metrics.items()}
+        return {'depth': counts, 'oldest_queued_seconds': round(oldest_age, 3), 'kinds': kinds}
+
+    def render_metrics(self):
+        """Prometheus lines for /metrics (registered as an instrumentation collector)."""
+        stats = self.stats()
+        lines = ["# HELP studyplanner_jobs Jobs in the table by kind and status.", "# TYPE studyplanner_jobs gauge"]
+        for kind, statuses in sorted(stats['depth'].items()):
+            for status, count in sorted(statuses.items()):
+                lines.append(f'studyplanner_jobs{{kind="{kind}",status="{status}"}} {count}')
+        lines += ["# HELP studyplanner_jobs_oldest_queued_seconds Age of the oldest queued job.",
+                  "# TYPE studyplanner_jobs_oldest_queued_seconds gauge",
+                  f"studyplanner_jobs_oldest_queued_seconds {stats['oldest_queued_seconds']}"]
+        for metric, attr, kind_of, help_text in (
+                ('studyplanner_jobs_succeeded_total', 'succeeded', 'counter', "Jobs finished."),
+                ('studyplanner_jobs_retried_total', 'retried', 'counter', "Failed attempts that were requeued."),
+                ('studyplanner_jobs_failed_total', 'failed', 'counter', "Jobs that ran out of attempts."),
+                ('studyplanner_jobs_latency_seconds_total', 'latency_seconds', 'counter', "Enqueue to done, summed."),
+                ('studyplanner_jobs_latency_max_seconds', 'latency_max', 'gauge', "Slowest enqueue to done.")):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind_of}"]
+            for kind, m in sorted(stats['kinds'].items()):
+                value = m[attr]
+                lines.append(f'{metric}{{kind="{kind}"}} {value if isinstance(value, int) else f"{value:.6f}"}')
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self.metrics.clear()
+
+job_queue = JobQueue()
+
+@event.listens_for(Session, 'after_commit')
+def _wake_workers(session):
+    """Jobs are only visible once the route commits, so that's when idle workers get woken."""
+    if session.info.pop('jobs_enqueued', False):
+        job_queue._wake.set()
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_enqueued(session):
+    session.info.pop('jobs_enqueued', None)
@@ -0,0 +1,178 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+from run import create_app
+from extensions import db
+from model.models import lookup_data, Subject, StudyRollup, Job, ArchiveBlock, username_key
+from model.counters import REBUILD_SQL
+from model.search import install_search
+
+"""
+In-place schema migrations for W Notes+.
+Applies versioned changes to an existing database instead of reset_db's drop and recreate.
+The applied version is tracked in SQLite's PRAGMA user_version.
+"""
+
+def add_column(table, column, ddl):
+    """Migration step adding a column unless it's already there (ALTER TABLE has no IF NOT EXISTS)."""
+    def step(conn):
+        existing = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+        if column not in existing:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return step
+
+def create_table(model):
+    """Migration step creating a model's table (and its indexes) if missing."""
+    def step(conn):
+        model.__table__.create(conn, checkfirst=True)
+    return step
+
+def backfill_username_keys(conn):
+    """
+    Sets username_key with the same username_key() new rows get. SQL lower()/trim() would differ
+    for non-ASCII names (SQLite's lower() only folds A-Z), leaving them out of prefix autocomplete.
+    """
+    rows = conn.execute(text("SELECT user_id, username, username_key FROM user")).all()
+    changed = [{'user_id': user_id, 'key': username_key(username)}
+               for user_id, username, key in rows if key != username_key(username)]
+    if changed:
+        conn.execute(text("UPDATE user SET username_key = :key WHERE user_id = :user_id"), changed)
+
+# Tables whose rows keep a subject_id, a deleted subject's id may live on in them until purged
+SUBJECT_ID_TABLES = ('task', 'message', 'study_session', 'subject_member', 'study_rollup', 'archive_block')
+
+def rebuild_subject_autoincrement(conn):
+    """
+    Recreates subject with AUTOINCREMENT (SQLite can't ALTER it in): new table, copy, drop, rename.
+    The sequence starts past every id still referenced anywhere, so hidden subjects' ids stay retired.
+    """
+    ddl = str(CreateTable(Subject.__table__).compile(dialect=conn.dialect))
+    conn.execute(text(ddl.replace("CREATE TABLE subject (", "CREATE TABLE subject_new (", 1)))
+    existing = [row[1] for row in conn.execute(text("PRAGMA table_info(subject)"))]
+    columns = ", ".join(c.name for c in Subject.__table__.columns if c.name in existing)
+    conn.execute(text(f"INSERT INTO subject_new ({columns}) SELECT {columns} FROM subject"))
+    conn.execute(text("DROP TABLE subject"))
+    conn.execute(text("ALTER TABLE subject_new RENAME TO subject"))
+    for index in Subject.__table__.indexes:
+        index.create(conn)
+    high = conn.execute(text("SELECT MAX(subject_id) FROM (" + " UNION ALL ".join(
+        f"SELECT MAX(subject_id) AS subject_id FROM {table}" for table in ('subject',) + SUBJECT_ID_TABLES) + ")")).scalar()
+    conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'subject'"))
+    conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('subject', :seq)"), {'seq': high or 0})
+
+# (version, description, steps) - steps are SQL strings or callables taking the connection.
+# Append new migrations to the end, never edit old ones.
+MIGRATIONS = [
+    (1, "indexes for hot foreign key filters + unique memberships", [
+        "CREATE INDEX IF NOT EXISTS ix_subject_user ON subject (user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_task_subject_status ON task (subject_id, status_id)",
+        "CREATE INDEX IF NOT EXISTS ix_message_subject_timestamp ON message (subject_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS ix_study_session_subject_timestamp ON study_session (subject_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS ix_subject_member_user_status ON subject_member (user_id, status)",
+        # Old check-then-insert invites could race, keep the accepted row (or the oldest) per pair
+        """DELETE FROM subject_member WHERE id NOT IN (
+               SELECT COALESCE(MIN(CASE WHEN status = 'accepted' THEN id END), MIN(id))
+               FROM subject_member GROUP BY user_id, subject_id)""",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_subject_member_user_subject ON subject_member (user_id, subject_id)",
+    ]),
+    (2, "denormalized per-subject counters", [
+        add_column('subject', 'active_task_count', "INTEGER NOT NULL DEFAULT 0"),
+        add_column('subject', 'completed_task_count', "INTEGER NOT NULL DEFAULT 0"),
+        add_column('subject', 'study_minutes', "INTEGER NOT NULL DEFAULT 0"),
+        add_column('subject', 'message_count', "INTEGER NOT NULL DEFAULT 0"),
+        add_column('subject', 'last_activity', "DATETIME"),
+        REBUILD_SQL,
+    ]),
+    # run backfill_analytics.py afterwards to fill the rollups from existing rows
+    (3, "study analytics rollups", [
+        add_column('study_session', 'user_id', "INTEGER REFERENCES user (user_id)"),
+        add_column('task', 'completed_at', "DATETIME"),
+        create_table(StudyRollup),
+    ]),
+    (4, "full-text search over tasks and notes", [
+        install_search,
+    ]),
+    (5, "due date index for the agenda", [
+        "CREATE INDEX IF NOT EXISTS ix_task_status_due ON task (status_id, due_date)",
+    ]),
+    (6, "study planner effort estimates and daily budget", [
+        add_column('task', 'estimated_minutes', "INTEGER"),
+        add_column('user', 'daily_study_minutes', "INTEGER"),
+    ]),
+    (7, "calendar feed tokens", [
+        add_column('user', 'calendar_token', "VARCHAR(64)"),
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_user_calendar_token ON user (calendar_token)",
+    ]),
+    # in-process fragment caches start empty on restart; clear a shared FRAGMENT_CACHE_BACKEND after this
+    (8, "subject version stamps for page ETags and fragment caching", [
+        add_column('subject', 'version', "INTEGER NOT NULL DEFAULT 0"),
+    ]),
+    (9, "lowercased username key for invite autocomplete", [
+        add_column('user', 'username_key', "VARCHAR(20)"),
+        backfill_username_keys,
+        "CREATE INDEX IF NOT EXISTS ix_user_username_key ON user (username_key)",
+    ]),
+    (10, "durable background job queue", [
+        create_table(Job),
+    ]),
+    # run archive_history.py afterwards to move old notes/sessions out of the live tables
+    (11, "compressed monthly archive of old notes and sessions", [
+        create_table(ArchiveBlock),
+    ]),
+    # clear a shared FRAGMENT_CACHE_BACKEND afterwards, it may hold fragments of reused ids
+    (12, "never reuse subject ids", [
+        rebuild_subject_autoincrement,
+    ]),
+    # version 9 used to fill the keys with SQL lower(trim()), recompute them for databases it already ran on
+    (13, "username keys for non-ASCII usernames", [
+        backfill_username_keys,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def get_version(conn):
+    """Reads the schema version stored in the database header."""
+    return conn.execute(text("PRAGMA user_version")).scalar()
+
+def set_version(conn, version):
+    """PRAGMA can't take bound params, version is always an int from MIGRATIONS."""
+    conn.execute(text(f"PRAGMA user_version = {int(version)}"))
+
+def stamp_latest():
+    """Marks a freshly created schema (create_all) as fully migrated."""
+    with db.engine.begin() as conn:
+        set_version(conn, LATEST_VERSION)
+
+def upgrade():
+    """
+    Brings the database up to LATEST_VERSION.
+    Empty databases are built with create_all, existing ones get each pending migration in its own transaction.
+    Returns the list of versions applied.
+    """
+    if not inspect(db.engine).has_table('subject'):
+        db.create_all()
+        stamp_latest()
+        lookup_data()
+        return [version for version, _, _ in MIGRATIONS]
+
+    applied = []
+    for version, description, steps in MIGRATIONS:
+        with db.engine.begin() as conn:
+            if get_version(conn) >= version:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(text(step))
+            set_version(conn, version)
+        applied.append(version)
+        print(f"Applied migration {version}: {description}")
+    return applied
+
+if __name__ == "__main__":
+    app = create_app(routes=False)
+    with app.app_context():
+        done = upgrade()
+        if not done:
+            print(f"Database already at version {LATEST_VERSION}.")
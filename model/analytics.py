@@ -0,0 +1,249 @@
+from datetime import timedelta
+from sqlalchemy import func, select, insert, delete, Table, MetaData, Column, Integer, String, Date, Index
+from sqlalchemy.dialects import sqlite
+from extensions import db
+from model.models import Subject, StudySession, StudyRollup, Task, get_nzt_now
+from model.archive import iter_archived
+
+"""
+Study analytics for W Notes+.
+log_session and complete_task add to daily + weekly rollup buckets as they write,
+so the stats page reads a handful of pre-aggregated rows instead of scanning raw sessions.
+"""
+
+PERIODS = ('day', 'week')
+BACKFILL_BATCH_SIZE = 1000
+
+# backfill_rollups builds here and swaps it in at the end, so /stats keeps the old numbers meanwhile.
+# Own MetaData: never part of create_all, created and dropped by the backfill.
+ROLLUP_COLUMNS = ('user_id', 'subject_id', 'period', 'period_start', 'minutes', 'sessions', 'tasks_completed')
+rollup_staging = Table(
+    'study_rollup_staging', MetaData(),
+    Column('user_id', Integer, nullable=False),
+    Column('subject_id', Integer, nullable=False),
+    Column('period', String(4), nullable=False),
+    Column('period_start', Date, nullable=False),
+    Column('minutes', Integer, nullable=False, default=0),
+    Column('sessions', Integer, nullable=False, default=0),
+    Column('tasks_completed', Integer, nullable=False, default=0),
+    Index('uq_study_rollup_staging_bucket', 'user_id', 'period', 'period_start', 'subject_id', unique=True),
+)
+
+def period_start(period, day):
+    """Bucket key for a date: the day itself, or the Monday of its week."""
+    return day if period == 'day' else day - timedelta(days=day.weekday())
+
+def dialect_insert(table):
+    """Dialect insert that supports ON CONFLICT (SQLite and Postgres)."""
+    if db.engine.dialect.name == 'postgresql':
+        # Slow import, only paid on Postgres deployments
+        from sqlalchemy.dialects import postgresql
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+def add_to_rollups(buckets, table=None):
+    """
+    Upserts {(user_id, subject_id, day): (minutes, sessions, tasks_completed)} into every period.
+    Existing buckets are incremented in place, so this is safe to call per write or per batch.
+    table defaults to study_rollup (the backfill passes its staging table).
+    """
+    rows = {}
+    for (user_id, subject_id, day), (minutes, sessions, tasks_completed) in buckets.items():
+        for period in PERIODS:
+            key = (user_id, subject_id, period, period_start(period, day))
+            current = rows.get(key, (0, 0, 0))
+            rows[key] = (current[0] + minutes, current[1] + sessions, current[2] + tasks_completed)
+    if not rows:
+        return 0
+
+    table = StudyRollup.__table__ if table is None else table
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'period', 'period_start', 'subject_id'],
+        set_={
+            'minutes': table.c.minutes + stmt.excluded.minutes,
+            'sessions': table.c.sessions + stmt.excluded.sessions,
+            'tasks_completed': table.c.tasks_completed + stmt.excluded.tasks_completed,
+        })
+    db.session.execute(stmt, [
+        {'user_id': u, 'subject_id': s, 'period': p, 'period_start': start,
+         'minutes': m, 'sessions': n, 'tasks_completed': t}
+        for (u, s, p, start), (m, n, t) in rows.items()
+    ])
+    return len(rows)
+
+def record_session(user_id, subject_id, minutes, when=None):
+    """Called by log_session inside its transaction."""
+    day = (when or get_nzt_now()).date()
+    add_to_rollups({(user_id, subject_id, day): (minutes, 1, 0)})
+
+def record_completion(user_id, subject_id, when=None):
+    """Called by complete_task inside its transaction."""
+    day = (when or get_nzt_now()).date()
+    add_to_rollups({(user_id, subject_id, day): (0, 0, 1)})
+
+def _streaks(active_days, today):
+    """(current, longest) runs of consecutive active days. Current counts if the run reaches today or yesterday."""
+    longest = run = 0
+    previous = None
+    for day in sorted(active_days):
+        run = run + 1 if previous and day - previous == timedelta(days=1) else 1
+        longest = max(longest, run)
+        previous = day
+    current = run if previous and (today - previous).days <= 1 else 0
+    return current, longest
+
+def get_user_stats(user_id, days=14, weeks=8, today=None):
+    """Dashboard numbers for one user, read only from rollup rows."""
+    today = today or get_nzt_now().date()
+    day_from = today - timedelta(days=days - 1)
+    week_from = period_start('week', today) - timedelta(weeks=weeks - 1)
+
+    # Daily series across all subjects
+    daily_rows = (db.session.query(StudyRollup.period_start,
+                                   func.sum(StudyRollup.minutes),
+                                   func.sum(StudyRollup.sessions),
+                                   func.sum(StudyRollup.tasks_completed))
+                  .filter(StudyRollup.user_id == user_id, StudyRollup.period == 'day',
+                          StudyRollup.period_start >= day_from)
+                  .group_by(StudyRollup.period_start)
+                  .all())
+    by_day = {row[0]: row[1:] for row in daily_rows}
+    daily = []
+    for offset in range(days):
+        day = day_from + timedelta(days=offset)
+        minutes, sessions, tasks_done = by_day.get(day, (0, 0, 0))
+        daily.append({'day': day.isoformat(), 'minutes': minutes, 'sessions': sessions, 'tasks_completed': tasks_done})
+
+    # Weekly totals per subject
+    weekly_rows = (db.session.query(StudyRollup.period_start, Subject.subject_id, Subject.name,
+                                    StudyRollup.minutes, StudyRollup.sessions, StudyRollup.tasks_completed)
+                   .join(Subject, Subject.subject_id == StudyRollup.subject_id)
+                   .filter(StudyRollup.user_id == user_id, StudyRollup.period == 'week',
+                           StudyRollup.period_start >= week_from)
+                   .order_by(StudyRollup.period_start.desc(), Subject.name)
+                   .all())
+    weekly = [{'week_start': r[0].isoformat(), 'subject_id': r[1], 'subject': r[2],
+               'minutes': r[3], 'sessions': r[4], 'tasks_completed': r[5]} for r in weekly_rows]
+
+    # Streaks look at every active day the user has ever had (one small row per day)
+    active_days = [row[0] for row in
+                   db.session.query(StudyRollup.period_start)
+                   .filter(StudyRollup.user_id == user_id, StudyRollup.period == 'day')
+                   .group_by(StudyRollup.period_start)
+                   .having((func.sum(StudyRollup.minutes) + func.sum(StudyRollup.tasks_completed)) > 0)
+                   .all()]
+    current_streak, longest_streak = _streaks(active_days, today)
+
+    return {
+        'totals': {
+            'minutes': sum(d['minutes'] for d in daily),
+            'sessions': sum(d['sessions'] for d in daily),
+            'tasks_completed': sum(d['tasks_completed'] for d in daily),
+            'days': days,
+        },
+        'daily': daily,
+        'weekly': weekly,
+        'current_streak': current_streak,
+        'longest_streak': longest_streak,
+    }
+
+def _fold_sessions(rows, buckets):
+    """Adds (user_id, subject_id, timestamp, duration) rows to day buckets."""
+    for user_id, subject_id, timestamp, duration in rows:
+        key = (user_id, subject_id, timestamp.date())
+        minutes, sessions, tasks_done = buckets.get(key, (0, 0, 0))
+        buckets[key] = (minutes + (duration or 0), sessions + 1, tasks_done)
+    return buckets
+
+def _fold_completions(rows, buckets):
+    """Adds (user_id, subject_id, completed_at) rows to day buckets."""
+    for user_id, subject_id, completed_at in rows:
+        key = (user_id, subject_id, completed_at.date())
+        minutes, sessions, tasks_done = buckets.get(key, (0, 0, 0))
+        buckets[key] = (minutes, sessions, tasks_done + 1)
+    return buckets
+
+def _session_rows(query):
+    # Older sessions have no user_id, credit the subject owner
+    return (query.with_entities(func.coalesce(StudySession.user_id, Subject.user_id), StudySession.subject_id,
+                                StudySession.timestamp, StudySession.duration)
+            .join(Subject, Subject.subject_id == StudySession.subject_id))
+
+def _completed_tasks():
+    return (db.session.query(Task.user_id, Task.subject_id, Task.completed_at)
+            .filter(Task.status_id == 2, Task.completed_at.isnot(None)))
+
+def backfill_rollups(batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Rebuilds every rollup from raw sessions (live and archived) and completed tasks.
+    Raw rows are read in keyset batches and folded into a staging table, so memory stays flat and
+    /stats keeps serving the old rollups until one short transaction swaps the new ones in.
+    Sessions after the high-water id and completions from after the start are left to the live
+    record_session/record_completion calls while it runs, and picked up again at the swap.
+    Tasks reopened while it runs may stay counted until the next rebuild.
+    Completed tasks without completed_at (from before it existed) can't be dated and are skipped.
+    Returns the number of raw rows processed.
+    """
+    started = get_nzt_now().replace(tzinfo=None)
+    high_water = db.session.query(func.max(StudySession.id)).scalar() or 0
+    connection = db.session.connection()
+    rollup_staging.drop(connection, checkfirst=True)  # left over from an interrupted run
+    rollup_staging.create(connection)
+    db.session.commit()
+    processed = 0
+
+    last_id = 0
+    while last_id < high_water:
+        batch = (_session_rows(db.session.query(StudySession))
+                 .filter(StudySession.id > last_id, StudySession.id <= high_water)
+                 .order_by(StudySession.id)
+                 .limit(batch_size)
+                 .add_columns(StudySession.id)
+                 .all())
+        if not batch:
+            break
+        add_to_rollups(_fold_sessions((row[:4] for row in batch), {}), rollup_staging)
+        db.session.commit()
+        processed += len(batch)
+        last_id = batch[-1][4]
+
+    # Archived sessions (their user_id was resolved when they were archived)
+    buckets = {}
+    for subject_id, row in iter_archived('session'):
+        _fold_sessions([(row.user_id, subject_id, row.timestamp, row.duration)], buckets)
+        processed += 1
+        if len(buckets) >= batch_size:
+            add_to_rollups(buckets, rollup_staging)
+            db.session.commit()
+            buckets = {}
+    add_to_rollups(buckets, rollup_staging)
+    db.session.commit()
+
+    # Completed tasks
+    last_id = 0
+    while True:
+        batch = (_completed_tasks()
+                 .add_columns(Task.task_id)
+                 .filter(Task.task_id > last_id, Task.completed_at < started)
+                 .order_by(Task.task_id)
+                 .limit(batch_size)
+                 .all())
+        if not batch:
+            break
+        add_to_rollups(_fold_completions((row[:3] for row in batch), {}), rollup_staging)
+        db.session.commit()
+        processed += len(batch)
+        last_id = batch[-1][3]
+
+    # Swap: staged rollups (minus subjects deleted meanwhile) plus whatever was written live since the start
+    db.session.execute(delete(StudyRollup))
+    db.session.execute(insert(StudyRollup.__table__).from_select(
+        ROLLUP_COLUMNS, select(*(rollup_staging.c[name] for name in ROLLUP_COLUMNS))
+        .where(rollup_staging.c.subject_id.in_(select(Subject.subject_id)))))
+    late = _fold_sessions(_session_rows(db.session.query(StudySession)).filter(StudySession.id > high_water), {})
+    add_to_rollups(_fold_completions(_completed_tasks().filter(Task.completed_at >= started), late))
+    db.session.commit()
+    rollup_staging.drop(db.session.connection())
+    db.session.commit()
+    return processed
@@ -0,0 +1,195 @@
+import json
+from collections import namedtuple
+from datetime import date, datetime
+from sqlalchemy import select, func, case, tuple_
+from extensions import db
+from model.models import Subject, Task, Tag, Priority, Color, Message, StudySession, User, task_tags
+from model.queries import visible_subject_ids, encode_time_cursor, decode_time_cursor
+from utils import parse_positive_int
+
+"""
+Read-only JSON API queries for W Notes+ (served by routes/api.py).
+Each list is one Core select of just the requested columns - no ORM objects, no relationship loads -
+keyset paged and serialized row by row off a server-side cursor, so a page costs the same however
+big the tables get. Only live notes/sessions are listed, archived months stay in the archive (the export has them).
+"""
+
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+API_CHUNK_ROWS = 100  # rows fetched and written out per chunk
+TAG_SEPARATOR = ';'
+
+class ApiError(ValueError):
+    """Bad fields/cursor/filter in an API request, shown to the client as a 400."""
+
+# fields: name -> (column expression, join it needs or None). key/timestamp drive the keyset order:
+# id ascending, or newest first by (timestamp, id) for the timestamped feeds.
+Resource = namedtuple('Resource', 'table fields default key timestamp subject_col joins')
+
+def _task_tags():
+    """Tag names of the outer task row, one correlated group_concat instead of loading Task.tags."""
+    return (select(func.group_concat(Tag.name, TAG_SEPARATOR))
+            .join(task_tags, task_tags.c.tag_id == Tag.tag_id)
+            .where(task_tags.c.task_id == Task.task_id)
+            .scalar_subquery())
+
+RESOURCES = {
+    'subjects': Resource(
+        table=Subject,
+        fields={
+            'id': (Subject.subject_id, None),
+            'name': (Subject.name, None),
+            'color': (Color.hex_code, 'color'),
+            'owner_id': (Subject.user_id, None),
+            'active_tasks': (Subject.active_task_count, None),
+            'completed_tasks': (Subject.completed_task_count, None),
+            'study_minutes': (Subject.study_minutes, None),
+            'notes': (Subject.message_count, None),
+            'last_activity': (Subject.last_activity, None),
+            'version': (Subject.version, None),
+        },
+        default=('id', 'name', 'color', 'owner_id', 'active_tasks', 'completed_tasks', 'last_activity'),
+        key=Subject.subject_id, timestamp=None, subject_col=Subject.subject_id,
+        joins={'color': (Color, Color.id == Subject.color_id)}),
+    'tasks': Resource(
+        table=Task,
+        fields={
+            'id': (Task.task_id, None),
+            'subject_id': (Task.subject_id, None),
+            'title': (Task.title, None),
+            'description': (Task.description, None),
+            'due_date': (Task.due_date, None),
+            'status': (case((Task.status_id == 2, 'completed'), else_='pending'), None),
+            'priority': (Priority.level, 'priority'),
+            'estimated_minutes': (Task.estimated_minutes, None),
+            'completed_at': (Task.completed_at, None),
+            'tags': (_task_tags(), None),
+        },
+        default=('id', 'subject_id', 'title', 'due_date', 'status', 'priority', 'tags'),
+        key=Task.task_id, timestamp=None, subject_col=Task.subject_id,
+        joins={'priority': (Priority, Priority.id == Task.priority_id)}),
+    'notes': Resource(
+        table=Message,
+        fields={
+            'id': (Message.message_id, None),
+            'subject_id': (Message.subject_id, None),
+            'sender_id': (Message.sender_id, None),
+            'sender': (User.username, 'sender'),
+            'content': (Message.content, None),
+            'timestamp': (Message.timestamp, None),
+        },
+        default=('id', 'subject_id', 'sender', 'content', 'timestamp'),
+        key=Message.message_id, timestamp=Message.timestamp, subject_col=Message.subject_id,
+        joins={'sender': (User, User.user_id == Message.sender_id)}),
+    'sessions': Resource(
+        table=StudySession,
+        fields={
+            'id': (StudySession.id, None),
+            'subject_id': (StudySession.subject_id, None),
+            # Older sessions have no user_id, they belong to the subject owner
+            'user_id': (func.coalesce(StudySession.user_id, Subject.user_id), 'subject'),
+            'duration': (StudySession.duration, None),
+            'timestamp': (StudySession.timestamp, None),
+        },
+        default=('id', 'subject_id', 'user_id', 'duration', 'timestamp'),
+        key=StudySession.id, timestamp=StudySession.timestamp, subject_col=StudySession.subject_id,
+        joins={'subject': (Subject, Subject.subject_id == StudySession.subject_id)}),
+}
+
+TASK_STATUSES = {'pending': 1, 'completed': 2}
+
+def parse_fields(resource, raw):
+    """?fields=a,b as a tuple of known field names, the resource's defaults when empty."""
+    if not raw:
+        return RESOURCES[resource].default
+    fields = tuple(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in RESOURCES[resource].fields]
+    if unknown:
+        raise ApiError(f"unknown fields for {resource}: {', '.join(unknown)}")
+    return fields
+
+def encode_cursor(resource, row):
+    res = RESOURCES[resource]
+    if res.timestamp is None:
+        return str(row._key)
+    return encode_time_cursor(row._ts, row._key)
+
+def decode_cursor(resource, cursor):
+    """(id,) or (timestamp, id) from an ?after= cursor, None when there isn't one."""
+    if not cursor:
+        return None
+    if RESOURCES[resource].timestamp is None:
+        key = parse_positive_int(cursor)
+        if key is None:
+            raise ApiError("invalid cursor")
+        return (key,)
+    key = decode_time_cursor(cursor)
+    if key is None:
+        raise ApiError("invalid cursor")
+    return key
+
+def build_select(resource, user_id, fields, after=None, limit=API_PAGE_SIZE, subject_id=None, status=None):
+    """
+    One keyset page (plus one row to tell if there's another) of the resource, limited to subjects the
+    user can see. Only the requested columns and the joins they need make it into the SQL.
+    """
+    res = RESOURCES[resource]
+    columns = [res.fields[name][0].label(name) for name in fields]
+    columns.append(res.key.label('_key'))
+    if res.timestamp is not None:
+        columns.append(res.timestamp.label('_ts'))
+    stmt = select(*columns).select_from(res.table)
+    for join in dict.fromkeys(res.fields[name][1] for name in fields):
+        if join:
+            target, onclause = res.joins[join]
+            stmt = stmt.outerjoin(target, onclause)
+
+    stmt = stmt.where(res.subject_col.in_(visible_subject_ids(user_id)))
+    if subject_id is not None:
+        stmt = stmt.where(res.subject_col == subject_id)
+    if status is not None:
+        stmt = stmt.where(Task.status_id == TASK_STATUSES[status])
+    if res.timestamp is None:
+        if after:
+            stmt = stmt.where(res.key > after[0])
+        order = (res.key.asc(),)
+    else:
+        if after:
+            stmt = stmt.where(tuple_(res.timestamp, res.key) < tuple_(*after))
+        order = (res.timestamp.desc(), res.key.desc())
+    return stmt.order_by(*order).limit(limit + 1)
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def _row_json(row, fields):
+    item = {name: getattr(row, name) for name in fields}
+    if 'tags' in item:
+        item['tags'] = item['tags'].split(TAG_SEPARATOR) if item['tags'] else []
+    return json.dumps(item, default=_json_default)
+
+def stream_page(resource, stmt, fields, limit=API_PAGE_SIZE):
+    """
+    Yields the page as JSON text, API_CHUNK_ROWS rows at a time straight off the cursor,
+    with the next page's cursor (or null) at the end: {"data": [...], "count": n, "next_cursor": ...}
+    """
+    result = db.session.execute(stmt, execution_options={'yield_per': API_CHUNK_ROWS})
+    chunk, count, last, has_more = ['{"data":['], 0, None, False
+    try:
+        for row in result:
+            if count == limit:
+                has_more = True  # the extra row only says there's another page
+                break
+            chunk.append((',' if count else '') + _row_json(row, fields))
+            count += 1
+            last = row
+            if len(chunk) >= API_CHUNK_ROWS:
+                yield ''.join(chunk)
+                chunk = []
+    finally:
+        result.close()
+    next_cursor = encode_cursor(resource, last) if has_more else None
+    chunk.append(f'],"count":{count},"next_cursor":{json.dumps(next_cursor)}}}')
+    yield ''.join(chunk)
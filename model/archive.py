@@ -0,0 +1,154 @@
+import json
+import zlib
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import func, update, delete
+from extensions import db
+from model.models import ArchiveBlock, Subject, Message, StudySession, User, get_nzt_now
+
+"""
+History archive for W Notes+.
+Notes and study sessions from whole months older than ARCHIVE_AFTER_DAYS are moved out of the live
+message/study_session tables into per-subject, per-month zlib compressed blocks. Each batch of rows is
+written and deleted in its own short transaction. Subject counters and study rollups already include
+the moved rows and stay as they are. Archived notes drop out of full-text search.
+view_subject only opens blocks when someone pages back past the live rows.
+"""
+
+ARCHIVE_AFTER_DAYS = 180
+ARCHIVE_BATCH_ROWS = 1000
+
+# Row shapes handed to the history templates, attribute compatible with Message/StudySession
+ArchivedSender = namedtuple('ArchivedSender', 'user_id username')
+ArchivedMessage = namedtuple('ArchivedMessage', 'message_id timestamp sender content')
+ArchivedSession = namedtuple('ArchivedSession', 'id timestamp user_id duration')
+
+def archive_cutoff(days=ARCHIVE_AFTER_DAYS, today=None):
+    """Start of the month that contains today - days. Everything before it is archived, so months are never split."""
+    day = (today or get_nzt_now().date()) - timedelta(days=days)
+    return datetime(day.year, day.month, 1)
+
+def encode_rows(rows):
+    """(compressed bytes, raw JSON size) for a list of row lists."""
+    raw = json.dumps(rows, separators=(',', ':')).encode()
+    return zlib.compress(raw, 9), len(raw)
+
+def decode_block(block, kind):
+    """Rows of a block, oldest first, as ArchivedMessage/ArchivedSession."""
+    rows = json.loads(zlib.decompress(block.data))
+    if kind == 'message':
+        return [ArchivedMessage(row[0], datetime.fromisoformat(row[1]), ArchivedSender(row[2], row[3]), row[4])
+                for row in rows]
+    return [ArchivedSession(row[0], datetime.fromisoformat(row[1]), row[2], row[3]) for row in rows]
+
+def _fetch_batch(kind, subject_id, owner_id, cutoff, limit):
+    """Oldest live rows of a subject before cutoff as JSON-ready lists: [id, timestamp, ...]."""
+    if kind == 'message':
+        rows = (db.session.query(Message.message_id, Message.timestamp, Message.sender_id, User.username, Message.content)
+                .join(User, User.user_id == Message.sender_id)
+                .filter(Message.subject_id == subject_id, Message.timestamp < cutoff)
+                .order_by(Message.timestamp, Message.message_id)
+                .limit(limit))
+        return [[m_id, ts.isoformat(), sender_id, username, content] for m_id, ts, sender_id, username, content in rows]
+    rows = (db.session.query(StudySession.id, StudySession.timestamp, StudySession.user_id, StudySession.duration)
+            .filter(StudySession.subject_id == subject_id, StudySession.timestamp < cutoff)
+            .order_by(StudySession.timestamp, StudySession.id)
+            .limit(limit))
+    # Older sessions have no user_id, credit the owner the same way the rollups do
+    return [[s_id, ts.isoformat(), user_id or owner_id, duration or 0] for s_id, ts, user_id, duration in rows]
+
+def archive_subject(kind, subject_id, owner_id, cutoff, batch_size=ARCHIVE_BATCH_ROWS):
+    """Moves one subject's old rows of one kind into monthly blocks, a batch per transaction."""
+    model, key = (Message, Message.message_id) if kind == 'message' else (StudySession, StudySession.id)
+    totals = {'rows': 0, 'blocks': 0, 'raw_bytes': 0, 'stored_bytes': 0}
+    while True:
+        rows = _fetch_batch(kind, subject_id, owner_id, cutoff, batch_size)
+        if not rows:
+            break
+        months = {}
+        for row in rows:
+            months.setdefault(row[1][:7], []).append(row)
+        for month, month_rows in months.items():
+            data, raw_bytes = encode_rows(month_rows)
+            db.session.add(ArchiveBlock(
+                subject_id=subject_id, kind=kind, month=month, row_count=len(month_rows),
+                minutes=sum(row[3] for row in month_rows) if kind == 'session' else 0,
+                first_ts=datetime.fromisoformat(month_rows[0][1]), last_ts=datetime.fromisoformat(month_rows[-1][1]),
+                raw_bytes=raw_bytes, data=data))
+            totals['blocks'] += 1
+            totals['raw_bytes'] += raw_bytes
+            totals['stored_bytes'] += len(data)
+        db.session.execute(delete(model).where(key.in_([row[0] for row in rows]))
+                           .execution_options(synchronize_session=False))
+        # History pages are cached by version, their older links may now point into the archive
+        db.session.execute(update(Subject).where(Subject.subject_id == subject_id).values(version=Subject.version + 1))
+        db.session.commit()
+        totals['rows'] += len(rows)
+    return totals
+
+def archive_history(days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_ROWS, today=None):
+    """
+    One archive pass over every subject. Safe to stop and re-run, each batch is committed on its own.
+    Returns rows moved per kind, blocks written and bytes before/after compression.
+    """
+    cutoff = archive_cutoff(days, today)
+    report = {'cutoff': cutoff.date().isoformat(), 'message': 0, 'session': 0, 'blocks': 0, 'raw_bytes': 0, 'stored_bytes': 0}
+    for kind, model in (('message', Message), ('session', StudySession)):
+        # Covered by the (subject_id, timestamp) index, no table rows read
+        subjects = (db.session.query(Subject.subject_id, Subject.user_id)
+                    .filter(Subject.subject_id.in_(db.select(model.subject_id).where(model.timestamp < cutoff).distinct()))
+                    .all())
+        db.session.commit()
+        for subject_id, owner_id in subjects:
+            totals = archive_subject(kind, subject_id, owner_id, cutoff, batch_size)
+            report[kind] += totals['rows']
+            for field in ('blocks', 'raw_bytes', 'stored_bytes'):
+                report[field] += totals[field]
+    report['saved_bytes'] = report['raw_bytes'] - report['stored_bytes']
+    return report
+
+def has_archive(subject_id, kind):
+    return db.session.query(ArchiveBlock.block_id).filter_by(subject_id=subject_id, kind=kind).first() is not None
+
+def get_archived_page(subject_id, kind, before=None, limit=50):
+    """
+    Archived rows older than the (timestamp, id) cursor, newest first, plus whether more remain.
+    Only opens the blocks it needs, newest first.
+    """
+    query = db.session.query(ArchiveBlock).filter_by(subject_id=subject_id, kind=kind)
+    if before:
+        query = query.filter(ArchiveBlock.first_ts <= before[0])
+    page = []
+    for block in query.order_by(ArchiveBlock.last_ts.desc(), ArchiveBlock.block_id.desc()).yield_per(4):
+        for row in reversed(decode_block(block, kind)):
+            if before is None or (row.timestamp, row[0]) < before:
+                page.append(row)
+                if len(page) > limit:
+                    return page[:limit], True
+    return page, False
+
+def iter_archived(kind, subject_ids=None, blocks_per_batch=16):
+    """
+    (subject_id, row) for every archived row of a kind (export, rollup backfill).
+    Blocks are fetched in keyset batches, so callers can commit between rows.
+    """
+    last_id = 0
+    while True:
+        query = db.session.query(ArchiveBlock).filter(ArchiveBlock.kind == kind, ArchiveBlock.block_id > last_id)
+        if subject_ids is not None:
+            query = query.filter(ArchiveBlock.subject_id.in_(subject_ids))
+        blocks = query.order_by(ArchiveBlock.block_id).limit(blocks_per_batch).all()
+        if not blocks:
+            return
+        for block in blocks:
+            for row in decode_block(block, kind):
+                yield block.subject_id, row
+        last_id = blocks[-1].block_id
+
+def archive_stats():
+    """Blocks, rows and bytes held in the archive, per kind."""
+    rows = (db.session.query(ArchiveBlock.kind, func.count(), func.sum(ArchiveBlock.row_count),
+                             func.sum(ArchiveBlock.raw_bytes), func.sum(func.length(ArchiveBlock.data)))
+            .group_by(ArchiveBlock.kind))
+    return {kind: {'blocks': blocks, 'rows': count, 'raw_bytes': raw, 'stored_bytes': stored}
+            for kind, blocks, count, raw, stored in rows}
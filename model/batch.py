@@ -0,0 +1,148 @@
+from collections import Counter
+from sqlalchemy import update, delete
+from extensions import db
+from model.models import Task, Subject, task_tags, get_nzt_now
+from model.analytics import add_to_rollups, dialect_insert
+from model.counters import bump_counters
+from model.lookups import lookups
+from model.queries import has_subject_access
+from model.scheduler import plan_cache
+
+"""
+Batch task operations for W Notes+.
+Applies one action to many tasks with set-based UPDATE/INSERT/DELETE statements in a single transaction,
+keeping counters, rollups and the study plan cache in step like the single-task routes do.
+"""
+
+ACTIONS = ('complete', 'reopen', 'set_priority', 'add_tags', 'remove_tags', 'move')
+
+class BatchError(ValueError):
+    """Raised for an invalid action or argument, message is shown to the user."""
+
+def _owned_rows(user_id, task_ids):
+    """Same rule as complete_task: you can only change tasks you created."""
+    if not task_ids:
+        return []
+    return (db.session.query(Task.task_id, Task.subject_id, Task.status_id, Task.completed_at)
+            .filter(Task.task_id.in_(task_ids), Task.user_id == user_id)
+            .all())
+
+def _complete(user_id, rows):
+    pending = [r.task_id for r in rows if r.status_id != 2]
+    if not pending:
+        return 0
+    now = get_nzt_now()
+    # Guarded like complete_task: a task completed by another request since the read isn't counted twice,
+    # only the rows this UPDATE actually flipped drive the counters
+    changed = db.session.execute(update(Task).where(Task.task_id.in_(pending), Task.status_id != 2)
+                                 .values(status_id=2, completed_at=now)
+                                 .returning(Task.subject_id)).scalars().all()
+    per_subject = Counter(changed)
+    for subject_id, n in per_subject.items():
+        bump_counters(subject_id, active_task_count=-n, completed_task_count=n)
+    add_to_rollups({(user_id, subject_id, now.date()): (0, 0, n) for subject_id, n in per_subject.items()})
+    return len(changed)
+
+def _reopen(user_id, rows):
+    completed_at = {r.task_id: r.completed_at for r in rows if r.status_id == 2}
+    if not completed_at:
+        return 0
+    # RETURNING gives the new (cleared) completed_at, the credited day comes from the rows read before
+    changed = db.session.execute(update(Task).where(Task.task_id.in_(list(completed_at)), Task.status_id == 2)
+                                 .values(status_id=1, completed_at=None)
+                                 .returning(Task.task_id, Task.subject_id)).all()
+    for subject_id, n in Counter(subject_id for _, subject_id in changed).items():
+        bump_counters(subject_id, active_task_count=n, completed_task_count=-n)
+    # Take the completions back out of the day they were credited to
+    undo = Counter((subject_id, completed_at[task_id].date()) for task_id, subject_id in changed if completed_at[task_id])
+    add_to_rollups({(user_id, subject_id, day): (0, 0, -n) for (subject_id, day), n in undo.items()})
+    return len(changed)
+
+def _set_priority(rows, priority_id):
+    if priority_id not in lookups.priority_map():
+        raise BatchError("Pick a priority.")
+    db.session.execute(update(Task).where(Task.task_id.in_([r.task_id for r in rows])).values(priority_id=priority_id))
+    for subject_id in {r.subject_id for r in rows}:
+        bump_counters(subject_id)
+    return len(rows)
+
+def _valid_tags(tag_ids):
+    tags = [t for t in tag_ids if t in lookups.tag_map()]
+    if not tags:
+        raise BatchError("Pick at least one tag.")
+    return tags
+
+def _add_tags(rows, tag_ids):
+    tags = _valid_tags(tag_ids)
+    # Existing links are left alone thanks to the (task_id, tag_id) primary key
+    stmt = dialect_insert(task_tags).on_conflict_do_nothing()
+    db.session.execute(stmt, [{'task_id': r.task_id, 'tag_id': t} for r in rows for t in tags])
+    for subject_id in {r.subject_id for r in rows}:
+        bump_counters(subject_id)
+    return len(rows)
+
+def _remove_tags(rows, tag_ids):
+    tags = _valid_tags(tag_ids)
+    db.session.execute(delete(task_tags).where(task_tags.c.task_id.in_([r.task_id for r in rows]),
+                                               task_tags.c.tag_id.in_(tags)))
+    for subject_id in {r.subject_id for r in rows}:
+        bump_counters(subject_id)
+    return len(rows)
+
+def _move(user_id, rows, target_subject_id):
+    target = db.session.get(Subject, target_subject_id) if target_subject_id else None
+    if target is None or not has_subject_access(target, user_id):
+        raise BatchError("You can't move tasks into that subject.")
+    moving = [r for r in rows if r.subject_id != target.subject_id]
+    if not moving:
+        return 0
+    db.session.execute(update(Task).where(Task.task_id.in_([r.task_id for r in moving]))
+                       .values(subject_id=target.subject_id))
+    active = Counter(r.subject_id for r in moving if r.status_id != 2)
+    completed = Counter(r.subject_id for r in moving if r.status_id == 2)
+    for subject_id in set(active) | set(completed):
+        bump_counters(subject_id, active_task_count=-active[subject_id], completed_task_count=-completed[subject_id])
+    bump_counters(target.subject_id, active_task_count=sum(active.values()), completed_task_count=sum(completed.values()))
+    # Completions follow the task: out of the source subject's day/week buckets, into the target's
+    shifted = Counter((r.subject_id, r.completed_at.date()) for r in moving if r.status_id == 2 and r.completed_at)
+    buckets = {}
+    for (subject_id, day), n in shifted.items():
+        buckets[(user_id, subject_id, day)] = (0, 0, -n)
+        key = (user_id, target.subject_id, day)
+        buckets[key] = (0, 0, buckets.get(key, (0, 0, 0))[2] + n)
+    add_to_rollups(buckets)
+    return len(moving)
+
+def apply_batch(user_id, task_ids, action, priority_id=None, tag_ids=(), target_subject_id=None):
+    """
+    Runs one batch action over the user's own tasks among task_ids and commits.
+    Returns (tasks changed, tasks skipped because they belong to someone else or don't exist).
+    """
+    if action not in ACTIONS:
+        raise BatchError("Unknown batch action.")
+    rows = _owned_rows(user_id, task_ids)
+    skipped = len(set(task_ids)) - len(rows)
+    if not rows:
+        return 0, skipped
+
+    try:
+        if action == 'complete':
+            changed = _complete(user_id, rows)
+        elif action == 'reopen':
+            changed = _reopen(user_id, rows)
+        elif action == 'set_priority':
+            changed = _set_priority(rows, priority_id)
+        elif action == 'add_tags':
+            changed = _add_tags(rows, tag_ids)
+        elif action == 'remove_tags':
+            changed = _remove_tags(rows, tag_ids)
+        else:
+            changed = _move(user_id, rows, target_subject_id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # Titles stay the same but status/priority/subject may not, reload this user's plan lazily
+    plan_cache.invalidate(user_id)
+    return changed, skipped
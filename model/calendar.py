@@ -0,0 +1,98 @@
+import secrets
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, literal, union_all
+from extensions import db
+from model.models import Subject, Task, Priority, StudySession, get_nzt_now
+from model.queries import visible_subject_ids
+
+"""
+iCalendar (.ics) feed for W Notes+.
+Pending task due dates become VTODOs and recent study sessions become VEVENTs,
+streamed line by line from one UNION ALL query across the user's subjects.
+"""
+
+SESSION_DAYS = 30
+PRODID = "-//W Notes+//Study Planner//EN"
+
+def new_calendar_token():
+    """Unguessable token for the subscribe URL (calendar apps can't log in)."""
+    return secrets.token_urlsafe(24)
+
+def _escape(value):
+    """RFC 5545 TEXT escaping."""
+    return (value or "").replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+def _fold(line):
+    """Lines longer than 75 octets continue on the next line after a space."""
+    raw = line.encode('utf-8')
+    if len(raw) <= 75:
+        return line + "\r\n"
+    parts, chunk = [], b""
+    for char in line:
+        encoded = char.encode('utf-8')
+        if len(chunk) + len(encoded) > (75 if not parts else 74):
+            parts.append(chunk.decode('utf-8'))
+            chunk = b""
+        chunk += encoded
+    parts.append(chunk.decode('utf-8'))
+    return "\r\n ".join(parts) + "\r\n"
+
+def _utc(naive_nz):
+    """Stored timestamps are naive NZ time, calendars want UTC."""
+    aware = naive_nz.replace(tzinfo=get_nzt_now().tzinfo)
+    return aware.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+def feed_query(user_id, today):
+    """Pending dated tasks + sessions from the last SESSION_DAYS days, in one statement."""
+    since = datetime.combine(today - timedelta(days=SESSION_DAYS), datetime.min.time())
+    visible = visible_subject_ids(user_id)
+    tasks = (select(literal('task').label('kind'), Task.task_id.label('item_id'), Task.title.label('title'),
+                    Subject.name.label('subject'), Priority.level.label('priority'),
+                    Task.due_date.label('at'), literal(None).label('duration'))
+             .join(Subject, Subject.subject_id == Task.subject_id)
+             .outerjoin(Priority, Priority.id == Task.priority_id)
+             .where(Task.status_id == 1, Task.due_date.isnot(None), Task.subject_id.in_(visible)))
+    sessions = (select(literal('session'), StudySession.id, literal(None), Subject.name, literal(None),
+                       StudySession.timestamp, StudySession.duration)
+                .join(Subject, Subject.subject_id == StudySession.subject_id)
+                .where(StudySession.subject_id.in_(visible), StudySession.timestamp >= since))
+    return union_all(tasks, sessions)
+
+def ical_lines(user_id, updated=None, today=None, host='wnotes'):
+    """
+    Generator of folded .ics lines for the user's feed.
+    DTSTAMP is the last write rather than now, so the same data always gives the same bytes (strong ETag).
+    """
+    today = today or get_nzt_now().date()
+    stamp = _utc(updated or datetime.combine(today, datetime.min.time()))
+    yield from (_fold(line) for line in (
+        "BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:{PRODID}", "CALSCALE:GREGORIAN",
+        "X-WR-CALNAME:W Notes+"))
+
+    result = db.session.execute(feed_query(user_id, today), execution_options={'yield_per': 500})
+    for row in result.mappings():
+        if row['kind'] == 'task':
+            priority = f" [{row['priority']}]" if row['priority'] else ""
+            lines = [
+                "BEGIN:VTODO",
+                f"UID:task-{row['item_id']}@{host}",
+                f"DTSTAMP:{stamp}",
+                f"SUMMARY:{_escape(row['title'] + priority)}",
+                f"DESCRIPTION:{_escape(row['subject'])}",
+                f"DUE;VALUE=DATE:{row['at'].strftime('%Y%m%d')}",
+                "STATUS:NEEDS-ACTION",
+                "END:VTODO",
+            ]
+        else:
+            lines = [
+                "BEGIN:VEVENT",
+                f"UID:session-{row['item_id']}@{host}",
+                f"DTSTAMP:{stamp}",
+                f"DTSTART:{_utc(row['at'])}",
+                f"DURATION:PT{int(row['duration'] or 0)}M",
+                f"SUMMARY:{_escape('Studied ' + row['subject'])}",
+                "END:VEVENT",
+            ]
+        for line in lines:
+            yield _fold(line)
+    yield _fold("END:VCALENDAR")
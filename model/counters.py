@@ -0,0 +1,68 @@
+from sqlalchemy import text, update
+from extensions import db
+from model.models import Subject, get_nzt_now
+
+"""
+Per-subject counters (active/completed tasks, study minutes, messages, last activity) and version stamp.
+Write routes bump them inside their own transaction, rebuild_counters recomputes them from raw rows.
+"""
+
+COUNTER_COLUMNS = ('active_task_count', 'completed_task_count', 'study_minutes', 'message_count')
+
+# One set-based pass over every subject, also used by the schema migration
+REBUILD_SQL = """
+UPDATE subject SET
+    active_task_count = (SELECT COUNT(*) FROM task WHERE task.subject_id = subject.subject_id AND task.status_id != 2),
+    completed_task_count = (SELECT COUNT(*) FROM task WHERE task.subject_id = subject.subject_id AND task.status_id = 2),
+    study_minutes = (SELECT COALESCE(SUM(duration), 0) FROM study_session WHERE study_session.subject_id = subject.subject_id),
+    message_count = (SELECT COUNT(*) FROM message WHERE message.subject_id = subject.subject_id),
+    last_activity = (SELECT MAX(ts) FROM (
+        SELECT MAX(timestamp) AS ts FROM message WHERE message.subject_id = subject.subject_id
+        UNION ALL
+        SELECT MAX(timestamp) FROM study_session WHERE study_session.subject_id = subject.subject_id))
+"""
+
+# Archived notes/sessions (model/archive.py) still count, added on top of the live rows
+ARCHIVE_COUNTS_SQL = """
+UPDATE subject SET
+    study_minutes = study_minutes + (SELECT COALESCE(SUM(minutes), 0) FROM archive_block
+                                     WHERE archive_block.subject_id = subject.subject_id AND kind = 'session'),
+    message_count = message_count + (SELECT COALESCE(SUM(row_count), 0) FROM archive_block
+                                     WHERE archive_block.subject_id = subject.subject_id AND kind = 'message')
+"""
+
+# Task completions count as activity too (completed_at only exists from migration 3 on, so not in REBUILD_SQL).
+# Task creations/edits also stamp last_activity live but leave no timestamp behind,
+# so after a rebuild it can be earlier than before and the ETags built on it change once.
+TASK_ACTIVITY_SQL = """
+UPDATE subject SET
+    last_activity = (SELECT MAX(ts) FROM (
+        SELECT subject.last_activity AS ts
+        UNION ALL
+        SELECT MAX(completed_at) FROM task WHERE task.subject_id = subject.subject_id))
+"""
+
+def bump_counters(subject_id, **deltas):
+    """
+    Adds deltas to counter columns with a single UPDATE (col = col + n), so concurrent writers can't lose updates.
+    Runs in the caller's session - it commits or rolls back with the route's own changes.
+    Also bumps the subject's version stamp, so bump_counters(subject_id) alone marks a write.
+    """
+    values = {}
+    for column, delta in deltas.items():
+        if column not in COUNTER_COLUMNS:
+            raise ValueError(f"Unknown counter column: {column}")
+        values[column] = getattr(Subject, column) + delta
+    values['last_activity'] = get_nzt_now()
+    values['version'] = Subject.version + 1
+    db.session.execute(update(Subject).where(Subject.subject_id == subject_id).values(**values))
+
+def rebuild_counters():
+    """Recomputes every subject's counters from the task/session/message tables and the archive."""
+    result = db.session.execute(text(REBUILD_SQL))
+    db.session.execute(text(ARCHIVE_COUNTS_SQL))
+    db.session.execute(text(TASK_ACTIVITY_SQL))
+    # Counters may have changed, so anything cached against the old versions is stale
+    db.session.execute(update(Subject).values(version=Subject.version + 1))
+    db.session.commit()
+    return result.rowcount
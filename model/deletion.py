@@ -0,0 +1,104 @@
+from sqlalchemy import text
+from extensions import db
+from jobs import job_queue
+
+"""
+Subject deletion for W Notes+.
+Uses set-based DELETE statements instead of the ORM cascade (which loads every child row).
+Big subjects are hidden straight away (subject row, memberships and rollups go) and their
+tasks/notes/sessions are purged afterwards by a 'purge_subject' job in small chunks,
+so no single request or transaction holds the write lock for long.
+Subject ids are AUTOINCREMENT, so a hidden subject's id never comes back for a new subject
+and anything still keyed by it can only be leftovers.
+"""
+
+LARGE_SUBJECT_ROWS = 5000
+PURGE_CHUNK_SIZE = 500
+
+# Child tables keyed by subject_id, with their primary key column
+CHILD_TABLES = (('task', 'task_id'), ('message', 'message_id'), ('study_session', 'id'))
+
+def subject_row_estimate(subject):
+    """
+    Rough child row count: tasks and notes from the maintained counters (message_count already
+    includes archived notes), plus live and archived study sessions, which have no counter.
+    The session part is an index-only count and a sum over the subject's monthly blocks.
+    """
+    sessions = db.session.execute(text(
+        "SELECT (SELECT count(*) FROM study_session WHERE subject_id = :subject_id)"
+        " + (SELECT coalesce(sum(row_count), 0) FROM archive_block WHERE subject_id = :subject_id AND kind = 'session')"),
+        {'subject_id': subject.subject_id}).scalar()
+    return subject.active_task_count + subject.completed_task_count + subject.message_count + sessions
+
+def hide_subject(subject_id):
+    """Removes the subject and everything that makes it reachable. Caller commits."""
+    params = {'subject_id': subject_id}
+    db.session.execute(text("DELETE FROM study_rollup WHERE subject_id = :subject_id"), params)
+    db.session.execute(text("DELETE FROM archive_block WHERE subject_id = :subject_id"), params)
+    db.session.execute(text("DELETE FROM subject_member WHERE subject_id = :subject_id"), params)
+    db.session.execute(text("DELETE FROM subject WHERE subject_id = :subject_id"), params)
+
+def delete_children(subject_id):
+    """Deletes every child row of a subject in one pass. Caller commits."""
+    params = {'subject_id': subject_id}
+    db.session.execute(text(
+        "DELETE FROM task_tags WHERE task_id IN (SELECT task_id FROM task WHERE subject_id = :subject_id)"), params)
+    for table, _ in CHILD_TABLES:
+        db.session.execute(text(f"DELETE FROM {table} WHERE subject_id = :subject_id"), params)
+
+def delete_subject_now(subject_id):
+    """Small subjects: everything in a single short transaction."""
+    delete_children(subject_id)
+    hide_subject(subject_id)
+    db.session.commit()
+
+def purge_subject_children(subject_id, chunk_size=PURGE_CHUNK_SIZE):
+    """Deletes a hidden subject's children chunk by chunk, committing between chunks. Returns rows removed."""
+    removed = 0
+    for table, key in CHILD_TABLES:
+        while True:
+            ids = [row[0] for row in db.session.execute(
+                text(f"SELECT {key} FROM {table} WHERE subject_id = :subject_id LIMIT :limit"),
+                {'subject_id': subject_id, 'limit': chunk_size})]
+            if not ids:
+                break
+            id_params = {f'id{i}': value for i, value in enumerate(ids)}
+            placeholders = ", ".join(f":id{i}" for i in range(len(ids)))
+            if table == 'task':
+                db.session.execute(text(f"DELETE FROM task_tags WHERE task_id IN ({placeholders})"), id_params)
+            db.session.execute(text(f"DELETE FROM {table} WHERE {key} IN ({placeholders})"), id_params)
+            db.session.commit()
+            removed += len(ids)
+    return removed
+
+def orphaned_subject_ids():
+    """Subjects that were hidden but not fully purged (e.g. the process stopped mid-purge). Ids aren't reused, so these are safe to purge."""
+    union = " UNION ".join(f"SELECT subject_id FROM {table}" for table, _ in CHILD_TABLES)
+    rows = db.session.execute(text(
+        f"SELECT subject_id FROM ({union}) WHERE subject_id NOT IN (SELECT subject_id FROM subject)"))
+    return [row[0] for row in rows]
+
+def purge_orphans(chunk_size=PURGE_CHUNK_SIZE):
+    """Finishes any interrupted purges. Returns rows removed."""
+    return sum(purge_subject_children(subject_id, chunk_size) for subject_id in orphaned_subject_ids())
+
+@job_queue.handler('purge_subject', max_attempts=10)
+def purge_subject_job(payloads):
+    """Chunked purge of a hidden subject. Safe to re-run, it just finds fewer rows."""
+    for payload in payloads:
+        purge_subject_children(payload['subject_id'])
+
+def remove_subject(subject, app):
+    """
+    Deletes a subject. Small ones go in one transaction, large ones are hidden now and purged in the background.
+    Returns True when the purge was deferred.
+    """
+    subject_id = subject.subject_id
+    if subject_row_estimate(subject) < app.config.get('LARGE_SUBJECT_ROWS', LARGE_SUBJECT_ROWS):
+        delete_subject_now(subject_id)
+        return False
+    hide_subject(subject_id)
+    # Queued in the same transaction as the hide, so a hidden subject always has its purge on record
+    job_queue.enqueue('purge_subject', {'subject_id': subject_id})
+    db.session.commit()
+    return True
@@ -0,0 +1,118 @@
+import threading
+from collections import namedtuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from extensions import db
+from model.models import Color, Status, Priority, Tag
+
+"""
+Process-local cache for the seeded lookup tables (Color, Status, Priority, Tag).
+These rows almost never change, so forms and views read them from memory.
+Rows are cached as plain tuples (not ORM objects) so they survive session commits/closes.
+"""
+
+ColorRow = namedtuple('ColorRow', 'id name hex_code')
+StatusRow = namedtuple('StatusRow', 'id label')
+PriorityRow = namedtuple('PriorityRow', 'id level weight')
+TagRow = namedtuple('TagRow', 'tag_id name')
+
+class LookupCache:
+    """Loads every lookup table in one go and serves lists and id maps until invalidated."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+        self._stats = {'hits': 0, 'misses': 0, 'loads': 0, 'invalidations': 0}
+
+    def load(self):
+        """(Re)reads all lookup tables. Called at startup and after an invalidation."""
+        colors = [ColorRow(c.id, c.name, c.hex_code) for c in Color.query.order_by(Color.id).all()]
+        statuses = [StatusRow(s.id, s.label) for s in Status.query.order_by(Status.id).all()]
+        priorities = [PriorityRow(p.id, p.level, p.weight) for p in Priority.query.order_by(Priority.weight.asc()).all()]
+        tags = [TagRow(t.tag_id, t.name) for t in Tag.query.order_by(Tag.tag_id).all()]
+        data = {
+            'colors': colors,
+            'statuses': statuses,
+            'priorities': priorities,
+            'tags': tags,
+            'color_map': {c.id: c for c in colors},
+            'priority_map': {p.id: p for p in priorities},
+            'priority_weights': {p.id: p.weight for p in priorities},
+            'tag_map': {t.tag_id: t for t in tags},
+        }
+        with self._lock:
+            self._data = data
+            self._stats['loads'] += 1
+        return data
+
+    def invalidate(self):
+        """Drops the cached rows, the next read reloads them."""
+        with self._lock:
+            self._data = None
+            self._stats['invalidations'] += 1
+
+    def _get(self, key):
+        data = self._data
+        if data is None:
+            with self._lock:
+                self._stats['misses'] += 1
+            data = self.load()
+        else:
+            with self._lock:
+                self._stats['hits'] += 1
+        return data[key]
+
+    def stats(self):
+        """Hit/miss/load counters for metrics."""
+        with self._lock:
+            return dict(self._stats, loaded=self._data is not None)
+
+    # Lists for form dropdowns
+    def colors(self):
+        return self._get('colors')
+
+    def statuses(self):
+        return self._get('statuses')
+
+    def priorities(self):
+        """Sorted by weight, most important first."""
+        return self._get('priorities')
+
+    def tags(self):
+        return self._get('tags')
+
+    # id -> row maps
+    def color_map(self):
+        return self._get('color_map')
+
+    def priority_map(self):
+        return self._get('priority_map')
+
+    def priority_weights(self):
+        return self._get('priority_weights')
+
+    def tag_map(self):
+        return self._get('tag_map')
+
+lookups = LookupCache()
+
+# Any write to a lookup table (e.g. lookup_data re-seeding) invalidates the cache once it commits.
+# Flushing only flags the session: invalidating at flush would let another request reload the old rows
+# before the commit, and a rollback would throw the cache away for nothing.
+def _flag_lookup_write(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['lookups_changed'] = True
+
+for _model in (Color, Status, Priority, Tag):
+    for _event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event_name, _flag_lookup_write)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_lookups(session):
+    if session.info.pop('lookups_changed', False):
+        lookups.invalidate()
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_lookup_write(session):
+    session.info.pop('lookups_changed', None)
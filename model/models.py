@@ -39,12 +39,26 @@ class Priority(db.Model):
     level = db.Column(db.String(20))
     weight = db.Column(db.Integer)
 
+def username_key(username):
+    """Case-insensitive form of a username, what the autocomplete prefix index is built on."""
+    return username.strip().lower()
+
+def _username_key_default(context):
+    return username_key(context.get_current_parameters()['username'])
+
 class User(db.Model):
     """Primary user account storage with unique constraints for security."""
     user_id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(20), unique=True, nullable=False)
+    # Filled from username on insert (ORM or Core), range scanned by suggest_usernames
+    username_key = db.Column(db.String(20), default=_username_key_default)
     email = db.Column(db.String(50), unique=True, nullable=False)
     password_hash = db.Column(db.String(128), nullable=False)
+    daily_study_minutes = db.Column(db.Integer) # study budget used by the planner
+    calendar_token = db.Column(db.String(64)) # secret for the .ics subscribe link
+
+    __table_args__ = (db.Index('uq_user_calendar_token', 'calendar_token', unique=True),
+                      db.Index('ix_user_username_key', 'username_key'))
 
 class Subject(db.Model):
     """Main Subject container with cascading deletes for data integrity."""
@@ -53,10 +67,26 @@ class Subject(db.Model):
     color_id = db.Column(db.Integer, db.ForeignKey('color.id'))
     user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'), nullable=False)
     color = db.relationship('Color', backref='subjects')
+
+    # Denormalized counters kept up to date by the write routes (see model/counters.py)
+    active_task_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    completed_task_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    study_minutes = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    message_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_activity = db.Column(db.DateTime)
+    # Bumped by every write to the subject, keys the page ETags and cached fragments
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
     tasks = db.relationship('Task', backref='subject', lazy=True, cascade="all, delete-orphan")
     members = db.relationship('SubjectMember', backref='subject', lazy=True, cascade="all, delete-orphan")
     messages = db.relationship('Message', backref='subject', lazy=True, cascade="all, delete-orphan")
     study_sessions = db.relationship('StudySession', backref='subject', lazy=True, cascade="all, delete-orphan")
+    rollups = db.relationship('StudyRollup', backref='subject', lazy=True, cascade="all, delete-orphan")
+
+    # Dashboard looks up owned subjects by user.
+    # AUTOINCREMENT so a deleted subject's id is never handed out again: cached fragments and
+    # children still waiting for the purge job are keyed by it.
+    __table_args__ = (db.Index('ix_subject_user', 'user_id'), {'sqlite_autoincrement': True})
 
 class Task(db.Model):
     """Task objects linked to subjects and priorities for 2NF sorting."""
@@ -70,11 +100,20 @@ class Task(db.Model):
     priority_id = db.Column(db.Integer, db.ForeignKey('priority.id'))
     subject_id = db.Column(db.Integer, db.ForeignKey('subject.subject_id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'), nullable=False)
+    completed_at = db.Column(db.DateTime) # set by complete_task, feeds the analytics rollups
+    estimated_minutes = db.Column(db.Integer) # effort estimate for the planner
     
     # Bridge to lookup tables
     tags = db.relationship('Tag', secondary=task_tags, backref=db.backref('tasks', lazy='dynamic'))
     priority = db.relationship('Priority', backref='tasks')
 
+    # Every workspace/dashboard read filters tasks by subject then status
+    # Agenda scans pending tasks by due date across subjects
+    __table_args__ = (
+        db.Index('ix_task_subject_status', 'subject_id', 'status_id'),
+        db.Index('ix_task_status_due', 'status_id', 'due_date'),
+    )
+
 class Tag(db.Model):
     """Categorical labels for tasks."""
     tag_id = db.Column(db.Integer, primary_key=True)
@@ -86,6 +125,10 @@ class StudySession(db.Model):
     duration = db.Column(db.Integer) # stored in minutes
     timestamp = db.Column(db.DateTime, default=get_nzt_now)
     subject_id = db.Column(db.Integer, db.ForeignKey('subject.subject_id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.user_id')) # who logged it (older rows fall back to the owner)
+
+    # History list reads newest sessions per subject
+    __table_args__ = (db.Index('ix_study_session_subject_timestamp', 'subject_id', 'timestamp'),)
 
 class Message(db.Model):
     """Subject-specific chat messages for collaboration."""
@@ -96,6 +139,25 @@ class Message(db.Model):
     subject_id = db.Column(db.Integer, db.ForeignKey('subject.subject_id'), nullable=False)
     sender = db.relationship('User', backref='sent_messages')
 
+    # Notes feed pages by timestamp within a subject
+    __table_args__ = (db.Index('ix_message_subject_timestamp', 'subject_id', 'timestamp'),)
+
+class StudyRollup(db.Model):
+    """Pre-aggregated study activity per user, subject and day/week (see model/analytics.py)."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'), nullable=False)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.subject_id'), nullable=False)
+    period = db.Column(db.String(4), nullable=False) # 'day' or 'week'
+    period_start = db.Column(db.Date, nullable=False) # the day, or the Monday of the week
+    minutes = db.Column(db.Integer, nullable=False, default=0)
+    sessions = db.Column(db.Integer, nullable=False, default=0)
+    tasks_completed = db.Column(db.Integer, nullable=False, default=0)
+
+    # One row per bucket, stats read a user's buckets by period and date range
+    __table_args__ = (
+        db.Index('uq_study_rollup_bucket', 'user_id', 'period', 'period_start', 'subject_id', unique=True),
+    )
+
 # Tracks if you have joined any subjects
 class SubjectMember(db.Model):
     """Tracks who belongs to what subject and their invite status (3NF)."""
@@ -105,6 +167,48 @@ class SubjectMember(db.Model):
     status = db.Column(db.String(20), default='pending') 
     user = db.relationship('User', backref='subject_memberships')
 
+    # One membership row per user/subject pair, plus the dashboard's status lookup
+    __table_args__ = (
+        db.Index('uq_subject_member_user_subject', 'user_id', 'subject_id', unique=True),
+        db.Index('ix_subject_member_user_status', 'user_id', 'status'),
+    )
+
+class ArchiveBlock(db.Model):
+    """One compressed run of old notes or study sessions for a subject and month (see model/archive.py)."""
+    block_id = db.Column(db.Integer, primary_key=True)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.subject_id'), nullable=False)
+    kind = db.Column(db.String(10), nullable=False) # 'message' or 'session'
+    month = db.Column(db.String(7), nullable=False) # YYYY-MM
+    row_count = db.Column(db.Integer, nullable=False)
+    minutes = db.Column(db.Integer, nullable=False, default=0) # summed durations, sessions only
+    first_ts = db.Column(db.DateTime, nullable=False)
+    last_ts = db.Column(db.DateTime, nullable=False)
+    raw_bytes = db.Column(db.Integer, nullable=False) # JSON size before compression
+    data = db.Column(db.LargeBinary, nullable=False) # zlib compressed JSON rows, oldest first
+
+    # History paging walks a subject's blocks newest first
+    __table_args__ = (db.Index('ix_archive_block_subject_kind_last', 'subject_id', 'kind', 'last_ts'),)
+
+class Job(db.Model):
+    """Deferred follow-up work queued by write routes, run by the workers in jobs.py."""
+    job_id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}') # JSON
+    idempotency_key = db.Column(db.String(200)) # same key = same job, enqueued once
+    status = db.Column(db.String(10), nullable=False, default='queued') # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_at = db.Column(db.DateTime, nullable=False) # not picked up before this (retry backoff)
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+    # Workers claim the oldest due queued jobs
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+        db.Index('uq_job_idempotency_key', 'idempotency_key', unique=True),
+    )
+
 # Data for when DB is reset
 def lookup_data():
     """When DB is reset this brings back default lookup data."""
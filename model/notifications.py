@@ -0,0 +1,69 @@
+import json
+import os
+import uuid
+from collections import defaultdict
+from flask import current_app
+from extensions import db
+from model.models import SubjectMember, get_nzt_now
+from jobs import job_queue
+
+"""
+Notifications for W Notes+.
+Routes call notify/notify_subject inside their transaction (one INSERT into the job queue), and the
+batched 'notify' job works out who gets what and writes it to a local outbox directory,
+one JSON file per recipient per notification. The outbox stands in for email/push delivery.
+"""
+
+OUTBOX_BATCH_SIZE = 50
+
+def _enqueue(payload, key=None):
+    # The id is stored with the job, so a retried job rewrites the same file whatever batch it lands in
+    payload['id'] = uuid.uuid4().hex
+    job_queue.enqueue('notify', payload, key=key)
+
+def notify(user_id, event, key=None, **data):
+    """Queues a notification for one user."""
+    _enqueue({'user_id': user_id, 'event': event, 'data': data}, key)
+
+def notify_subject(subject_id, event, exclude_user_id=None, key=None, **data):
+    """Queues a notification for every accepted member of a subject (the owner included), resolved when it's sent."""
+    _enqueue({'subject_id': subject_id, 'exclude_user_id': exclude_user_id, 'event': event, 'data': data}, key)
+
+def outbox_dir():
+    return current_app.config.get('JOBS_OUTBOX_DIR') or os.path.join(current_app.instance_path, 'outbox')
+
+def _subject_audiences(subject_ids):
+    """{subject_id: {user_id, ...}} of accepted members, one query for the whole batch."""
+    audiences = defaultdict(set)
+    if subject_ids:
+        for subject_id, user_id in (db.session.query(SubjectMember.subject_id, SubjectMember.user_id)
+                                    .filter(SubjectMember.subject_id.in_(subject_ids),
+                                            SubjectMember.status == 'accepted')):
+            audiences[subject_id].add(user_id)
+    return audiences
+
+@job_queue.handler('notify', batch_size=OUTBOX_BATCH_SIZE)
+def deliver(payloads):
+    """Fans the batch out to recipients, one outbox file per recipient and notification id."""
+    audiences = _subject_audiences({p['subject_id'] for p in payloads if p.get('subject_id')})
+    inbox = defaultdict(list)
+    for payload in payloads:
+        if payload.get('subject_id'):
+            recipients = audiences[payload['subject_id']] - {payload.get('exclude_user_id')}
+        else:
+            recipients = {payload['user_id']}
+        item = {'id': payload['id'], 'event': payload['event'], 'subject_id': payload.get('subject_id'), **payload['data']}
+        for user_id in recipients:
+            inbox[user_id].append(item)
+
+    written = get_nzt_now().isoformat()
+    for user_id, items in inbox.items():
+        folder = os.path.join(outbox_dir(), str(user_id))
+        os.makedirs(folder, exist_ok=True)
+        for item in items:
+            # Named after the notification, so re-runs overwrite instead of duplicating.
+            # Temp file + rename so readers never see half a file.
+            path = os.path.join(folder, f"{item['id']}.json")
+            with open(path + '.tmp', 'w') as f:
+                json.dump({'user_id': user_id, 'written_at': written, 'notifications': [item]}, f, indent=2)
+            os.replace(path + '.tmp', path)
@@ -0,0 +1,246 @@
+from datetime import datetime, timedelta
+from sqlalchemy import case, func, tuple_
+from sqlalchemy.orm import joinedload, selectinload, contains_eager
+from extensions import db
+from model.archive import has_archive, get_archived_page
+from model.models import User, Subject, SubjectMember, Task, Priority, Message, StudySession, get_nzt_now, username_key
+
+"""
+Shared read helpers for W Notes+.
+Views call these instead of building their own queries so the query count stays fixed.
+"""
+
+# Page caps for the subject workspace so memory stays bounded
+TASK_PAGE_SIZE = 50
+MESSAGE_PAGE_SIZE = 50
+SESSION_PAGE_SIZE = 20
+FEED_PAGE_SIZE = 100
+AGENDA_PAGE_SIZE = 50
+USERNAME_SUGGEST_LIMIT = 8
+
+def has_subject_access(subject, user_id):
+    """Owner or accepted collaborator - the same rule view_subject has always enforced."""
+    if subject.user_id == user_id:
+        return True
+    membership = (db.session.query(SubjectMember.id)
+                  .filter_by(user_id=user_id, subject_id=subject.subject_id, status='accepted')
+                  .first())
+    return membership is not None
+
+def visible_subject_ids(user_id):
+    """Select of subject ids the user owns or has accepted membership in, for IN (...) filters."""
+    owned = db.select(Subject.subject_id).where(Subject.user_id == user_id)
+    joined = db.select(SubjectMember.subject_id).where(SubjectMember.user_id == user_id, SubjectMember.status == 'accepted')
+    return owned.union(joined)
+
+def get_subject_versions(user_id):
+    """
+    Every subject the user can see as small (subject_id, user_id, name, color_id, version) rows, by id.
+    One cheap query that doubles as the access check, the move target list and the page ETag input.
+    """
+    return (db.session.query(Subject.subject_id, Subject.user_id, Subject.name, Subject.color_id, Subject.version)
+            .filter(Subject.subject_id.in_(visible_subject_ids(user_id)))
+            .order_by(Subject.subject_id)
+            .all())
+
+def suggest_usernames(prefix, exclude_user_id=None, limit=USERNAME_SUGGEST_LIMIT):
+    """
+    Usernames starting with prefix, case-insensitive, alphabetical.
+    key >= prefix AND key < prefix-with-last-char-bumped is a plain range scan on ix_user_username_key,
+    so it only reads the rows it returns (LIKE 'x%' can't use the index under SQLite's default collation).
+    """
+    key = username_key(prefix)
+    if not key:
+        return []
+    upper = key[:-1] + chr(ord(key[-1]) + 1)
+    query = db.session.query(User.username).filter(User.username_key >= key, User.username_key < upper)
+    if exclude_user_id is not None:
+        query = query.filter(User.user_id != exclude_user_id)
+    return [row[0] for row in query.order_by(User.username_key).limit(limit)]
+
+def get_pending_invite_ids(user_id):
+    """Membership ids of the user's unanswered invites."""
+    return [row[0] for row in db.session.query(SubjectMember.id)
+            .filter_by(user_id=user_id, status='pending')
+            .order_by(SubjectMember.id)]
+
+def get_dashboard_data(user_id, subject_ids=None, invite_ids=None):
+    """
+    Gathers everything the dashboard needs in a fixed number of queries:
+    user, owned + joined subjects (colors eager loaded, counters on the row) and pending invites.
+    subject_ids / invite_ids narrow the subjects and invites to those the caller still needs
+    (cards missing from the fragment cache, invites it already has the ids of), an empty list skips that query.
+    """
+    user = db.session.get(User, user_id)
+
+    all_subjects = []
+    if subject_ids is None or subject_ids:
+        # Subjects the user joined (accepted) - owned subjects are matched directly
+        joined_ids = (db.session.query(SubjectMember.subject_id)
+                      .filter(SubjectMember.user_id == user_id, SubjectMember.status == 'accepted'))
+        query = (Subject.query
+                 .options(joinedload(Subject.color))
+                 .filter((Subject.user_id == user_id) | Subject.subject_id.in_(joined_ids)))
+        if subject_ids is not None:
+            query = query.filter(Subject.subject_id.in_(subject_ids))
+        # Owned subjects first, then shared ones, same order the dashboard always used
+        all_subjects = query.order_by(case((Subject.user_id == user_id, 0), else_=1), Subject.subject_id).all()
+
+    # Active counts are kept on the subject row itself (model/counters.py)
+    subject_list = [{'obj': s, 'active_count': s.active_task_count} for s in all_subjects]
+
+    # Separate list for notifications bar, subject eager loaded for the invite names
+    pending_invites = []
+    if invite_ids is None or invite_ids:
+        query = (SubjectMember.query
+                 .options(joinedload(SubjectMember.subject))
+                 .filter_by(user_id=user_id, status='pending'))
+        if invite_ids is not None:
+            query = query.filter(SubjectMember.id.in_(invite_ids))
+        pending_invites = query.order_by(SubjectMember.id).all()
+
+    return {'user': user, 'subjects': subject_list, 'invites': pending_invites}
+
+# Keyset cursors are plain strings so they can ride along in query params
+def encode_task_cursor(task):
+    """Cursor for the task list: status, priority weight, id."""
+    return f"{task.status_id}-{task.priority.weight}-{task.task_id}"
+
+def decode_task_cursor(cursor):
+    """Returns (status_id, weight, task_id) or None for missing/invalid cursors."""
+    try:
+        status_id, weight, task_id = (int(part) for part in cursor.split('-'))
+        return status_id, weight, task_id
+    except (AttributeError, ValueError):
+        return None
+
+def encode_time_cursor(timestamp, row_id):
+    """Cursor for timestamped feeds (notes, history): timestamp + id tie breaker."""
+    return f"{timestamp.replace(tzinfo=None).isoformat()},{row_id}"
+
+def decode_time_cursor(cursor):
+    """Returns (timestamp, id) or None for missing/invalid cursors."""
+    try:
+        raw_ts, raw_id = cursor.split(',')
+        return datetime.fromisoformat(raw_ts), int(raw_id)
+    except (AttributeError, ValueError):
+        return None
+
+def get_task_page(subject_id, after=None, limit=TASK_PAGE_SIZE):
+    """One page of tasks sorted by status then Priority weight, tags/priority eager loaded."""
+    query = (Task.query
+             .join(Priority)
+             .options(contains_eager(Task.priority), selectinload(Task.tags))
+             .filter(Task.subject_id == subject_id))
+    key = decode_task_cursor(after)
+    if key:
+        query = query.filter(tuple_(Task.status_id, Priority.weight, Task.task_id) > tuple_(*key))
+    rows = query.order_by(Task.status_id.asc(), Priority.weight.asc(), Task.task_id.asc()).limit(limit + 1).all()
+    tasks = rows[:limit]
+    next_cursor = encode_task_cursor(tasks[-1]) if len(rows) > limit else None
+    return tasks, next_cursor
+
+def _continue_into_archive(subject_id, kind, rows, key, limit):
+    """
+    Tops up a newest-first live page from the archive once the live rows run out. Returns (page, has_more).
+    The first page never opens a block, it only links on to the archive if there is one.
+    """
+    if len(rows) > limit:
+        return rows[:limit], True
+    if key is None and rows:
+        return rows, has_archive(subject_id, kind)
+    if rows:
+        last = rows[-1]
+        key = (last.timestamp, last.message_id if kind == 'message' else last.id)
+    archived, has_more = get_archived_page(subject_id, kind, before=key, limit=limit - len(rows))
+    return list(rows) + archived, has_more
+
+def get_message_page(subject_id, before=None, limit=MESSAGE_PAGE_SIZE):
+    """Newest page of notes (returned oldest first for the feed) with senders eager loaded, archived notes past the live ones."""
+    query = (Message.query
+             .options(joinedload(Message.sender))
+             .filter(Message.subject_id == subject_id))
+    key = decode_time_cursor(before)
+    if key:
+        query = query.filter(tuple_(Message.timestamp, Message.message_id) < tuple_(*key))
+    rows = query.order_by(Message.timestamp.desc(), Message.message_id.desc()).limit(limit + 1).all()
+    messages, has_more = _continue_into_archive(subject_id, 'message', rows, key, limit)
+    older_cursor = encode_time_cursor(messages[-1].timestamp, messages[-1].message_id) if has_more else None
+    messages.reverse()
+    return messages, older_cursor
+
+def get_session_page(subject_id, before=None, limit=SESSION_PAGE_SIZE):
+    """Most recent study sessions first, archived ones past the live ones."""
+    query = StudySession.query.filter(StudySession.subject_id == subject_id)
+    key = decode_time_cursor(before)
+    if key:
+        query = query.filter(tuple_(StudySession.timestamp, StudySession.id) < tuple_(*key))
+    rows = query.order_by(StudySession.timestamp.desc(), StudySession.id.desc()).limit(limit + 1).all()
+    sessions, has_more = _continue_into_archive(subject_id, 'session', rows, key, limit)
+    older_cursor = encode_time_cursor(sessions[-1].timestamp, sessions[-1].id) if has_more else None
+    return sessions, older_cursor
+
+def message_to_dict(msg):
+    """JSON shape of a note for the incremental feed/stream."""
+    return {
+        'message_id': msg.message_id,
+        'sender': msg.sender.username,
+        'content': msg.content,
+        'timestamp': msg.timestamp.isoformat() if msg.timestamp else None,
+    }
+
+def get_messages_after(subject_id, after_id=0, limit=FEED_PAGE_SIZE):
+    """Notes newer than the message_id cursor, oldest first, senders eager loaded."""
+    return (Message.query
+            .options(joinedload(Message.sender))
+            .filter(Message.subject_id == subject_id, Message.message_id > after_id)
+            .order_by(Message.message_id.asc())
+            .limit(limit)
+            .all())
+
+def encode_agenda_cursor(task):
+    """Cursor for the agenda: due date, priority weight, id."""
+    return f"{task.due_date.isoformat()},{task.priority.weight},{task.task_id}"
+
+def decode_agenda_cursor(cursor):
+    """Returns (due_date, weight, task_id) or None for missing/invalid cursors."""
+    try:
+        raw_due, raw_weight, raw_id = cursor.split(',')
+        return datetime.fromisoformat(raw_due), int(raw_weight), int(raw_id)
+    except (AttributeError, ValueError):
+        return None
+
+def agenda_window(days, today=None):
+    """[start of today, end of the Nth day) in the same naive NZ time due dates are stored in."""
+    start = (today or get_nzt_now()).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+    return start, start + timedelta(days=days)
+
+def get_agenda(user_id, days=7, after=None, limit=AGENDA_PAGE_SIZE, today=None):
+    """
+    Pending tasks due in the next `days` days across every subject the user can see,
+    ordered by due date then Priority weight. One range query on ix_task_status_due, keyset paged.
+    """
+    start, end = agenda_window(days, today)
+    query = (Task.query
+             .join(Priority)
+             .options(contains_eager(Task.priority), joinedload(Task.subject))
+             .filter(Task.status_id == 1,
+                     Task.due_date >= start, Task.due_date < end,
+                     Task.subject_id.in_(visible_subject_ids(user_id))))
+    key = decode_agenda_cursor(after)
+    if key:
+        query = query.filter(tuple_(Task.due_date, Priority.weight, Task.task_id) > tuple_(*key))
+    rows = query.order_by(Task.due_date.asc(), Priority.weight.asc(), Task.task_id.asc()).limit(limit + 1).all()
+    tasks = rows[:limit]
+    next_cursor = encode_agenda_cursor(tasks[-1]) if len(rows) > limit else None
+    return tasks, next_cursor
+
+def get_agenda_version(user_id):
+    """
+    Cheap change marker for the agenda: latest activity across visible subjects plus the subject set itself.
+    Every task write bumps Subject.last_activity (model/counters.py), joins/leaves change the count/sum.
+    """
+    row = (db.session.query(func.max(Subject.last_activity), func.count(Subject.subject_id), func.sum(Subject.subject_id))
+           .filter(Subject.subject_id.in_(visible_subject_ids(user_id)))
+           .one())
+    return row
@@ -0,0 +1,172 @@
+import heapq
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from extensions import db
+from model.models import User, Subject, Task, Priority, get_nzt_now
+from model.queries import visible_subject_ids
+
+"""
+Study plan scheduler for W Notes+.
+Spreads a user's pending tasks over the coming days with an earliest-deadline-first allocator,
+using their daily study budget and each task's effort estimate.
+Plans are cached per user and patched when tasks are added or completed instead of re-queried.
+Each cached plan is stamped with the user's subject versions, so a write handled by another
+worker (every task write bumps Subject.version) makes this one reload on the next view.
+"""
+
+DEFAULT_TASK_MINUTES = 60
+DEFAULT_DAILY_MINUTES = 120
+PLAN_HORIZON_DAYS = 28
+PLAN_CACHE_SIZE = 1000
+
+PlanItem = namedtuple('PlanItem', 'task_id title subject_id subject_name due_date weight minutes')
+
+def _sort_key(item):
+    """EDF order: earliest due date first (undated last), then Priority weight, then id for stability."""
+    due = item.due_date or datetime.max
+    return (due, item.weight, item.task_id)
+
+def build_plan(items, daily_minutes, start_day, horizon=PLAN_HORIZON_DAYS):
+    """
+    Allocates items into day slots of daily_minutes each, starting at start_day.
+    Tasks are split across days when they don't fit. Anything past the horizon is returned as unscheduled.
+    O(n log n) in the number of tasks.
+    """
+    heap = [(_sort_key(item), item.minutes, item) for item in items]
+    heapq.heapify(heap)
+    days = []
+    for offset in range(horizon):
+        if not heap:
+            break
+        day = start_day + timedelta(days=offset)
+        capacity = daily_minutes
+        blocks = []
+        while capacity > 0 and heap:
+            key, remaining, item = heapq.heappop(heap)
+            used = min(remaining, capacity)
+            capacity -= used
+            blocks.append({
+                'task_id': item.task_id,
+                'title': item.title,
+                'subject_id': item.subject_id,
+                'subject': item.subject_name,
+                'minutes': used,
+                'due_date': item.due_date.date().isoformat() if item.due_date else None,
+                'late': bool(item.due_date and day > item.due_date.date()),
+            })
+            if remaining > used:
+                heapq.heappush(heap, (key, remaining - used, item))
+        days.append({'day': day.isoformat(), 'capacity': daily_minutes,
+                     'used': daily_minutes - capacity, 'blocks': blocks})
+
+    unscheduled = [{'task_id': item.task_id, 'title': item.title, 'minutes': remaining}
+                   for _, remaining, item in sorted(heap, key=lambda entry: entry[0])]
+    return {'days': days, 'unscheduled': unscheduled}
+
+def _item_for(task, subject_name, weight):
+    return PlanItem(task.task_id, task.title, task.subject_id, subject_name, task.due_date,
+                    weight, task.estimated_minutes or DEFAULT_TASK_MINUTES)
+
+def load_items(user_id):
+    """Pending tasks the user created, in one joined query."""
+    rows = (db.session.query(Task, Subject.name, Priority.weight)
+            .join(Subject, Subject.subject_id == Task.subject_id)
+            .outerjoin(Priority, Priority.id == Task.priority_id)
+            .filter(Task.user_id == user_id, Task.status_id == 1)
+            .all())
+    return {task.task_id: _item_for(task, name, weight if weight is not None else 99) for task, name, weight in rows}
+
+class PlanCache:
+    """
+    Bounded LRU of per-user task items and the plan built from them.
+    Task writes patch the items; the plan is only rebuilt when items, budget or the day change.
+    Items are reloaded when the caller's stamp (see plan_stamp) differs from the one they were loaded under.
+    """
+
+    def __init__(self, maxsize=PLAN_CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.maxsize = maxsize
+        self.builds = 0
+
+    def _entry(self, user_id, stamp=None):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry['stamp'] == stamp:
+                self._entries.move_to_end(user_id)
+                return entry
+        entry = {'items': load_items(user_id), 'plan': None, 'plan_key': None, 'stamp': stamp}
+        with self._lock:
+            self._entries[user_id] = entry
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def get_plan(self, user_id, daily_minutes, today=None, stamp=None):
+        start_day = today or get_nzt_now().date()
+        entry = self._entry(user_id, stamp)
+        with self._lock:
+            plan_key = (start_day, daily_minutes)
+            if entry['plan'] is None or entry['plan_key'] != plan_key:
+                entry['plan'] = build_plan(entry['items'].values(), daily_minutes, start_day)
+                entry['plan_key'] = plan_key
+                self.builds += 1
+            return entry['plan']
+
+    @staticmethod
+    def _expect_own_bump(entry):
+        # The patched write bumped one subject version once. Versions only go up, so if anyone
+        # else wrote in between the real stamp ends up higher and the next view reloads.
+        if entry['stamp'] is not None:
+            count, versions, ids = entry['stamp']
+            entry['stamp'] = (count, (versions or 0) + 1, ids)
+
+    def task_added(self, task, subject_name, weight):
+        """Adds a new pending task to its creator's cached plan (no-op if they have no cached plan)."""
+        with self._lock:
+            entry = self._entries.get(task.user_id)
+            if entry is not None:
+                entry['items'][task.task_id] = _item_for(task, subject_name, weight)
+                entry['plan'] = None
+                self._expect_own_bump(entry)
+
+    def task_completed(self, task):
+        """Drops a finished task from its creator's cached plan."""
+        with self._lock:
+            entry = self._entries.get(task.user_id)
+            if entry is not None and entry['items'].pop(task.task_id, None) is not None:
+                entry['plan'] = None
+                self._expect_own_bump(entry)
+
+    def invalidate(self, user_id=None):
+        """Forgets one user's plan (or everyone's), it reloads on next view."""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+plan_cache = PlanCache()
+
+def plan_stamp_and_budget(user_id):
+    """
+    (stamp, daily budget) in one query. The stamp is count/sum of versions/sum of ids over the
+    user's visible subjects: any task write, move, join/leave or subject delete changes it.
+    """
+    row = (db.session.query(User.daily_study_minutes, func.count(Subject.subject_id),
+                            func.sum(Subject.version), func.sum(Subject.subject_id))
+           .select_from(User)
+           .outerjoin(Subject, Subject.subject_id.in_(visible_subject_ids(user_id)))
+           .filter(User.user_id == user_id)
+           .group_by(User.user_id)
+           .one())
+    return tuple(row[1:]), row[0]
+
+def get_user_plan(user_id, today=None):
+    """The signed in user's plan using their saved daily budget."""
+    stamp, daily_minutes = plan_stamp_and_budget(user_id)
+    daily_minutes = daily_minutes or DEFAULT_DAILY_MINUTES
+    return daily_minutes, plan_cache.get_plan(user_id, daily_minutes, today, stamp)
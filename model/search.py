@@ -0,0 +1,119 @@
+import re
+from sqlalchemy import event, text, DDL
+from extensions import db
+
+"""
+Full-text search over task titles/descriptions and subject notes (SQLite FTS5).
+The FTS tables are external-content indexes over task/message, kept in sync by triggers,
+so every write path (routes, bulk SQL, cascades) updates the index without extra code.
+"""
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE = 500  # deeper offsets are only ever typed in, and past a point SQLite can't bind them
+
+FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS task_fts USING fts5(title, description, content='task', content_rowid='task_id')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(content, content='message', content_rowid='message_id')",
+    # External content tables need the old values on delete/update, hence the 'delete' command rows
+    """CREATE TRIGGER IF NOT EXISTS task_fts_insert AFTER INSERT ON task BEGIN
+           INSERT INTO task_fts(rowid, title, description) VALUES (new.task_id, new.title, new.description);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS task_fts_delete AFTER DELETE ON task BEGIN
+           INSERT INTO task_fts(task_fts, rowid, title, description) VALUES ('delete', old.task_id, old.title, old.description);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS task_fts_update AFTER UPDATE OF title, description ON task BEGIN
+           INSERT INTO task_fts(task_fts, rowid, title, description) VALUES ('delete', old.task_id, old.title, old.description);
+           INSERT INTO task_fts(rowid, title, description) VALUES (new.task_id, new.title, new.description);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS message_fts_insert AFTER INSERT ON message BEGIN
+           INSERT INTO message_fts(rowid, content) VALUES (new.message_id, new.content);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS message_fts_delete AFTER DELETE ON message BEGIN
+           INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.message_id, old.content);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS message_fts_update AFTER UPDATE OF content ON message BEGIN
+           INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.message_id, old.content);
+           INSERT INTO message_fts(rowid, content) VALUES (new.message_id, new.content);
+       END""",
+]
+
+FTS_DROP = [
+    "DROP TABLE IF EXISTS task_fts",
+    "DROP TABLE IF EXISTS message_fts",
+]
+
+# create_all/drop_all don't know about virtual tables, so hook them onto the metadata
+for _statement in FTS_DDL:
+    event.listen(db.metadata, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+for _statement in FTS_DROP:
+    event.listen(db.metadata, 'before_drop', DDL(_statement).execute_if(dialect='sqlite'))
+
+def install_search(conn):
+    """Creates the FTS tables/triggers on an existing database and indexes current rows."""
+    for statement in FTS_DDL:
+        conn.execute(text(statement))
+    rebuild_index(conn)
+
+def rebuild_index(conn):
+    """FTS5 'rebuild' re-reads the content tables in one bulk pass."""
+    conn.execute(text("INSERT INTO task_fts(task_fts) VALUES ('rebuild')"))
+    conn.execute(text("INSERT INTO message_fts(message_fts) VALUES ('rebuild')"))
+
+def reindex():
+    """Rebuilds both search indexes from scratch."""
+    with db.engine.begin() as conn:
+        rebuild_index(conn)
+
+def to_match_query(raw):
+    """
+    Turns free text into a safe FTS5 query: every word must appear, last word matches as a prefix.
+    Quoting each token stops user input from being parsed as FTS syntax (NEAR, OR, column filters...).
+    """
+    words = re.findall(r"\w+", raw or "")
+    if not words:
+        return None
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += '*'
+    return " ".join(terms)
+
+SEARCH_SQL = """
+WITH visible AS (
+    SELECT subject_id FROM subject WHERE user_id = :user_id
+    UNION
+    SELECT subject_id FROM subject_member WHERE user_id = :user_id AND status = 'accepted'
+)
+SELECT kind, item_id, subject_id, subject_name, title, snippet, rank FROM (
+    SELECT 'task' AS kind, task.task_id AS item_id, task.subject_id, subject.name AS subject_name,
+           task.title AS title, snippet(task_fts, 1, '', '', '…', 12) AS snippet,
+           bm25(task_fts, 10.0, 1.0) AS rank
+    FROM task_fts
+    JOIN task ON task.task_id = task_fts.rowid
+    JOIN subject ON subject.subject_id = task.subject_id
+    WHERE task_fts MATCH :query AND task.subject_id IN (SELECT subject_id FROM visible)
+    UNION ALL
+    SELECT 'note', message.message_id, message.subject_id, subject.name,
+           NULL, snippet(message_fts, 0, '', '', '…', 12),
+           bm25(message_fts)
+    FROM message_fts
+    JOIN message ON message.message_id = message_fts.rowid
+    JOIN subject ON subject.subject_id = message.subject_id
+    WHERE message_fts MATCH :query AND message.subject_id IN (SELECT subject_id FROM visible)
+)
+ORDER BY rank, kind, item_id
+LIMIT :limit OFFSET :offset
+"""
+
+def search(user_id, raw_query, page=1, per_page=SEARCH_PAGE_SIZE):
+    """
+    Ranked (bm25) matches across tasks and notes in subjects the user owns or has joined.
+    Returns (results, has_more); fetches one extra row to know if there's a next page.
+    """
+    query = to_match_query(raw_query)
+    if not query:
+        return [], False
+    page = min(max(page, 1), SEARCH_MAX_PAGE)
+    rows = db.session.execute(text(SEARCH_SQL), {
+        'user_id': user_id, 'query': query,
+        'limit': per_page + 1, 'offset': (page - 1) * per_page,
+    }).mappings().all()
+    return [dict(r) for r in rows[:per_page]], len(rows) > per_page
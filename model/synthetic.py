@@ -0,0 +1,118 @@
+import random
+from datetime import timedelta
+from sqlalchemy import insert, func
+from werkzeug.security import generate_password_hash
+from extensions import db
+from passwords import password_hasher
+from model.models import (User, Subject, SubjectMember, Task, Message, StudySession, task_tags, get_nzt_now)
+from model.lookups import lookups
+from model.counters import rebuild_counters
+from model.analytics import backfill_rollups
+
+"""
+Seeded synthetic data for benchmarks and load tests.
+Same seed + sizes = same rows, so benchmark runs are comparable.
+Rows go in with Core executemany inserts and explicit ids; counters and rollups are rebuilt at the end.
+"""
+
+SYNTHETIC_PASSWORD = 'benchmark123'
+
+# Rough shape of a real semester: a handful of subjects each, some shared with classmates
+RATIOS = {
+    'subjects_per_user': 5,
+    'shared_fraction': 0.3,     # subjects with invited members
+    'members_per_shared': 2,
+    'pending_invite_fraction': 0.2,
+    'tasks_per_subject': 40,
+    'completed_fraction': 0.5,
+    'max_tags_per_task': 3,
+    'messages_per_subject': 60,
+    'sessions_per_subject': 20,
+}
+
+WORDS = ("essay revise lab report quiz chapter notes reading past paper derivatives photosynthesis "
+         "vectors poem draft outline flashcards experiment summary exam prep group project").split()
+
+def _next_id(column):
+    return (db.session.query(func.max(column)).scalar() or 0) + 1
+
+def _phrase(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+def generate(users=50, seed=42, ratios=None, chunk_size=5000):
+    """
+    Inserts `users` synthetic users and their subjects, memberships, tasks (with tags), notes and sessions.
+    Returns row counts per table. Needs the lookup rows (lookup_data) in place first.
+    """
+    shape = dict(RATIOS, **(ratios or {}))
+    rng = random.Random(seed)
+    now = get_nzt_now().replace(tzinfo=None)
+    priority_ids = [p.id for p in lookups.priorities()]
+    tag_ids = [t.tag_id for t in lookups.tags()]
+    color_ids = [c.id for c in lookups.colors()]
+
+    rows = {'user': [], 'subject': [], 'subject_member': [], 'task': [], 'task_tags': [],
+            'message': [], 'study_session': []}
+    # Hashing is deliberately slow, one hash shared by every synthetic user
+    password_hash = generate_password_hash(SYNTHETIC_PASSWORD, method=password_hasher.method)
+
+    user_base, subject_base, task_base = _next_id(User.user_id), _next_id(Subject.subject_id), _next_id(Task.task_id)
+    user_ids = list(range(user_base, user_base + users))
+    for user_id in user_ids:
+        rows['user'].append({'user_id': user_id, 'username': f'bench{user_id}', 'email': f'bench{user_id}@example.com',
+                             'password_hash': password_hash, 'daily_study_minutes': rng.choice((60, 90, 120, 180))})
+
+    subject_id, task_id = subject_base, task_base
+    for owner in user_ids:
+        for n in range(shape['subjects_per_user']):
+            rows['subject'].append({'subject_id': subject_id, 'name': f'{rng.choice(WORDS)} {n}',
+                                    'color_id': rng.choice(color_ids) if color_ids else None, 'user_id': owner})
+            rows['subject_member'].append({'user_id': owner, 'subject_id': subject_id, 'status': 'accepted'})
+            members = [owner]
+            if len(user_ids) > 1 and rng.random() < shape['shared_fraction']:
+                others = rng.sample([u for u in user_ids if u != owner], min(shape['members_per_shared'], len(user_ids) - 1))
+                for member in others:
+                    pending = rng.random() < shape['pending_invite_fraction']
+                    rows['subject_member'].append({'user_id': member, 'subject_id': subject_id,
+                                                   'status': 'pending' if pending else 'accepted'})
+                    if not pending:
+                        members.append(member)
+
+            for _ in range(shape['tasks_per_subject']):
+                done = rng.random() < shape['completed_fraction']
+                due = now + timedelta(days=rng.randint(-14, 45)) if rng.random() < 0.8 else None
+                rows['task'].append({
+                    'task_id': task_id, 'title': _phrase(rng, 3)[:50], 'description': _phrase(rng, 12),
+                    'due_date': due.replace(hour=0, minute=0, second=0, microsecond=0) if due else None,
+                    'status_id': 2 if done else 1, 'priority_id': rng.choice(priority_ids) if priority_ids else None,
+                    'subject_id': subject_id, 'user_id': rng.choice(members),
+                    'completed_at': now - timedelta(days=rng.randint(0, 40)) if done else None,
+                    'estimated_minutes': rng.choice((None, 30, 45, 60, 90, 120)),
+                })
+                for tag_id in rng.sample(tag_ids, rng.randint(0, min(shape['max_tags_per_task'], len(tag_ids)))):
+                    rows['task_tags'].append({'task_id': task_id, 'tag_id': tag_id})
+                task_id += 1
+
+            for _ in range(shape['messages_per_subject']):
+                rows['message'].append({'content': _phrase(rng, rng.randint(3, 25)), 'sender_id': rng.choice(members),
+                                        'subject_id': subject_id,
+                                        'timestamp': now - timedelta(minutes=rng.randint(0, 60 * 24 * 60))})
+            for _ in range(shape['sessions_per_subject']):
+                rows['study_session'].append({'duration': rng.choice((15, 25, 30, 45, 60, 90)), 'subject_id': subject_id,
+                                              'user_id': rng.choice(members),
+                                              'timestamp': now - timedelta(minutes=rng.randint(0, 60 * 24 * 60))})
+            subject_id += 1
+
+    # Parents before children so the foreign keys hold
+    tables = {'user': User.__table__, 'subject': Subject.__table__, 'subject_member': SubjectMember.__table__,
+              'task': Task.__table__, 'task_tags': task_tags, 'message': Message.__table__,
+              'study_session': StudySession.__table__}
+    for name, table in tables.items():
+        batch = rows[name]
+        for start in range(0, len(batch), chunk_size):
+            db.session.execute(insert(table), batch[start:start + chunk_size])
+        db.session.commit()
+
+    rebuild_counters()
+    backfill_rollups()
+    return {name: len(batch) for name, batch in rows.items()}
@@ -0,0 +1,303 @@
+import csv
+import io
+import json
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import select, insert, func
+from extensions import db
+from model.models import (Subject, SubjectMember, Task, Tag, Priority, Color, Message, StudySession,
+                          User, task_tags, get_nzt_now)
+from model.analytics import add_to_rollups
+from model.archive import iter_archived
+from model.counters import bump_counters
+from model.lookups import lookups
+from model.queries import visible_subject_ids
+from model.scheduler import plan_cache
+from utils import parse_date, parse_positive_int
+
+"""
+Bulk import/export for W Notes+ (CSV and NDJSON).
+Export streams rows straight off server-side cursors through generators, so memory stays flat.
+Import reads rows one at a time, resolves subjects/priorities/tags from maps built once,
+and writes in chunked executemany batches.
+"""
+
+EXPORT_BATCH_SIZE = 1000
+IMPORT_CHUNK_SIZE = 1000
+
+CSV_FIELDS = ['type', 'subject', 'color', 'title', 'description', 'due_date', 'priority', 'tags',
+              'status', 'estimated_minutes', 'content', 'sender', 'timestamp', 'duration']
+
+STATUS_LABELS = {1: 'pending', 2: 'completed'}
+
+def _stream(stmt):
+    """Executes a Core select on a server-side cursor, yielding mapping rows in batches."""
+    result = db.session.execute(stmt, execution_options={'yield_per': EXPORT_BATCH_SIZE})
+    for row in result.mappings():
+        yield row
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+def _archived(kind, user_id):
+    """(subject name, row) for archived notes/sessions in scope, names looked up once per subject."""
+    names = {}
+    scope = None if user_id is None else visible_subject_ids(user_id)
+    for subject_id, row in iter_archived(kind, scope):
+        if subject_id not in names:
+            names[subject_id] = db.session.query(Subject.name).filter_by(subject_id=subject_id).scalar()
+        yield names[subject_id], row
+
+def export_records(user_id=None):
+    """
+    Yields one dict per subject, task, note and session (subjects first so imports can resolve names).
+    user_id limits the export to subjects that user can see, None exports everything (CLI).
+    """
+    def scoped(stmt, subject_col):
+        return stmt if user_id is None else stmt.where(subject_col.in_(visible_subject_ids(user_id)))
+
+    subjects = scoped(select(Subject.subject_id, Subject.name.label('subject'), Color.name.label('color'))
+                      .outerjoin(Color, Color.id == Subject.color_id)
+                      .order_by(Subject.subject_id), Subject.subject_id)
+    for row in _stream(subjects):
+        yield {'type': 'subject', 'subject': row['subject'], 'color': row['color']}
+
+    # Tags come back pre-joined with group_concat instead of a lookup per task
+    tags = (select(task_tags.c.task_id, func.group_concat(Tag.name, ';').label('tags'))
+            .join(Tag, Tag.tag_id == task_tags.c.tag_id)
+            .group_by(task_tags.c.task_id)
+            .subquery())
+    tasks = scoped(select(Subject.name.label('subject'), Task.title, Task.description, Task.due_date,
+                          Priority.level.label('priority'), tags.c.tags, Task.status_id, Task.estimated_minutes)
+                   .join(Subject, Subject.subject_id == Task.subject_id)
+                   .outerjoin(Priority, Priority.id == Task.priority_id)
+                   .outerjoin(tags, tags.c.task_id == Task.task_id)
+                   .order_by(Task.task_id), Task.subject_id)
+    for row in _stream(tasks):
+        yield {'type': 'task', 'subject': row['subject'], 'title': row['title'],
+               'description': row['description'],
+               'due_date': row['due_date'].date().isoformat() if row['due_date'] else None,
+               'priority': row['priority'], 'tags': row['tags'] or '',
+               'status': STATUS_LABELS.get(row['status_id'], 'pending'),
+               'estimated_minutes': row['estimated_minutes']}
+
+    messages = scoped(select(Subject.name.label('subject'), Message.content, User.username.label('sender'), Message.timestamp)
+                      .join(Subject, Subject.subject_id == Message.subject_id)
+                      .join(User, User.user_id == Message.sender_id)
+                      .order_by(Message.message_id), Message.subject_id)
+    # Archived notes/sessions are older than every live row, so they go first
+    for subject, row in _archived('message', user_id):
+        yield {'type': 'note', 'subject': subject, 'content': row.content,
+               'sender': row.sender.username, 'timestamp': _iso(row.timestamp)}
+    for row in _stream(messages):
+        yield {'type': 'note', 'subject': row['subject'], 'content': row['content'],
+               'sender': row['sender'], 'timestamp': _iso(row['timestamp'])}
+
+    sessions = scoped(select(Subject.name.label('subject'), StudySession.duration, StudySession.timestamp)
+                      .join(Subject, Subject.subject_id == StudySession.subject_id)
+                      .order_by(StudySession.id), StudySession.subject_id)
+    for subject, row in _archived('session', user_id):
+        yield {'type': 'session', 'subject': subject, 'duration': row.duration, 'timestamp': _iso(row.timestamp)}
+    for row in _stream(sessions):
+        yield {'type': 'session', 'subject': row['subject'], 'duration': row['duration'],
+               'timestamp': _iso(row['timestamp'])}
+
+def export_ndjson(user_id=None):
+    """Generator of NDJSON lines."""
+    for record in export_records(user_id):
+        yield json.dumps(record) + "\n"
+
+def export_csv(user_id=None):
+    """Generator of CSV text, one chunk per row, header first."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for record in export_records(user_id):
+        writer.writerow(record)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def read_records(stream, fmt):
+    """Yields dicts from a text stream of CSV or NDJSON, one line at a time."""
+    if fmt == 'csv':
+        for row in csv.DictReader(stream):
+            yield row
+        return
+    for line in stream:
+        line = line.strip()
+        if line:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            # Anything but an object (a list, a bare number) is counted as a skipped row
+            yield record if isinstance(record, dict) else {'type': None}
+
+def _parse_timestamp(raw):
+    """ISO timestamps from our own exports, plain dates via utils.parse_date."""
+    if not raw:
+        return None
+    try:
+        return datetime.fromisoformat(raw)
+    except ValueError:
+        return parse_date(raw)
+
+def _text(record, key):
+    """A field as text. NDJSON values can be any JSON type: numbers are read as text, lists/objects as empty."""
+    value = record.get(key)
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return ''
+
+class Importer:
+    """
+    Imports records for one user. Subjects are matched by name among the user's own subjects
+    (created when missing), priorities/tags by name from the lookup cache.
+    """
+
+    def __init__(self, user_id, chunk_size=IMPORT_CHUNK_SIZE):
+        self.user_id = user_id
+        self.chunk_size = chunk_size
+        # Maps built once up front, never per row
+        self.priorities = {p.level.lower(): p.id for p in lookups.priorities()}
+        self.default_priority = self.priorities.get('normal') or next(iter(self.priorities.values()), None)
+        self.tags = {t.name.lower(): t.tag_id for t in lookups.tags()}
+        self.colors = {c.name.lower(): c.id for c in lookups.colors()}
+        self.subjects = {name.lower(): sid for sid, name in
+                         db.session.query(Subject.subject_id, Subject.name).filter(Subject.user_id == user_id)}
+        self.pending = {'task': [], 'note': [], 'session': []}
+        self.report = Counter()
+
+    def _subject_id(self, record):
+        name = _text(record, 'subject').strip()
+        if not name:
+            return None
+        key = name.lower()
+        if key not in self.subjects:
+            color_id = self.colors.get(_text(record, 'color').lower()) or next(iter(self.colors.values()), None)
+            subject = Subject(name=name[:50], color_id=color_id, user_id=self.user_id)
+            db.session.add(subject)
+            db.session.flush()
+            db.session.add(SubjectMember(user_id=self.user_id, subject_id=subject.subject_id, status='accepted'))
+            self.subjects[key] = subject.subject_id
+            self.report['subjects_created'] += 1
+        return self.subjects[key]
+
+    def add(self, record):
+        """Validates one record and queues it, flushing a chunk when full."""
+        kind = record.get('type')
+        subject_id = self._subject_id(record) if kind in ('subject', 'task', 'note', 'session') else None
+        if subject_id is None:
+            self.report['skipped'] += 1
+            return
+        if kind == 'subject':
+            return
+
+        if kind == 'task':
+            title = _text(record, 'title').strip()
+            if not title:
+                self.report['skipped'] += 1
+                return
+            status_id = 2 if _text(record, 'status').lower() == 'completed' else 1
+            tag_names = [t.strip().lower() for t in _text(record, 'tags').split(';') if t.strip()]
+            unknown = sum(1 for t in tag_names if t not in self.tags)
+            if unknown:
+                self.report['unknown_tags'] += unknown
+            self.pending['task'].append({
+                'row': {'title': title[:50], 'description': _text(record, 'description') or None,
+                        'due_date': parse_date(_text(record, 'due_date')), 'status_id': status_id,
+                        'priority_id': self.priorities.get(_text(record, 'priority').lower(), self.default_priority),
+                        'subject_id': subject_id, 'user_id': self.user_id,
+                        'estimated_minutes': parse_positive_int(record.get('estimated_minutes'))},
+                'tags': [self.tags[t] for t in dict.fromkeys(tag_names) if t in self.tags],
+            })
+        elif kind == 'note':
+            content = _text(record, 'content').strip()
+            if not content:
+                self.report['skipped'] += 1
+                return
+            self.pending['note'].append({'content': content, 'sender_id': self.user_id, 'subject_id': subject_id,
+                                         'timestamp': _parse_timestamp(_text(record, 'timestamp')) or get_nzt_now()})
+        else:
+            duration = parse_positive_int(record.get('duration'))
+            if duration is None:
+                self.report['skipped'] += 1
+                return
+            self.pending['session'].append({'duration': duration, 'subject_id': subject_id, 'user_id': self.user_id,
+                                            'timestamp': _parse_timestamp(_text(record, 'timestamp')) or get_nzt_now()})
+
+        if len(self.pending[kind]) >= self.chunk_size:
+            self.flush(kind)
+
+    def flush(self, kind):
+        """Writes one queued chunk with executemany-style batched inserts and commits it."""
+        batch = self.pending[kind]
+        if not batch:
+            return
+        self.pending[kind] = []
+
+        if kind == 'task':
+            # RETURNING in parameter order gives the new ids for the tag links
+            stmt = insert(Task.__table__).returning(Task.__table__.c.task_id, sort_by_parameter_order=True)
+            ids = db.session.execute(stmt, [item['row'] for item in batch]).scalars().all()
+            links = [{'task_id': task_id, 'tag_id': tag_id}
+                     for task_id, item in zip(ids, batch) for tag_id in item['tags']]
+            if links:
+                db.session.execute(task_tags.insert(), links)
+            active = Counter(item['row']['subject_id'] for item in batch if item['row']['status_id'] == 1)
+            completed = Counter(item['row']['subject_id'] for item in batch if item['row']['status_id'] == 2)
+            for subject_id in set(active) | set(completed):
+                bump_counters(subject_id, active_task_count=active[subject_id], completed_task_count=completed[subject_id])
+        elif kind == 'note':
+            db.session.execute(insert(Message.__table__), batch)
+            for subject_id, n in Counter(row['subject_id'] for row in batch).items():
+                bump_counters(subject_id, message_count=n)
+        else:
+            db.session.execute(insert(StudySession.__table__), batch)
+            minutes = Counter()
+            buckets = {}
+            for row in batch:
+                minutes[row['subject_id']] += row['duration']
+                key = (self.user_id, row['subject_id'], row['timestamp'].date())
+                m, n, t = buckets.get(key, (0, 0, 0))
+                buckets[key] = (m + row['duration'], n + 1, t)
+            for subject_id, total in minutes.items():
+                bump_counters(subject_id, study_minutes=total)
+            add_to_rollups(buckets)
+
+        db.session.commit()
+        self.report[kind + 's'] += len(batch)
+
+    def finish(self):
+        for kind in self.pending:
+            self.flush(kind)
+        db.session.commit()
+        plan_cache.invalidate(self.user_id)
+        return dict(self.report)
+
+class ImportFileError(ValueError):
+    """The upload couldn't be read to the end (not UTF-8, broken CSV). report has what got imported before it."""
+
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
+
+def import_records(user_id, records, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Imports an iterable of records for user_id. Returns counts of what was written/skipped.
+    Earlier chunks are already committed when a bad spot in the file turns up, so the rows read
+    before it are kept and ImportFileError reports them.
+    """
+    importer = Importer(user_id, chunk_size)
+    try:
+        for record in records:
+            importer.add(record)
+    except UnicodeDecodeError as e:
+        raise ImportFileError("File isn't UTF-8 text.", importer.finish()) from e
+    except csv.Error as e:
+        raise ImportFileError(f"Couldn't read the CSV: {e}.", importer.finish()) from e
+    return importer.finish()
@@ -0,0 +1,117 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+"""
+Password hashing off the request thread for W Notes+.
+Hashes and checks run on a small bounded pool (hashlib's scrypt/pbkdf2 release the GIL, so threads
+really do run in parallel). When every worker is busy and the queue is full the call fails straight
+away with PasswordPoolBusy, which the auth routes turn into a 503 instead of stalling every other request.
+"""
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+# werkzeug fills in missing parameters, spell them out so stored hash prefixes compare equal
+METHOD_DEFAULTS = {
+    'scrypt': ['scrypt', '32768', '8', '1'],
+    'pbkdf2': ['pbkdf2', 'sha256', str(DEFAULT_PBKDF2_ITERATIONS)],
+}
+
+class PasswordPoolBusy(Exception):
+    """No free worker or queue slot for a hash, the caller should answer 503."""
+
+def normalize_method(method):
+    """'scrypt' -> 'scrypt:32768:8:1' etc., the exact prefix werkzeug writes into the stored hash."""
+    parts = method.split(':')
+    if parts[0] not in METHOD_DEFAULTS:
+        raise ValueError(f"Unsupported password hash method: {method}")
+    return ':'.join(parts + METHOD_DEFAULTS[parts[0]][len(parts):])
+
+def needs_rehash(stored_hash, method):
+    """True when a stored hash was made with different parameters than method."""
+    return stored_hash.split('$', 1)[0] != method
+
+# Module level so a process pool can pickle them
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+def _verify(stored_hash, password, method):
+    """(matches, upgraded hash or None) - the rehash rides along in the same job as the check."""
+    if not check_password_hash(stored_hash, password):
+        return False, None
+    if needs_rehash(stored_hash, method):
+        return True, generate_password_hash(password, method=method)
+    return True, None
+
+class PasswordHasher:
+    """Bounded executor for password work, configured from the app (PASSWORD_* settings)."""
+
+    def __init__(self):
+        self.method = DEFAULT_METHOD
+        self.workers = os.cpu_count() or 1
+        self.queue_size = self.workers * 4
+        self.timeout = 10
+        self.kind = 'thread'
+        self.rejected = 0
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+
+    def init_app(self, app):
+        """Reads the settings. The pool itself starts on first use, so CLI apps never spawn one."""
+        self.shutdown()
+        self.method = normalize_method(app.config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD))
+        self.workers = app.config.get('PASSWORD_POOL_WORKERS') or os.cpu_count() or 1
+        queue_size = app.config.get('PASSWORD_POOL_QUEUE')
+        self.queue_size = self.workers * 4 if queue_size is None else queue_size
+        self.timeout = app.config.get('PASSWORD_POOL_TIMEOUT', 10)
+        self.kind = app.config.get('PASSWORD_POOL_KIND', 'thread')
+        if self.kind not in ('thread', 'process'):
+            raise ValueError(f"PASSWORD_POOL_KIND must be 'thread' or 'process', not {self.kind!r}")
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                pool = ThreadPoolExecutor if self.kind == 'thread' else ProcessPoolExecutor
+                kwargs = {'thread_name_prefix': 'password'} if self.kind == 'thread' else {}
+                self._executor = pool(max_workers=self.workers, **kwargs)
+            return self._executor
+
+    def submit(self, fn, *args):
+        """Queues fn(*args) if a slot is free (running + waiting <= workers + queue), else PasswordPoolBusy."""
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PasswordPoolBusy()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _run(self, fn, *args):
+        try:
+            return self.submit(fn, *args).result(timeout=self.timeout)
+        except FutureTimeout:
+            # Still queued behind a backlog, give up rather than pin the request thread
+            raise PasswordPoolBusy() from None
+
+    def hash(self, password):
+        """New hash with the configured method."""
+        return self._run(_hash, password, self.method)
+
+    def verify(self, stored_hash, password):
+        """(matches, new_hash). new_hash is set when the stored one should be replaced with it."""
+        return self._run(_verify, stored_hash, password, self.method)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+password_hasher = PasswordHasher()
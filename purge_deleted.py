@@ -0,0 +1,10 @@
+from run import create_app
+from model.deletion import purge_orphans
+
+"""Finishes purging rows left behind by deleted subjects (e.g. after a restart mid-purge)."""
+
+if __name__ == "__main__":
+    app = create_app(routes=False)
+    with app.app_context():
+        removed = purge_orphans()
+        print(f"Purged {removed} orphaned rows.")
@@ -0,0 +1,62 @@
+import queue
+import threading
+
+"""
+In-process pub/sub fanout for W Notes+.
+send_message publishes new notes here and each open stream for that subject gets a copy.
+Only reaches listeners in the same process, streams poll the feed for notes posted on other workers.
+"""
+
+class Listener(queue.Queue):
+    """One open stream's queue. overflowed is set when it fell behind and got dropped from the fanout."""
+
+    def __init__(self, maxsize):
+        super().__init__(maxsize=maxsize)
+        self.overflowed = False
+
+class Broker:
+    """Fans published events out to bounded per-listener queues, keyed by subject."""
+
+    def __init__(self, max_queue=100):
+        self._lock = threading.Lock()
+        self._listeners = {}
+        self.max_queue = max_queue
+
+    def subscribe(self, subject_id):
+        """Returns a queue that receives every event published for subject_id."""
+        listener = Listener(self.max_queue)
+        with self._lock:
+            self._listeners.setdefault(subject_id, set()).add(listener)
+        return listener
+
+    def unsubscribe(self, subject_id, listener):
+        with self._lock:
+            listeners = self._listeners.get(subject_id)
+            if listeners:
+                listeners.discard(listener)
+                if not listeners:
+                    del self._listeners[subject_id]
+
+    def publish(self, subject_id, event):
+        """
+        Delivers event to current listeners without blocking the sender.
+        A listener that is full is flagged and unsubscribed instead of silently skipping the event,
+        its stream drains what it has and ends, and the client reconnects from its Last-Event-ID.
+        """
+        with self._lock:
+            listeners = list(self._listeners.get(subject_id, ()))
+        for listener in listeners:
+            try:
+                listener.put_nowait(event)
+            except queue.Full:
+                listener.overflowed = True
+                self.unsubscribe(subject_id, listener)
+        return len(listeners)
+
+    def listener_count(self, subject_id=None):
+        with self._lock:
+            if subject_id is None:
+                return sum(len(l) for l in self._listeners.values())
+            return len(self._listeners.get(subject_id, ()))
+
+message_broker = Broker()
@@ -0,0 +1,10 @@
+from run import create_app
+from model.counters import rebuild_counters
+
+"""Recomputes the denormalized per-subject counters from scratch."""
+
+if __name__ == "__main__":
+    app = create_app(routes=False)
+    with app.app_context():
+        updated = rebuild_counters()
+        print(f"Rebuilt counters for {updated} subjects.")
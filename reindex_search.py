@@ -0,0 +1,10 @@
+from run import create_app
+from model.search import reindex
+
+"""Rebuilds the full-text search indexes for tasks and notes in one bulk pass."""
+
+if __name__ == "__main__":
+    app = create_app(routes=False)
+    with app.app_context():
+        reindex()
+        print("Search index rebuilt.")
@@ -1,10 +1,23 @@
-from run import app
+from run import create_app
 from extensions import db
+from migrate_db import stamp_latest
+from model.lookups import lookups
+from model.scheduler import plan_cache
+from cache import fragment_cache
 
-def resetdb():
+def resetdb(app=None):
+    """Drops and recreates every table on app (a DB-only app by default)."""
+    app = app or create_app(routes=False)
     with app.app_context():
         db.drop_all()
         db.create_all()
+        # Fresh schema already has every migration baked in
+        stamp_latest()
+        # Lookup rows were dropped with the tables
+        lookups.invalidate()
+        plan_cache.invalidate()
+        # Version stamps restart at 0, old fragments would match them
+        fragment_cache.clear()
         print("Database reset and seeded successfully.")
 
 if __name__ == "__main__":
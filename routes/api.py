@@ -0,0 +1,88 @@
+from flask import Blueprint, request, session, jsonify, current_app, Response, stream_with_context
+from compression import negotiate, encode_stream
+from model.api import (RESOURCES, TASK_STATUSES, API_PAGE_SIZE, API_MAX_PAGE_SIZE, ApiError,
+                       parse_fields, decode_cursor, build_select, stream_page)
+from utils import parse_positive_int
+
+"""
+Read-only JSON API, version 1.
+Subjects, tasks, notes and study sessions for the mobile client, keyset paged:
+
+    GET /api/v1/tasks?fields=id,title,tags&subject_id=3&status=pending&limit=100&after=<next_cursor>
+
+Signed in with the same session cookie as the site. Responses are streamed (gzipped when asked for).
+"""
+
+api_v1_bp = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+@api_v1_bp.before_request
+def require_session():
+    """JSON 401 instead of the site's redirect to the signin page."""
+    if 'user_id' not in session:
+        return jsonify(error="sign in required"), 401
+
+@api_v1_bp.errorhandler(ApiError)
+def bad_request(e):
+    return jsonify(error=str(e)), 400
+
+def _int_arg(name):
+    raw = request.args.get(name, '')
+    if not raw:
+        return None
+    value = parse_positive_int(raw)
+    if value is None:
+        raise ApiError(f"{name} must be a positive whole number")
+    return value
+
+def _list(resource, filters=()):
+    """Validates the query string up front, then streams the page."""
+    fields = parse_fields(resource, request.args.get('fields'))
+    after = decode_cursor(resource, request.args.get('after'))
+    limit = min(max(_int_arg('limit') or API_PAGE_SIZE, 1), API_MAX_PAGE_SIZE)
+    options = {}
+    if 'subject_id' in filters:
+        options['subject_id'] = _int_arg('subject_id')
+    if 'status' in filters and request.args.get('status'):
+        if request.args['status'] not in TASK_STATUSES:
+            raise ApiError(f"status must be one of {', '.join(TASK_STATUSES)}")
+        options['status'] = request.args['status']
+
+    stmt = build_select(resource, session['user_id'], fields, after, limit, **options)
+    body = stream_page(resource, stmt, fields, limit)
+    # The after_request compressor leaves streamed bodies alone, so compress this one as it goes out
+    config = current_app.config
+    encoding = negotiate() if config['COMPRESS_ENABLED'] else None
+    if encoding:
+        body = encode_stream(body, encoding, config['COMPRESS_LEVEL'], config['COMPRESS_BROTLI_QUALITY'])
+    response = Response(stream_with_context(body), mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@api_v1_bp.route('/')
+def index():
+    """Resources with their fields and defaults, so clients can build ?fields= lists."""
+    return jsonify({name: {'fields': list(res.fields), 'default': list(res.default)} for name, res in RESOURCES.items()})
+
+@api_v1_bp.route('/subjects')
+def subjects():
+    """Subjects the user owns or has joined, by id."""
+    return _list('subjects')
+
+@api_v1_bp.route('/tasks')
+def tasks():
+    """Tasks in visible subjects by id, optionally for one subject and/or status."""
+    return _list('tasks', ('subject_id', 'status'))
+
+@api_v1_bp.route('/notes')
+def notes():
+    """Notes in visible subjects, newest first."""
+    return _list('notes', ('subject_id',))
+
+@api_v1_bp.route('/sessions')
+def sessions():
+    """Study sessions in visible subjects, newest first."""
+    return _list('sessions', ('subject_id',))
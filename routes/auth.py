@@ -1,16 +1,24 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy import or_
 from extensions import db
 from model.models import User
+from passwords import password_hasher, PasswordPoolBusy
 
 """
 Authentication Blueprint.
 Handles registration, login, and secure logout logic using hashed passwords.
+Hashing runs on the bounded pool in passwords.py, a full pool answers 503 straight away.
 """
 
 auth_bp = Blueprint('auth', __name__)
 
+@auth_bp.errorhandler(PasswordPoolBusy)
+def hashing_busy(e):
+    """Too many logins at once - tell the browser to retry shortly instead of queueing forever."""
+    response = render_template('error.html', code=503, message="busy signing people in",
+                               description="Lots of logins right now. Please try again in a moment.")
+    return response, 503, {'Retry-After': '2'}
+
 @auth_bp.route('/signup', methods=['GET', 'POST'])
 def signup():
     """Creates a new user account if the username/email is unique."""
@@ -25,8 +33,8 @@ def signup():
             flash("Username or email already in use. Login instead?")
             return redirect(url_for('auth.signup'))
 
-        # Securely hash password before storing in the DB
-        hashed_password = generate_password_hash(password)
+        # Securely hash password before storing in the DB (on the hashing pool)
+        hashed_password = password_hasher.hash(password)
         new_user = User(username=user, email=email_address, password_hash=hashed_password)
         
         try:
@@ -51,7 +59,12 @@ def signin():
         record = User.query.filter(or_(User.username == login_identifier, User.email == login_identifier)).first()
         
         # Check if password matches the hash we have on file
-        if record and check_password_hash(record.password_hash, pwd):
+        matches, new_hash = password_hasher.verify(record.password_hash, pwd) if record else (False, None)
+        if matches:
+            if new_hash:
+                # Hash settings changed since this one was stored, swap in the upgraded hash
+                record.password_hash = new_hash
+                db.session.commit()
             session['user_id'] = record.user_id
             return redirect(url_for('main.dashboard'))
         
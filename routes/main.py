@@ -1,7 +1,23 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, abort
+import json
+import queue
+import time
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, session, abort, jsonify, Response, current_app,
+                   make_response)
+from sqlalchemy.exc import IntegrityError
 from extensions import db
-from model.models import User, Subject, SubjectMember, Task, Message, Color, Priority, StudySession
-from utils import login_required
+from model.models import User, Subject, SubjectMember, Task, Message, StudySession
+from model.lookups import lookups
+from model.counters import bump_counters
+from model.analytics import record_session
+from model.scheduler import plan_cache
+from model.deletion import remove_subject
+from model.notifications import notify, notify_subject
+from model.queries import (get_subject_versions, get_pending_invite_ids, get_dashboard_data,
+                           get_task_page, get_message_page, get_session_page,
+                           has_subject_access, get_messages_after, message_to_dict, suggest_usernames)
+from cache import fragment_cache
+from realtime import message_broker
+from utils import login_required, make_etag, not_modified, set_validators, parse_positive_int
 
 """
 Main Application Blueprint.
@@ -28,31 +44,40 @@ def index():
 def dashboard():
     """Renders the main study hub showing owned and joined subjects."""
     user_id = session['user_id']
-    user = db.session.get(User, user_id)
-    
-    # Grab subjects the user owns and subjects they've been invited to
-    owned_subs = Subject.query.filter_by(user_id=user_id).all()
-    # 3NF: Filter memberships where the user has actually joined (status: accepted)
-    others_memberships = SubjectMember.query.filter(SubjectMember.user_id == user_id, SubjectMember.status == 'accepted').all()
-    shared_subs = [m.subject for m in others_memberships if m.subject.user_id != user_id]
-    
-    all_subjects = owned_subs + shared_subs
-    # Separate list for notifications bar
-    pending_invites = SubjectMember.query.filter_by(user_id=user_id, status='pending').all()
-
-    # Pre-calculate active task counts for each subject card for the UI
-    subject_list = []
-    for s in all_subjects:
-        active_count = Task.query.filter_by(subject_id=s.subject_id).filter(Task.status_id != 2).count()
-        subject_list.append({'obj': s, 'active_count': active_count})
-    
-    return render_template('home.html', username=user.username, subjects=subject_list, invites=pending_invites)
+    # Subject versions + invite ids are all the ETag needs, nothing else is loaded for a 304
+    subjects = get_subject_versions(user_id)
+    invite_ids = get_pending_invite_ids(user_id)
+    generation = lookups.stats()['invalidations']
+    etag = make_etag('dashboard', user_id, generation, subjects, invite_ids)
+    # Pages carrying a flash message must render (and must not be revalidated later)
+    cacheable = '_flashes' not in session
+    if cacheable:
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+    # Owned subjects first, then shared ones, same order the dashboard always used
+    ordered = sorted(subjects, key=lambda s: (s.user_id != user_id, s.subject_id))
+    # Cards are cached per subject version, the loader only fetches the misses (one query, none when all are cached)
+    keys = {s.subject_id: ('card', s.subject_id, s.version, s.name, s.color_id, generation) for s in ordered}
+    data = get_dashboard_data(user_id, subject_ids=fragment_cache.missing(keys), invite_ids=invite_ids)
+    loaded = {item['obj'].subject_id: item['obj'] for item in data['subjects']}
+    def render_card(subject_id):
+        # evicted between the check and now: load it on its own
+        subject = loaded.get(subject_id) or get_dashboard_data(user_id, [subject_id], [])['subjects'][0]['obj']
+        return render_template('_subject_card.html', subject=subject)
+    cards = [fragment_cache.render(keys[s.subject_id], lambda sid=s.subject_id: render_card(sid)) for s in ordered]
+
+    response = make_response(render_template('home.html', username=data['user'].username, cards=cards,
+                                             invites=data['invites']))
+    return set_validators(response, etag) if cacheable else response
 
 @main_bp.route('/add_subject', methods=['GET', 'POST'])
 @login_required
 def add_subject():
     """Creates a new subject and automatically joins the creator as a member."""
-    available_colors = Color.query.all()
+    # Colors come from the in-process lookup cache
+    available_colors = lookups.colors()
     if request.method == 'POST':
         name = request.form.get('name').strip()
         color_id = request.form.get('color_id')
@@ -81,32 +106,70 @@ def add_subject():
 def view_subject(subject_id):
     """Displays the specific workspace for a subject, including tasks and chat."""
     user_id = session['user_id']
-    subject = db.session.get(Subject, subject_id) or abort(404)
-    membership = SubjectMember.query.filter_by(user_id=user_id, subject_id=subject_id, status='accepted').first()
-    
+    # One small query covers the permission check, the move targets and the ETag
+    subjects = get_subject_versions(user_id)
+    subject = next((s for s in subjects if s.subject_id == subject_id), None)
+
     # Permission check: You must be the owner or an accepted collaborator
-    if subject.user_id != user_id and not membership:
+    if subject is None:
+        db.session.get(Subject, subject_id) or abort(404)
         flash("Access denied.")
         return redirect(url_for('main.dashboard'))
-    
-    # 2NF logic: Sort tasks by status first, then importance using the Priority weight
-    sorted_tasks = Task.query.join(Priority).filter(Task.subject_id == subject_id).order_by(Task.status_id.asc(), Priority.weight.asc()).all()
-    # Pull messages for the collaboration feed
-    messages = Message.query.filter_by(subject_id=subject_id).order_by(Message.timestamp.asc()).all()
-    
-    return render_template('viewsubject.html', subject=subject, tasks=sorted_tasks, messages=messages)
+
+    tasks_after = request.args.get('tasks_after')
+    notes_before = request.args.get('notes_before')
+    history_before = request.args.get('history_before')
+    generation = lookups.stats()['invalidations']
+    etag = make_etag('subject', user_id, generation, subjects, tasks_after, notes_before, history_before)
+    cacheable = '_flashes' not in session
+    if cacheable:
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+    # 2NF logic: tasks sorted by status then Priority weight, each list paged by keyset cursors.
+    # Fragments are cached per subject version, so a list is only queried/rendered after it changes.
+    # Subject ids are never reused (AUTOINCREMENT), so a deleted subject's fragments can't resurface under a new one.
+    page = (subject_id, subject.version, generation, tasks_after, notes_before, history_before)
+    def render_tasks():
+        tasks, next_tasks = get_task_page(subject_id, after=tasks_after)
+        return render_template('_tasks.html', subject=subject, tasks=tasks, next_tasks=next_tasks)
+    def render_notes():
+        messages, older_notes = get_message_page(subject_id, before=notes_before)
+        return render_template('_notes.html', subject=subject, messages=messages, older_notes=older_notes)
+    def render_history():
+        sessions, older_history = get_session_page(subject_id, before=history_before)
+        return render_template('_history.html', subject=subject, sessions=sessions, older_history=older_history)
+
+    # Choices for the batch task form
+    batch_options = {
+        'move_targets': sorted(((s.subject_id, s.name) for s in subjects), key=lambda pair: pair[1]),
+        'priorities': lookups.priorities(),
+        'tags': lookups.tags(),
+    }
+
+    response = make_response(render_template(
+        'viewsubject.html', subject=subject,
+        # the task list has per-viewer checkboxes, notes and history are the same for everyone
+        tasks_html=fragment_cache.render(('tasks', user_id) + page, render_tasks),
+        notes_html=fragment_cache.render(('notes',) + page, render_notes),
+        history_html=fragment_cache.render(('history',) + page, render_history),
+        **batch_options))
+    return set_validators(response, etag) if cacheable else response
 
 @main_bp.route('/log_session/<int:subject_id>', methods=['POST'])
 @login_required
 def log_session(subject_id):
     """Logs study session duration for a subject."""
-    duration_raw = request.form.get('duration')
     # Validate that study time is a positive number
-    if not duration_raw or not duration_raw.isdigit() or int(duration_raw) <= 0:
+    duration = parse_positive_int(request.form.get('duration'))
+    if duration is None:
         flash("Can't log 0 minutes.")
     else:
-        new_session = StudySession(duration=int(duration_raw), subject_id=subject_id)
+        new_session = StudySession(duration=duration, subject_id=subject_id, user_id=session['user_id'])
         db.session.add(new_session)
+        bump_counters(subject_id, study_minutes=duration)
+        record_session(session['user_id'], subject_id, duration)
         db.session.commit()
     return redirect(url_for('main.view_subject', subject_id=subject_id))
 
@@ -114,14 +177,114 @@ def log_session(subject_id):
 @login_required
 def send_message(subject_id):
     """Sends a message to the subject collaboration feed."""
+    subject = db.session.get(Subject, subject_id) or abort(404)
+    if not has_subject_access(subject, session['user_id']):
+        abort(403)
+    wants_json = request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
     content = request.form.get('content')
     # Prevent empty or whitespace-only messages
     if content and content.strip():
         new_msg = Message(content=content, sender_id=session['user_id'], subject_id=subject_id)
         db.session.add(new_msg)
+        bump_counters(subject_id, message_count=1)
+        # Everyone else in the subject hears about it from the job queue, not this request
+        notify_subject(subject_id, 'note', exclude_user_id=session['user_id'],
+                       subject=subject.name, message_id=new_msg.message_id, preview=content[:100])
         db.session.commit()
+        # Push to anyone streaming this subject's notes
+        payload = message_to_dict(new_msg)
+        message_broker.publish(subject_id, payload)
+        if wants_json:
+            return jsonify(payload), 201
+    elif wants_json:
+        return jsonify(error="Message can't be empty."), 400
     return redirect(url_for('main.view_subject', subject_id=subject_id))
 
+def _feed_cursor():
+    """message_id cursor from ?after= or the EventSource reconnect header."""
+    raw = request.args.get('after') or request.headers.get('Last-Event-ID')
+    return parse_positive_int(raw, 0)
+
+@main_bp.route('/subject/<int:subject_id>/messages')
+@login_required
+def message_feed(subject_id):
+    """Incremental notes feed: only messages after the ?after=<message_id> cursor."""
+    subject = db.session.get(Subject, subject_id) or abort(404)
+    if not has_subject_access(subject, session['user_id']):
+        abort(403)
+    messages = [message_to_dict(m) for m in get_messages_after(subject_id, _feed_cursor())]
+    last_id = messages[-1]['message_id'] if messages else _feed_cursor()
+    return jsonify(messages=messages, last_id=last_id)
+
+@main_bp.route('/subject/<int:subject_id>/stream')
+@login_required
+def message_stream(subject_id):
+    """
+    Server-sent events stream of new notes, fed by the in-process broker.
+    The broker only hears this worker's posts, so the stream also polls the feed once per keepalive
+    for notes that other workers wrote.
+    """
+    subject = db.session.get(Subject, subject_id) or abort(404)
+    if not has_subject_access(subject, session['user_id']):
+        abort(403)
+
+    # Subscribe before reading the backlog so nothing slips through the gap
+    listener = message_broker.subscribe(subject_id)
+    backlog = [message_to_dict(m) for m in get_messages_after(subject_id, _feed_cursor())]
+    last_seen = backlog[-1]['message_id'] if backlog else _feed_cursor()
+    lifetime = current_app.config['FEED_STREAM_SECONDS']
+    keepalive = current_app.config['FEED_KEEPALIVE_SECONDS']
+    app = current_app._get_current_object()
+
+    def to_sse(payload):
+        return f"id: {payload['message_id']}\nevent: message\ndata: {json.dumps(payload)}\n\n"
+
+    def poll():
+        # The generator runs after the request is gone, each poll gets its own context (and session)
+        with app.app_context():
+            return [message_to_dict(m) for m in get_messages_after(subject_id, last_seen)]
+
+    def events():
+        nonlocal last_seen
+        try:
+            yield "retry: 3000\n\n"
+            for payload in backlog:
+                yield to_sse(payload)
+            # Streams end after a while, EventSource reconnects with Last-Event-ID
+            now = time.monotonic()
+            deadline, next_poll = now + lifetime, now + keepalive
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                # Fell behind and missed a note: end here, the reconnect catches up from Last-Event-ID
+                if listener.overflowed and listener.empty():
+                    break
+                if now >= next_poll:
+                    # Polled even while local notes keep coming, so a busy subject can't starve it
+                    next_poll = now + keepalive
+                    fresh = poll()
+                    for payload in fresh:
+                        yield to_sse(payload)
+                    if fresh:
+                        last_seen = fresh[-1]['message_id']
+                    else:
+                        yield ": keepalive\n\n"
+                    continue
+                try:
+                    payload = listener.get(timeout=min(next_poll, deadline) - now)
+                except queue.Empty:
+                    continue
+                if payload['message_id'] > last_seen:
+                    last_seen = payload['message_id']
+                    yield to_sse(payload)
+        finally:
+            message_broker.unsubscribe(subject_id, listener)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @main_bp.route('/invite_user/<int:subject_id>', methods=['POST'])
 @login_required
 def invite_user(subject_id):
@@ -129,18 +292,30 @@ def invite_user(subject_id):
     username = request.form.get('username')
     target_user = User.query.filter_by(username=username).first()
     if target_user:
-        # Prevent duplicate invites or inviting someone who is already a member
-        exists = SubjectMember.query.filter_by(user_id=target_user.user_id, subject_id=subject_id).first()
-        if not exists:
+        # uq_subject_member_user_subject rejects duplicate invites or inviting someone already a member
+        try:
             db.session.add(SubjectMember(user_id=target_user.user_id, subject_id=subject_id)) # Defaults to 'pending'
+            bump_counters(subject_id)
+            notify(target_user.user_id, 'invite', subject_id=subject_id, invited_by=session['user_id'])
             db.session.commit()
             flash(f"Invite sent to {username}!")
-        else:
+        except IntegrityError:
+            db.session.rollback()
             flash("User already a member or invited.") 
     else:
         flash(f"User '{username}' not found.")
     return redirect(url_for('main.view_subject', subject_id=subject_id))
 
+@main_bp.route('/users/suggest')
+@login_required
+def suggest_users():
+    """Username prefix matches for the invite box's autocomplete."""
+    q = request.args.get('q', '')[:User.username.type.length]
+    response = jsonify(q=q, usernames=suggest_usernames(q, exclude_user_id=session['user_id']))
+    # Typing back over the same prefix shouldn't go to the server again
+    response.headers['Cache-Control'] = 'private, max-age=60'
+    return response
+
 @main_bp.route('/accept_invite/<int:membership_id>')
 @login_required
 def accept_invite(membership_id):
@@ -148,7 +323,11 @@ def accept_invite(membership_id):
     member = db.session.get(SubjectMember, membership_id) or abort(404)
     # Ensure only the invited user can accept their own invite
     if member.user_id == session['user_id']:
+        if member.status != 'accepted':
+            # Let the rest of the subject know someone joined (only the first time)
+            notify_subject(member.subject_id, 'joined', exclude_user_id=member.user_id, user_id=member.user_id)
         member.status = 'accepted'
+        bump_counters(member.subject_id)
         db.session.commit()
     return redirect(url_for('main.dashboard'))
 
@@ -158,7 +337,13 @@ def delete_subject(subject_id):
     """Deletes a subject if the user is the owner."""
     # Security check: Only the owner has the right to delete
     subject = Subject.query.filter_by(subject_id=subject_id, user_id=session['user_id']).first_or_404()
-    db.session.delete(subject)
-    db.session.commit()
-    flash(f"Subject '{subject.name}' deleted.")
+    name = subject.name
+    # Anyone with tasks in here loses them from their cached study plan
+    affected_users = [row[0] for row in db.session.query(Task.user_id).filter_by(subject_id=subject_id).distinct()]
+
+    # Set-based deletes, big subjects are hidden now and purged in the background
+    deferred = remove_subject(subject, current_app._get_current_object())
+    for affected in affected_users:
+        plan_cache.invalidate(affected)
+    flash(f"Subject '{name}' deleted." + (" Cleaning up its history in the background." if deferred else ""))
     return redirect(url_for('main.dashboard'))
\ No newline at end of file
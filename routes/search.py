@@ -0,0 +1,31 @@
+from flask import Blueprint, render_template, jsonify, session, request
+from model.search import search
+from utils import login_required, parse_positive_int
+
+"""
+Search Blueprint.
+Full-text search across tasks and notes in every subject the user can see.
+"""
+
+search_bp = Blueprint('search', __name__)
+
+def _run_search():
+    """Reads ?q= and ?page= and runs the ranked search."""
+    q = request.args.get('q', '').strip()
+    page = parse_positive_int(request.args.get('page'), 1)
+    results, has_more = search(session['user_id'], q, page=page)
+    return q, page, results, has_more
+
+@search_bp.route('/search')
+@login_required
+def search_page():
+    """Search results page with next/previous links."""
+    q, page, results, has_more = _run_search()
+    return render_template('search.html', q=q, page=page, results=results, has_more=has_more)
+
+@search_bp.route('/search.json')
+@login_required
+def search_json():
+    """Same results as JSON."""
+    q, page, results, has_more = _run_search()
+    return jsonify(q=q, page=page, results=results, has_more=has_more)
@@ -0,0 +1,27 @@
+from flask import Blueprint, render_template, jsonify, session, request
+from model.analytics import get_user_stats
+from utils import login_required, parse_positive_int
+
+"""
+Study Analytics Blueprint.
+Serves the stats page and its JSON twin straight from the pre-aggregated rollups.
+"""
+
+stats_bp = Blueprint('stats', __name__)
+
+def _window():
+    """?days= for the daily series, clamped so nobody asks for years of buckets."""
+    return min(parse_positive_int(request.args.get('days'), 14), 90)
+
+@stats_bp.route('/stats')
+@login_required
+def stats_page():
+    """Minutes, sessions, completed tasks and streaks for the signed in user."""
+    stats = get_user_stats(session['user_id'], days=_window())
+    return render_template('stats.html', stats=stats)
+
+@stats_bp.route('/stats.json')
+@login_required
+def stats_json():
+    """Same numbers as the stats page, for scripts and widgets."""
+    return jsonify(get_user_stats(session['user_id'], days=_window()))
@@ -1,7 +1,18 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, abort
+import hashlib
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, session, abort, jsonify, make_response,
+                   Response, stream_with_context)
+from sqlalchemy import update
+from sqlalchemy.orm import joinedload
 from extensions import db
-from model.models import SubjectMember, Tag, Priority, Task
-from utils import login_required, parse_date
+from model.models import User, SubjectMember, Task, task_tags, get_nzt_now
+from model.lookups import lookups
+from model.counters import bump_counters
+from model.analytics import record_completion
+from model.scheduler import plan_cache, get_user_plan
+from model.batch import apply_batch, BatchError
+from model.queries import get_agenda, get_agenda_version
+from model.calendar import ical_lines, new_calendar_token
+from utils import login_required, parse_date, not_modified, set_validators, parse_positive_int
 
 """
 Task Management Blueprint.
@@ -16,11 +27,12 @@ def add_task():
     """Adds a new task to a specific subject with optional tags and priorities."""
     user_id = session['user_id']
     # Filter only subjects user is actually a member of
-    memberships = SubjectMember.query.filter_by(user_id=user_id, status='accepted').all()
+    memberships = SubjectMember.query.options(joinedload(SubjectMember.subject)).filter_by(user_id=user_id, status='accepted').all()
     user_subjects = [m.subject for m in memberships]
 
-    available_tags = Tag.query.all()
-    available_priorities = Priority.query.order_by(Priority.weight.asc()).all()
+    # Lookup rows come from the in-process cache, no DB hit
+    available_tags = lookups.tags()
+    available_priorities = lookups.priorities()
     
     if request.method == 'POST':
         # parse_date handles invalid strings from the date input
@@ -31,20 +43,36 @@ def add_task():
             due_date=due_date,
             subject_id=request.form.get('subject_id'),
             user_id=user_id,
-            priority_id=request.form.get('priority_id')
+            priority_id=request.form.get('priority_id'),
+            # Effort estimate is optional, the planner falls back to its default
+            estimated_minutes=parse_positive_int(request.form.get('estimated_minutes'))
         )
         
-        # Link Many-to-Many tags safely
+        db.session.add(new_task)
+        db.session.flush()
+        bump_counters(new_task.subject_id, active_task_count=1)
+
+        # Link Many-to-Many tags safely, unknown ids are dropped using the cached tag map
+        tag_map = lookups.tag_map()
+        tag_ids = set()
         for t_id in request.form.getlist('tag_ids'):
             try:
-                tag_obj = db.session.get(Tag, int(t_id)) 
-                if tag_obj:
-                    new_task.tags.append(tag_obj)
+                if int(t_id) in tag_map:
+                    tag_ids.add(int(t_id))
             except (ValueError, TypeError):
                 continue
-            
-        db.session.add(new_task)
+        if tag_ids:
+            db.session.execute(task_tags.insert(), [{'task_id': new_task.task_id, 'tag_id': t_id} for t_id in sorted(tag_ids)])
+
         db.session.commit()
+
+        # Patch the cached study plan instead of rebuilding it from the DB
+        subject_names = {sub.subject_id: sub.name for sub in user_subjects}
+        if new_task.subject_id in subject_names:
+            weight = lookups.priority_weights().get(new_task.priority_id, 99)
+            plan_cache.task_added(new_task, subject_names[new_task.subject_id], weight)
+        else:
+            plan_cache.invalidate(user_id)
         return redirect(url_for('main.view_subject', subject_id=new_task.subject_id))
         
     return render_template('addtask.html', subjects=user_subjects, tags=available_tags, priorities=available_priorities)
@@ -61,6 +89,162 @@ def complete_task(task_id):
         flash("Permission denied.")
         return redirect(url_for('main.dashboard'))
 
-    task.status_id = 2 # Updates linked 2NF status
+    # Only move the counters on the first completion, repeat clicks are no-ops.
+    # Guarded UPDATE so two concurrent clicks can't both see 'pending' and both count it.
+    completed_at = get_nzt_now()
+    done = db.session.execute(update(Task)
+                              .where(Task.task_id == task_id, Task.status_id != 2)
+                              .values(status_id=2, completed_at=completed_at)) # Updates linked 2NF status
+    if done.rowcount == 1:
+        bump_counters(task.subject_id, active_task_count=-1, completed_task_count=1)
+        record_completion(task.user_id, task.subject_id, completed_at)
+        db.session.commit()
+        plan_cache.task_completed(task)
+    return redirect(url_for('main.view_subject', subject_id=task.subject_id))
+
+def _agenda_request():
+    """?days= window (1-60, default 7) and ?after= keyset cursor."""
+    return min(parse_positive_int(request.args.get('days'), 7), 60), request.args.get('after')
+
+def _agenda_validators(user_id, days, after):
+    """ETag + Last-Modified built from the agenda version, without loading any tasks."""
+    last_activity, subject_count, subject_sum = get_agenda_version(user_id)
+    today = get_nzt_now().date()
+    etag = hashlib.sha1(f"{user_id}:{days}:{after}:{today}:{last_activity}:{subject_count}:{subject_sum}".encode()).hexdigest()
+    # last_activity is stored as naive NZ time
+    last_modified = last_activity.replace(tzinfo=get_nzt_now().tzinfo) if last_activity else None
+    return etag, last_modified
+
+@tasks_bp.route('/agenda')
+@login_required
+def agenda():
+    """Upcoming deadlines across every subject the user is in."""
+    user_id = session['user_id']
+    days, after = _agenda_request()
+    etag, last_modified = _agenda_validators(user_id, days, after)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+
+    tasks, next_cursor = get_agenda(user_id, days=days, after=after)
+    response = make_response(render_template('agenda.html', tasks=tasks, days=days, next_cursor=next_cursor))
+    return set_validators(response, etag, last_modified)
+
+@tasks_bp.route('/agenda.json')
+@login_required
+def agenda_json():
+    """Agenda as JSON, with the cursor for the next page."""
+    user_id = session['user_id']
+    days, after = _agenda_request()
+    etag, last_modified = _agenda_validators(user_id, days, after)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+
+    tasks, next_cursor = get_agenda(user_id, days=days, after=after)
+    response = jsonify(days=days, next_cursor=next_cursor, tasks=[{
+        'task_id': t.task_id,
+        'title': t.title,
+        'due_date': t.due_date.date().isoformat(),
+        'subject_id': t.subject_id,
+        'subject': t.subject.name,
+        'priority': t.priority.level,
+        'weight': t.priority.weight,
+    } for t in tasks])
+    return set_validators(response, etag, last_modified)
+
+def _int_list(values):
+    """Form lists to ints, silently dropping junk like complete_task's int route converter would."""
+    return [v for v in map(parse_positive_int, values) if v is not None]
+
+@tasks_bp.route('/tasks/batch', methods=['POST'])
+@login_required
+def batch_tasks():
+    """Applies complete/reopen, priority, tag or move changes to many tasks in one transaction."""
+    wants_json = request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+    try:
+        changed, skipped = apply_batch(
+            session['user_id'],
+            _int_list(request.form.getlist('task_ids')),
+            request.form.get('action'),
+            priority_id=parse_positive_int(request.form.get('priority_id')),
+            tag_ids=_int_list(request.form.getlist('tag_ids')),
+            target_subject_id=parse_positive_int(request.form.get('target_subject_id')),
+        )
+    except BatchError as e:
+        if wants_json:
+            return jsonify(error=str(e)), 400
+        flash(str(e))
+        changed = skipped = None
+
+    if wants_json:
+        return jsonify(changed=changed, skipped=skipped)
+    if changed is not None:
+        flash(f"Updated {changed} task{'s' if changed != 1 else ''}."
+              + (f" {skipped} skipped (not yours)." if skipped else ""))
+    back = parse_positive_int(request.form.get('return_subject_id'))
+    if back:
+        return redirect(url_for('main.view_subject', subject_id=back))
+    return redirect(url_for('main.dashboard'))
+
+@tasks_bp.route('/plan', methods=['GET', 'POST'])
+@login_required
+def study_plan():
+    """Day-by-day study plan built from pending tasks. POST saves the daily study budget."""
+    user_id = session['user_id']
+    if request.method == 'POST':
+        hours_raw = request.form.get('daily_hours', '')
+        try:
+            hours = float(hours_raw)
+        except ValueError:
+            hours = 0
+        if 0 < hours <= 16:
+            db.session.get(User, user_id).daily_study_minutes = int(hours * 60)
+            db.session.commit()
+        else:
+            flash("Pick between 0 and 16 hours a day.")
+        return redirect(url_for('tasks.study_plan'))
+
+    daily_minutes, plan = get_user_plan(user_id)
+    token = db.session.get(User, user_id).calendar_token
+    calendar_url = url_for('tasks.calendar_feed', token=token, _external=True) if token else None
+    return render_template('plan.html', plan=plan, daily_hours=daily_minutes / 60, calendar_url=calendar_url)
+
+@tasks_bp.route('/plan.json')
+@login_required
+def study_plan_json():
+    """The study plan as JSON."""
+    daily_minutes, plan = get_user_plan(session['user_id'])
+    return jsonify(daily_minutes=daily_minutes, **plan)
+
+@tasks_bp.route('/calendar/token', methods=['POST'])
+@login_required
+def calendar_token():
+    """Creates (or replaces, revoking the old link) the user's calendar subscribe token."""
+    db.session.get(User, session['user_id']).calendar_token = new_calendar_token()
     db.session.commit()
-    return redirect(url_for('main.view_subject', subject_id=task.subject_id))
\ No newline at end of file
+    flash("New calendar link created. Old links stop working.")
+    return redirect(url_for('tasks.study_plan'))
+
+@tasks_bp.route('/calendar/<token>.ics')
+def calendar_feed(token):
+    """
+    iCalendar feed of pending deadlines and recent study sessions.
+    Calendar apps can't sign in, so the unguessable token in the URL identifies the user.
+    Polls between writes get a 304 after one small version query.
+    """
+    user = User.query.filter_by(calendar_token=token).first()
+    if user is None:
+        abort(404)
+
+    last_activity, subject_count, subject_sum = get_agenda_version(user.user_id)
+    today = get_nzt_now().date()
+    etag = hashlib.sha1(f"ics:{user.user_id}:{today}:{last_activity}:{subject_count}:{subject_sum}".encode()).hexdigest()
+    last_modified = last_activity.replace(tzinfo=get_nzt_now().tzinfo) if last_activity else None
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+
+    response = Response(stream_with_context(ical_lines(user.user_id, last_activity, today, host=request.host)),
+                        mimetype='text/calendar')
+    return set_validators(response, etag, last_modified)
@@ -0,0 +1,70 @@
+import io
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
+from model.transfer import export_csv, export_ndjson, import_records, read_records, ImportFileError
+from utils import login_required
+
+"""
+Import/Export Blueprint.
+Streams the user's subjects, tasks, notes and sessions out as CSV/NDJSON and bulk loads them back in.
+"""
+
+transfer_bp = Blueprint('transfer', __name__)
+
+@transfer_bp.route('/export.<fmt>')
+@login_required
+def export_data(fmt):
+    """Streams everything the user can see, row by row."""
+    if fmt == 'csv':
+        body, mimetype = export_csv(session['user_id']), 'text/csv'
+    elif fmt == 'ndjson':
+        body, mimetype = export_ndjson(session['user_id']), 'application/x-ndjson'
+    else:
+        return redirect(url_for('transfer.import_data'))
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=wnotes-export.{fmt}'})
+
+@transfer_bp.route('/import', methods=['GET', 'POST'])
+@login_required
+def import_data():
+    """Upload form (GET) and bulk import of a CSV/NDJSON file (POST)."""
+    if request.method == 'GET':
+        return render_template('transfer.html')
+
+    wants_json = request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        if wants_json:
+            return jsonify(error="No file uploaded."), 400
+        flash("Choose a file to import.")
+        return redirect(url_for('transfer.import_data'))
+
+    fmt = 'csv' if upload.filename.lower().endswith('.csv') else 'ndjson'
+    # Decode the upload lazily so big files are read line by line
+    text_stream = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+    try:
+        report = import_records(session['user_id'], read_records(text_stream, fmt))
+    except ImportFileError as e:
+        # Rows before the bad spot are in, say so
+        if wants_json:
+            return jsonify(error=str(e), **e.report), 400
+        flash(f"{e} {_summary(e.report)}")
+        return redirect(url_for('transfer.import_data'))
+
+    if wants_json:
+        return jsonify(report)
+    flash(_summary(report))
+    return redirect(url_for('main.dashboard'))
+
+def _summary(report):
+    return (f"Imported {report.get('tasks', 0)} tasks, {report.get('notes', 0)} notes and "
+            f"{report.get('sessions', 0)} sessions ({report.get('skipped', 0)} rows skipped).")
+
+@transfer_bp.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    """Uploads over MAX_CONTENT_LENGTH, the import runs inside the request so it's capped."""
+    message = "File too large to import."
+    if request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json':
+        return jsonify(error=message), 413
+    flash(message)
+    return redirect(url_for('transfer.import_data'))
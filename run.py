@@ -1,42 +1,88 @@
 from flask import Flask, render_template
+from werkzeug.utils import import_string
 from extensions import db
-from model.models import lookup_data
-from routes.auth import auth_bp
-from routes.main import main_bp
-from routes.tasks import tasks_bp
+from config import load_config, register_engine_hooks
+from instrumentation import instrumentation
+from cache import fragment_cache
+from passwords import password_hasher
+from jobs import job_queue
+from compression import compressor
+from assets import assets
+import model.models  # table definitions for create_all
+import model.search  # FTS tables/triggers ride along with create_all
 
 """
 Main Application Entry Point.
-Initializes the Flask app, connects the database, and registers all blueprints.
+create_app builds the Flask app, connects the database, and registers all blueprints.
 """
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.secret_key = 'readingthiskeys'
+# Imported only when an app with routes is built, so CLI scripts skip loading every view module
+BLUEPRINTS = (
+    'routes.auth:auth_bp',
+    'routes.main:main_bp',
+    'routes.tasks:tasks_bp',
+    'routes.stats:stats_bp',
+    'routes.search:search_bp',
+    'routes.transfer:transfer_bp',
+    'routes.api:api_v1_bp',
+)
 
-# Connect the DB object to this specific app instance
-db.init_app(app)
+def create_app(config=None, overrides=None, routes=True):
+    """
+    Application factory.
+    config is a profile name from config.PROFILES (default: STUDYPLANNER_PROFILE or 'default'),
+    overrides is a dict applied last. routes=False gives a DB-only app for CLI scripts.
+    """
+    app = Flask(__name__)
+    # Settings come from the profile, STUDYPLANNER_SETTINGS file, STUDYPLANNER_* env vars, then overrides
+    load_config(app, config, overrides)
 
-# route blueprints
-app.register_blueprint(auth_bp)
-app.register_blueprint(main_bp)
-app.register_blueprint(tasks_bp)
+    # Connect the DB object to this specific app instance
+    db.init_app(app)
+    # WAL + busy timeout etc. on every new SQLite connection
+    register_engine_hooks(app, db)
+    # Query/template/latency timing, only active with INSTRUMENTATION_ENABLED
+    instrumentation.init_app(app, db)
+    # Rendered fragment cache, in-process LRU unless FRAGMENT_CACHE_BACKEND points somewhere shared
+    fragment_cache.init_app(app)
+    # Bounded pool for password hashing, started on first signup/signin
+    password_hasher.init_app(app)
+    # Durable job queue, its depth/latency/failures show up on /metrics
+    job_queue.init_app(app)
+    instrumentation.add_collector(job_queue.render_metrics)
+    # gzip/brotli for HTML/JSON, registered after instrumentation so its timing includes compression
+    compressor.init_app(app)
+    instrumentation.add_collector(compressor.render_metrics)
 
-# Error handlers visiblity of system status
-@app.errorhandler(404)
-def page_not_found(e):
-    """404 error page. Visiblity of system status."""
-    return render_template('error.html', code=404, message="404 page not found"), 404
+    if routes:
+        for blueprint in BLUEPRINTS:
+            app.register_blueprint(import_string(blueprint))
+        # /assets/ and asset_url() for the fingerprinted static files from build_assets.py
+        assets.init_app(app)
+        # Web apps run jobs in-process unless JOBS_WORKER_THREADS = 0 (then worker.py does)
+        if app.config['JOBS_WORKER_THREADS']:
+            job_queue.start(app)
 
-@app.errorhandler(500)
-def server_error(e):
-    """505 error page visiblity of system status."""
-    return render_template('error.html', code=500, message="internal glitch", description="Something went wrong on our end. We're looking into it."), 500
+    # Error handlers visiblity of system status
+    @app.errorhandler(404)
+    def page_not_found(e):
+        """404 error page. Visiblity of system status."""
+        return render_template('error.html', code=404, message="404 page not found"), 404
+
+    @app.errorhandler(500)
+    def server_error(e):
+        """505 error page visiblity of system status."""
+        return render_template('error.html', code=500, message="internal glitch", description="Something went wrong on our end. We're looking into it."), 500
+
+    return app
 
 if __name__ == '__main__':
+    from model.models import lookup_data
+    from model.lookups import lookups
+    app = create_app('development')
     with app.app_context():
         db.create_all()
         lookup_data() # Seed the basics if the DB is empty
+        lookups.load() # Warm the lookup cache once at startup
     # Port 5000 is the standard dev spot
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000)
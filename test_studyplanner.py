@@ -1,31 +1,101 @@
+import atexit
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
 import pytest
-from run import app
+from contextlib import closing, contextmanager
+from sqlalchemy import event
+from run import create_app
 from extensions import db
 from model.models import Subject, Task, SubjectMember, Priority, lookup_data
+from model.lookups import lookups
+from model.scheduler import plan_cache
+from cache import fragment_cache
 from reset_db import resetdb
+from migrate_db import upgrade, get_version, LATEST_VERSION
+from utils import parse_positive_int
+
+# One app and one scratch database file for the whole run
+TEST_DIR = tempfile.mkdtemp(prefix='studyplanner-tests-')
+atexit.register(shutil.rmtree, TEST_DIR, ignore_errors=True)
+TEST_DB = os.path.join(TEST_DIR, 'test.db')
+app = create_app('testing', {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{TEST_DB}',
+                             'JOBS_OUTBOX_DIR': os.path.join(TEST_DIR, 'outbox'),
+                             'ASSETS_DIST_DIR': os.path.join(TEST_DIR, 'dist')})
+
+@contextmanager
+def count_queries():
+    """Records (statement, params) for every SQL statement executed inside the block."""
+    executed = []
+    def _record(conn, cursor, statement, params, context, executemany):
+        executed.append((statement, params))
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', _record)
+    try:
+        yield executed
+    finally:
+        event.remove(engine, 'before_cursor_execute', _record)
+
+# SQL statements each page may run (after the lookup cache is warm), so N+1s can't creep back in
+QUERY_BUDGETS = {
+    '/dashboard': 3,
+    '/subject/1': 1,  # task/notes/history fragments come from the cache
+    '/subject/1/messages': 2,
+    '/add_task': 1,
+    '/agenda': 2,
+    '/agenda.json': 2,
+    '/plan': 2,
+    '/plan.json': 1,
+}
+
+def assert_query_budget(client, path, budget, method='get', **kwargs):
+    """Makes one request and fails if it ran more SQL statements than budget."""
+    with count_queries() as executed:
+        rv = getattr(client, method)(path, **kwargs)
+    assert len(executed) <= budget, f"{path} ran {len(executed)} queries, budget {budget}:\n" + "\n".join(
+        sql for sql, _ in executed)
+    return rv
+
+@pytest.fixture(scope='session')
+def seeded_db():
+    """
+    Schema, lookup rows and the default test user, built once per run.
+    Kept as an in-memory copy that every test restores from.
+    """
+    with app.app_context():
+        # Reset schema and seed with default priorities/colors/tags
+        resetdb(app)
+        lookup_data()
+    with app.test_client() as client:
+        # Create a default test user for general testing
+        client.post('/signup', data={
+            'username': 'testuser',
+            'email': 'test@gmail.com',
+            'password': 'password123'
+        })
+    template = sqlite3.connect(':memory:', check_same_thread=False)
+    with closing(sqlite3.connect(TEST_DB)) as source:
+        source.backup(template)
+    yield template
+    template.close()
 
 @pytest.fixture
-def client():
-    """Setup a fresh database for every test run."""
-    app.config.update({
-        'TESTING': True,
-        'WTF_CSRF_ENABLED': False,
-        'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
-        'SERVER_NAME': 'localhost'
-    })
-    
+def client(seeded_db):
+    """Fresh copy of the seeded database for every test, via SQLite's online backup API."""
+    with app.app_context():
+        raw = db.engine.raw_connection()
+        try:
+            seeded_db.backup(raw.driver_connection)
+        finally:
+            raw.close()
+    # Caches keyed by ids/versions would otherwise leak between tests
+    lookups.invalidate()
+    plan_cache.invalidate()
+    fragment_cache.clear()
     with app.test_client() as client:
-        with app.app_context():
-            # Reset schema and seed with default priorities/colors/tags
-            resetdb() 
-            lookup_data()
-            
-            # Create a default test user for general testing
-            client.post('/signup', data={
-                'username': 'testuser',
-                'email': 'test@gmail.com',
-                'password': 'password123'
-            }, follow_redirects=True)
         yield client
 
 
@@ -41,6 +111,48 @@ def test_unauthorized_access(client):
     rv = client.get('/dashboard', follow_redirects=True)
     assert b"sign in" in rv.data.lower()
 
+def test_password_rehashed_on_signin(client):
+    """A hash made with old settings is replaced with the configured method after a good login."""
+    from model.models import User
+    from passwords import password_hasher, normalize_method
+    original = app.config['PASSWORD_HASH_METHOD']
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1200'
+    password_hasher.init_app(app)
+    try:
+        # Wrong password leaves the stored hash alone
+        assert client.post('/signin', data={'username or email': 'testuser', 'password': 'nope'}).status_code == 401
+        with app.app_context():
+            assert User.query.filter_by(username='testuser').one().password_hash.startswith(normalize_method(original) + '$')
+        assert client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'}).status_code == 302
+        with app.app_context():
+            assert User.query.filter_by(username='testuser').one().password_hash.startswith('pbkdf2:sha256:1200$')
+        client.get('/logout')
+        assert client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'}).status_code == 302
+    finally:
+        app.config['PASSWORD_HASH_METHOD'] = original
+        password_hasher.init_app(app)
+
+def test_password_pool_saturated_returns_503(client):
+    """With every hashing slot taken, signin is turned away at once instead of queueing."""
+    import threading
+    from passwords import password_hasher
+    app.config.update(PASSWORD_POOL_WORKERS=1, PASSWORD_POOL_QUEUE=0)
+    password_hasher.init_app(app)
+    gate = threading.Event()
+    try:
+        blocker = password_hasher.submit(gate.wait)
+        rv = client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+        assert rv.status_code == 503
+        assert rv.headers['Retry-After'] == '2'
+        assert password_hasher.rejected == 1
+        gate.set()
+        blocker.result(timeout=5)
+        assert client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'}).status_code == 302
+    finally:
+        gate.set()
+        app.config.update(PASSWORD_POOL_WORKERS=None, PASSWORD_POOL_QUEUE=None)
+        password_hasher.init_app(app)
+
 def test_404_not_found(client):
     """Confirms the 404 triggers for non existant pages"""
     client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
@@ -156,4 +268,1140 @@ def test_subject_deletion_cascade(client):
     
     with app.app_context():
         assert db.session.get(Subject, 1) is None
-        assert SubjectMember.query.filter_by(subject_id=1).first() is None
\ No newline at end of file
+        assert SubjectMember.query.filter_by(subject_id=1).first() is None
+
+def test_dashboard_query_count_is_fixed(client):
+    """Dashboard cost must not grow with the number of subjects."""
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Subject 0', 'color_id': 1})
+    client.post('/add_task', data={'title': 'T0', 'subject_id': 1, 'priority_id': 1})
+    with count_queries() as few:
+        client.get('/dashboard')
+
+    for i in range(1, 6):
+        client.post('/add_subject', data={'name': f'Subject {i}', 'color_id': 2})
+        client.post('/add_task', data={'title': f'T{i}', 'subject_id': i + 1, 'priority_id': 1})
+    with count_queries() as many:
+        rv = client.get('/dashboard')
+
+    assert len(many) == len(few)
+    assert rv.data.count(b"1 active tasks") == 6
+
+    # The loader under the cached view still serves the whole dashboard, or just the rows asked for
+    from model.queries import get_dashboard_data
+    with app.app_context():
+        data = get_dashboard_data(1)
+        assert [item['active_count'] for item in data['subjects']] == [1] * 6 and data['invites'] == []
+        with count_queries() as executed:
+            narrowed = get_dashboard_data(1, subject_ids=[2], invite_ids=[])
+        assert [item['obj'].name for item in narrowed['subjects']] == ['Subject 1'] and len(executed) == 1
+
+def test_workspace_pagination(client):
+    """Workspace lists are capped per page and link to the next page with a cursor."""
+    from model import queries
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Physics', 'color_id': 1})
+    for i in range(queries.TASK_PAGE_SIZE + 5):
+        client.post('/add_task', data={'title': f'task {i}', 'subject_id': 1, 'priority_id': 2})
+    for i in range(queries.MESSAGE_PAGE_SIZE + 3):
+        client.post('/send_message/1', data={'content': f'note {i}'})
+
+    rv = client.get('/subject/1')
+    assert rv.data.count(b'class="task_item') == queries.TASK_PAGE_SIZE
+    assert b"load more tasks" in rv.data
+    assert b"load older notes" in rv.data
+    # Newest notes are on the first page, oldest are behind the cursor
+    assert b"note 0\n" not in rv.data
+    assert b"note %d\n" % (queries.MESSAGE_PAGE_SIZE + 2) in rv.data
+
+    with app.app_context():
+        first_page, cursor = queries.get_task_page(1)
+        second_page, end = queries.get_task_page(1, after=cursor)
+    assert len(second_page) == 5 and end is None
+    assert not {t.task_id for t in first_page} & {t.task_id for t in second_page}
+
+def test_workspace_query_count_is_fixed(client):
+    """Tags, priority and senders are batch loaded instead of per row."""
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Chemistry', 'color_id': 1})
+    client.post('/add_task', data={'title': 'one', 'subject_id': 1, 'priority_id': 1, 'tag_ids': [1]})
+    client.post('/send_message/1', data={'content': 'hi'})
+    with count_queries() as few:
+        client.get('/subject/1')
+
+    for i in range(10):
+        client.post('/add_task', data={'title': f'more {i}', 'subject_id': 1, 'priority_id': 3, 'tag_ids': [1, 2]})
+        client.post('/send_message/1', data={'content': f'hello {i}'})
+    with count_queries() as many:
+        client.get('/subject/1')
+    assert len(many) == len(few)
+
+def test_hot_queries_use_indexes(client):
+    """EXPLAIN QUERY PLAN: dashboard and workspace reads must search indexes, not scan tables."""
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Indexed', 'color_id': 1})
+    client.post('/add_task', data={'title': 'a', 'subject_id': 1, 'priority_id': 1})
+    client.post('/send_message/1', data={'content': 'hi'})
+    client.post('/log_session/1', data={'duration': '20'})
+    with count_queries() as executed:
+        client.get('/dashboard')
+        client.get('/subject/1')
+        client.get('/agenda.json')
+
+    plans = []
+    with app.app_context():
+        with db.engine.connect() as conn:
+            for statement, params in executed:
+                rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, params).fetchall()
+                plans.append(" | ".join(row[-1] for row in rows))
+    plan_text = "\n".join(plans)
+
+    for index in ('ix_task_subject_status', 'ix_message_subject_timestamp',
+                  'ix_study_session_subject_timestamp', 'ix_subject_member_user_status',
+                  'ix_task_status_due'):
+        assert index in plan_text
+    for table in ('task', 'message', 'study_session', 'subject_member'):
+        assert f"SCAN {table}\n" not in plan_text + "\n"
+        assert f"SCAN {table} |" not in plan_text
+
+def test_duplicate_invite_rejected(client):
+    """The unique membership index stops a second invite for the same user."""
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Team', 'color_id': 1})
+    client.post('/signup', data={'username': 'friend', 'email': 'f@f.com', 'password': '123'})
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/invite_user/1', data={'username': 'friend'})
+    rv = client.post('/invite_user/1', data={'username': 'friend'}, follow_redirects=True)
+    assert b"already a member" in rv.data.lower()
+    with app.app_context():
+        assert SubjectMember.query.filter_by(subject_id=1, user_id=2).count() == 1
+
+def test_username_suggestions_prefix_index(client):
+    """Invite autocomplete matches prefixes case-insensitively off the username_key index."""
+    for name in ('Alice', 'alina', 'albert', 'bob'):
+        client.post('/signup', data={'username': name, 'email': f'{name}@x.com', 'password': '123'})
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    rv = client.get('/users/suggest?q=AL')
+    assert rv.get_json()['usernames'] == ['albert', 'Alice', 'alina']
+    assert client.get('/users/suggest?q=ali').get_json()['usernames'] == ['Alice', 'alina']
+    # Own name and empty input suggest nothing
+    assert client.get('/users/suggest?q=test').get_json()['usernames'] == []
+    assert client.get('/users/suggest?q=').get_json()['usernames'] == []
+
+    with count_queries() as executed:
+        client.get('/users/suggest?q=bo')
+    with app.app_context():
+        with db.engine.connect() as conn:
+            plan = " ".join(row[-1] for statement, params in executed
+                            for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, params))
+    assert 'ix_user_username_key (username_key>? AND username_key<?)' in plan
+
+def test_migration_upgrades_in_place(client):
+    """An old unindexed database is upgraded without losing rows."""
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Legacy', 'color_id': 1})
+    with app.app_context():
+        with db.engine.begin() as conn:
+            # Roll the schema back to how the baseline shipped it
+            for index in ('ix_subject_user', 'ix_task_subject_status', 'ix_message_subject_timestamp',
+                          'ix_study_session_subject_timestamp', 'ix_subject_member_user_status',
+                          'uq_subject_member_user_subject', 'ix_task_status_due', 'uq_user_calendar_token',
+                          'ix_user_username_key'):
+                conn.exec_driver_sql(f"DROP INDEX {index}")
+            for column in ('active_task_count', 'completed_task_count', 'study_minutes', 'message_count', 'last_activity', 'version'):
+                conn.exec_driver_sql(f"ALTER TABLE subject DROP COLUMN {column}")
+            conn.exec_driver_sql("ALTER TABLE task DROP COLUMN completed_at")
+            conn.exec_driver_sql("ALTER TABLE user DROP COLUMN calendar_token")
+            conn.exec_driver_sql("ALTER TABLE user DROP COLUMN username_key")
+            conn.exec_driver_sql("DROP TABLE study_rollup")
+            conn.exec_driver_sql("DROP TABLE job")
+            conn.exec_driver_sql("DROP TABLE archive_block")
+            for trigger in ('task_fts_insert', 'task_fts_delete', 'task_fts_update',
+                            'message_fts_insert', 'message_fts_delete', 'message_fts_update'):
+                conn.exec_driver_sql(f"DROP TRIGGER {trigger}")
+            conn.exec_driver_sql("DROP TABLE task_fts")
+            conn.exec_driver_sql("DROP TABLE message_fts")
+            conn.exec_driver_sql("INSERT INTO subject_member (user_id, subject_id, status) VALUES (1, 1, 'pending')")
+            conn.exec_driver_sql("INSERT INTO task (title, status_id, priority_id, subject_id, user_id) VALUES ('old', 1, 1, 1, 1)")
+            # Left behind by a hidden subject whose purge hasn't run
+            conn.exec_driver_sql("INSERT INTO message (content, sender_id, subject_id) VALUES ('orphan', 1, 7)")
+            conn.exec_driver_sql("INSERT INTO user (username, email, password_hash) VALUES ('Élodie', 'e@e.com', 'x')")
+            conn.exec_driver_sql("PRAGMA user_version = 0")
+
+        assert upgrade() == [v for v in range(1, LATEST_VERSION + 1)]
+        with db.engine.connect() as conn:
+            assert get_version(conn) == LATEST_VERSION
+        # Duplicate collapsed onto the accepted membership, subject untouched
+        members = SubjectMember.query.filter_by(subject_id=1, user_id=1).all()
+        assert len(members) == 1 and members[0].status == 'accepted'
+        legacy = db.session.get(Subject, 1)
+        assert legacy.name == 'Legacy'
+        # Counters are backfilled from existing rows
+        assert legacy.active_task_count == 1
+        # Existing rows are indexed for search
+        from model.search import search
+        assert [r['title'] for r in search(1, 'old')[0]] == ['old']
+        # Usernames are backfilled into the autocomplete key
+        from model.queries import suggest_usernames
+        assert suggest_usernames('TEST') == ['testuser']
+        # with the same folding new rows get, SQL lower() would have left the É alone
+        assert suggest_usernames('élo') == ['Élodie']
+        # Subject ids are never reused, not even ones only the orphaned rows remember
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("INSERT INTO subject (name, user_id) VALUES ('New', 1)")
+        assert Subject.query.filter_by(name='New').one().subject_id == 8
+        assert upgrade() == []
+
+        # A database that ran the old SQL backfill gets its keys recomputed
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("UPDATE user SET username_key = lower(trim(username))")
+            conn.exec_driver_sql(f"PRAGMA user_version = {LATEST_VERSION - 1}")
+        assert suggest_usernames('élo') == []
+        assert upgrade() == [LATEST_VERSION]
+        assert suggest_usernames('élo') == ['Élodie']
+
+def test_sqlite_connection_pragmas(client):
+    """Every pooled connection gets the configured pragmas from the connect hook."""
+    from sqlalchemy import text
+    with app.app_context():
+        with db.engine.connect() as conn:
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() == app.config['SQLITE_BUSY_TIMEOUT_MS']
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+            assert conn.execute(text("PRAGMA temp_store")).scalar() == 2  # MEMORY
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() in ('wal', 'memory')
+
+def test_engine_options_follow_database_url():
+    """Pool settings only apply where the database can actually be pooled."""
+    from config import Config, build_engine_options
+    settings = {k: getattr(Config, k) for k in dir(Config) if k.isupper()}
+
+    memory = build_engine_options({**settings, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:'})
+    assert 'pool_size' not in memory
+
+    server = build_engine_options({**settings, 'SQLALCHEMY_DATABASE_URI': 'postgresql://u:p@db/notes', 'DB_POOL_SIZE': 20})
+    assert server['pool_size'] == 20 and server['pool_pre_ping'] and 'connect_args' not in server
+
+    file_db = build_engine_options({**settings, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///notes.db'})
+    assert file_db['connect_args']['timeout'] == Config.SQLITE_BUSY_TIMEOUT_MS / 1000
+
+def test_lookup_cache_serves_forms(client):
+    """Forms read lookup rows from memory and re-seeding invalidates the cache."""
+    from model.lookups import lookups
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Art', 'color_id': 1})
+    client.get('/add_task')
+
+    with count_queries() as executed:
+        rv = client.get('/add_task')
+        client.get('/add_subject')
+    lookup_tables = ('FROM tag', 'FROM priority', 'FROM color', 'FROM status')
+    assert not [sql for sql, _ in executed if any(t in sql for t in lookup_tables)]
+    assert b"urgent" in rv.data
+
+    before = lookups.stats()
+    client.post('/add_task', data={'title': 'Tagged', 'subject_id': 1, 'priority_id': 1, 'tag_ids': ['1', '2', '99', 'x']})
+    assert lookups.stats()['hits'] > before['hits']
+    with app.app_context():
+        task = Task.query.filter_by(title='Tagged').first()
+        assert sorted(t.name for t in task.tags) == ['exam', 'urgent']
+
+        # Writing to a lookup table drops the cached rows, but only once it commits
+        from model.models import Tag
+        db.session.add(Tag(name='scrapped'))
+        db.session.flush()
+        assert lookups.stats()['loaded']
+        db.session.rollback()
+        assert lookups.stats()['loaded'] and 'scrapped' not in [t.name for t in lookups.tags()]
+        db.session.add(Tag(name='lab'))
+        db.session.flush()
+        assert lookups.stats()['loaded']
+        db.session.commit()
+        assert not lookups.stats()['loaded']
+        assert 'lab' in [t.name for t in lookups.tags()]
+
+def test_incremental_message_feed(client):
+    """The feed only returns notes after the cursor and the stream replays the backlog."""
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Chat', 'color_id': 1})
+    client.post('/send_message/1', data={'content': 'first'})
+    rv = client.post('/send_message/1', data={'content': 'second'}, headers={'Accept': 'application/json'})
+    assert rv.status_code == 201
+    first_id = rv.get_json()['message_id'] - 1
+
+    data = client.get(f'/subject/1/messages?after={first_id}').get_json()
+    assert [m['content'] for m in data['messages']] == ['second']
+    assert client.get(f"/subject/1/messages?after={data['last_id']}").get_json()['messages'] == []
+
+    app.config.update(FEED_STREAM_SECONDS=0.2, FEED_KEEPALIVE_SECONDS=0.1)
+    try:
+        body = client.get('/subject/1/stream', headers={'Last-Event-ID': str(first_id)}).get_data(as_text=True)
+    finally:
+        app.config.update(FEED_STREAM_SECONDS=300, FEED_KEEPALIVE_SECONDS=15)
+    assert 'event: message' in body and '"second"' in body and '"first"' not in body
+    assert client.get('/subject/1/messages?after=²').get_json()['last_id'] == first_id + 1
+
+    # A note written by another worker never reaches this process's broker, the stream's poll finds it
+    app.config.update(FEED_STREAM_SECONDS=1, FEED_KEEPALIVE_SECONDS=0.1)
+    try:
+        rv = client.get('/subject/1/stream', headers={'Last-Event-ID': str(first_id + 1)}, buffered=False)
+        chunks = iter(rv.response)
+        assert next(chunks).startswith(b'retry')
+        with closing(sqlite3.connect(TEST_DB)) as conn, conn:
+            conn.execute("INSERT INTO message (content, sender_id, subject_id, timestamp) "
+                         "VALUES ('from elsewhere', 1, 1, '2030-01-01 00:00:00')")
+        body = b''.join(chunks).decode()
+        rv.close()
+    finally:
+        app.config.update(FEED_STREAM_SECONDS=300, FEED_KEEPALIVE_SECONDS=15)
+    assert body.count('event: message') == 1 and '"from elsewhere"' in body
+
+    # Outsiders can neither read nor post
+    client.post('/signup', data={'username': 'lurker', 'email': 'l@l.com', 'password': '123'})
+    client.post('/signin', data={'username or email': 'lurker', 'password': '123'})
+    assert client.get('/subject/1/messages').status_code == 403
+    assert client.post('/send_message/1', data={'content': 'spam'}).status_code == 403
+
+def test_broker_fanout():
+    """Published notes reach every listener on that subject only."""
+    from realtime import Broker
+    broker = Broker(max_queue=1)
+    a, b, other = broker.subscribe(1), broker.subscribe(1), broker.subscribe(2)
+    assert broker.publish(1, {'message_id': 1}) == 2
+    assert a.get_nowait() == b.get_nowait() == {'message_id': 1}
+    assert other.empty()
+    # A full queue doesn't block the sender, it gets flagged and dropped so its stream resyncs
+    broker.publish(1, {'message_id': 2})
+    b.get_nowait()
+    broker.publish(1, {'message_id': 3})
+    assert a.overflowed and not b.overflowed
+    assert a.get_nowait() == {'message_id': 2} and a.empty()
+    assert b.get_nowait() == {'message_id': 3}
+    assert broker.listener_count(1) == 1
+
+def test_subject_counters_follow_writes(client):
+    """Write routes keep the subject counters in step and rebuild agrees with them."""
+    from model.counters import rebuild_counters
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Counted', 'color_id': 1})
+    client.post('/add_task', data={'title': 'a', 'subject_id': 1, 'priority_id': 1})
+    client.post('/add_task', data={'title': 'b', 'subject_id': 1, 'priority_id': 1})
+    client.get('/complete_task/1')
+    client.get('/complete_task/1')  # second click must not double count
+    client.post('/log_session/1', data={'duration': '25'})
+    client.post('/log_session/1', data={'duration': '35'})
+    client.post('/send_message/1', data={'content': 'hello'})
+
+    def snapshot():
+        sub = db.session.get(Subject, 1)
+        db.session.refresh(sub)
+        return (sub.active_task_count, sub.completed_task_count, sub.study_minutes, sub.message_count)
+
+    with app.app_context():
+        assert snapshot() == (1, 1, 60, 1)
+        assert db.session.get(Subject, 1).last_activity is not None
+        db.session.execute(db.text("UPDATE subject SET active_task_count = 99, study_minutes = 0"))
+        db.session.commit()
+        rebuild_counters()
+        assert snapshot() == (1, 1, 60, 1)
+
+    # A subject whose only activity is a completion keeps it through a rebuild
+    client.post('/add_subject', data={'name': 'Quiet', 'color_id': 1})
+    client.post('/add_task', data={'title': 'c', 'subject_id': 2, 'priority_id': 1})
+    client.get('/complete_task/3')
+    with app.app_context():
+        completed_at = db.session.get(Task, 3).completed_at
+        rebuild_counters()
+        assert db.session.get(Subject, 2).last_activity == completed_at
+
+def test_study_rollups_and_stats(client):
+    """Sessions and completions land in the rollups, and backfill rebuilds the same numbers."""
+    from model.analytics import backfill_rollups, get_user_stats, record_session
+    from model.models import StudyRollup, StudySession
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Stats', 'color_id': 1})
+    client.post('/add_task', data={'title': 'a', 'subject_id': 1, 'priority_id': 1})
+    client.post('/log_session/1', data={'duration': '30'})
+    client.post('/log_session/1', data={'duration': '15'})
+    client.get('/complete_task/1')
+
+    data = client.get('/stats.json').get_json()
+    assert data['totals'] == {'minutes': 45, 'sessions': 2, 'tasks_completed': 1, 'days': 14}
+    assert client.get('/stats.json?days=²').get_json()['totals']['days'] == 14
+    assert client.get('/stats.json?days=500').get_json()['totals']['days'] == 90
+    assert data['weekly'][0]['subject'] == 'Stats'
+    assert data['current_streak'] == 1
+    assert b"45m" in client.get('/stats').data
+
+    with app.app_context():
+        before = get_user_stats(1)
+        assert StudyRollup.query.count() == 2  # one day bucket + one week bucket
+        assert backfill_rollups(batch_size=1) == 3
+        assert get_user_stats(1) == before
+
+    # A session logged while the backfill runs is counted once, and /stats never sees half-built rollups
+    import model.analytics
+    real_iter_archived = model.analytics.iter_archived
+    def log_midway(kind):
+        # What log_session does, from inside the backfill
+        assert get_user_stats(1)['totals']['minutes'] == 45
+        db.session.add(StudySession(duration=10, subject_id=1, user_id=1))
+        record_session(1, 1, 10)
+        db.session.commit()
+        return real_iter_archived(kind)
+    model.analytics.iter_archived = log_midway
+    try:
+        with app.app_context():
+            backfill_rollups(batch_size=1)
+    finally:
+        model.analytics.iter_archived = real_iter_archived
+    assert client.get('/stats.json').get_json()['totals'] == {'minutes': 55, 'sessions': 3, 'tasks_completed': 1, 'days': 14}
+
+def test_streaks():
+    """Current streak needs activity today or yesterday, longest is the best run ever."""
+    from datetime import date
+    from model.analytics import _streaks
+    days = [date(2026, 3, d) for d in (1, 2, 3, 7, 8)]
+    assert _streaks(days, date(2026, 3, 9)) == (2, 3)
+    assert _streaks(days, date(2026, 3, 12)) == (0, 3)
+    assert _streaks([], date(2026, 3, 12)) == (0, 0)
+
+def test_full_text_search(client):
+    """FTS finds tasks and notes by word or prefix, only in subjects the user can see."""
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'History', 'color_id': 1})
+    client.post('/add_task', data={'title': 'Essay on photosynthesis', 'description': 'draft', 'subject_id': 1, 'priority_id': 1})
+    client.post('/add_task', data={'title': 'Revise', 'description': 'photosynthesis notes', 'subject_id': 1, 'priority_id': 1})
+    client.post('/send_message/1', data={'content': 'who has the photo of the board?'})
+
+    data = client.get('/search.json?q=photosynth').get_json()
+    # Title hits are weighted above description hits
+    assert [r['title'] for r in data['results'] if r['kind'] == 'task'] == ['Essay on photosynthesis', 'Revise']
+    notes = client.get('/search.json?q=photo').get_json()['results']
+    assert any(r['kind'] == 'note' for r in notes)
+    # FTS syntax in the query is treated as plain words
+    assert client.get('/search.json?q=NEAR(" OR').status_code == 200
+    assert client.get('/search.json?q=photo&page=²').get_json()['page'] == 1
+    assert client.get('/search.json?q=photo&page=9999999999999999').get_json()['results'] == []
+
+    with app.app_context():
+        task = Task.query.filter_by(title='Revise').first()
+        task.description = 'chlorophyll'
+        db.session.commit()
+    titles = [r['title'] for r in client.get('/search.json?q=chlorophyll').get_json()['results']]
+    assert titles == ['Revise']
+
+    # Someone outside the subject sees nothing
+    client.post('/signup', data={'username': 'outsider', 'email': 'o@o.com', 'password': '123'})
+    client.post('/signin', data={'username or email': 'outsider', 'password': '123'})
+    assert client.get('/search.json?q=photo').get_json()['results'] == []
+    assert b"search" in client.get('/search?q=photo').data
+
+def test_agenda_orders_and_revalidates(client):
+    """Agenda lists pending tasks by due date then priority, and answers 304 until something changes."""
+    from datetime import timedelta
+    from model.models import get_nzt_now
+    soon = (get_nzt_now() + timedelta(days=1)).strftime('%Y-%m-%d')
+    later = (get_nzt_now() + timedelta(days=3)).strftime('%Y-%m-%d')
+    far = (get_nzt_now() + timedelta(days=30)).strftime('%Y-%m-%d')
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Maths', 'color_id': 1})
+    client.post('/add_task', data={'title': 'later', 'subject_id': 1, 'priority_id': 1, 'due_date_str': later})
+    client.post('/add_task', data={'title': 'soon low', 'subject_id': 1, 'priority_id': 3, 'due_date_str': soon})
+    client.post('/add_task', data={'title': 'soon high', 'subject_id': 1, 'priority_id': 1, 'due_date_str': soon})
+    client.post('/add_task', data={'title': 'far', 'subject_id': 1, 'priority_id': 1, 'due_date_str': far})
+
+    rv = client.get('/agenda.json')
+    assert [t['title'] for t in rv.get_json()['tasks']] == ['soon high', 'soon low', 'later']
+    assert client.get('/agenda.json?days=²').get_json()['tasks'] == rv.get_json()['tasks']
+    assert client.get('/agenda?days=²').status_code == 200
+    etag = rv.headers['ETag']
+    assert rv.headers['Last-Modified']
+
+    with count_queries() as executed:
+        cached = client.get('/agenda.json', headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert not [sql for sql, _ in executed if 'FROM task' in sql]
+
+    client.get('/complete_task/3')
+    fresh = client.get('/agenda.json', headers={'If-None-Match': etag})
+    assert fresh.status_code == 200
+    assert [t['title'] for t in fresh.get_json()['tasks']] == ['soon low', 'later']
+
+    with app.app_context():
+        from model.queries import get_agenda
+        page, cursor = get_agenda(1, limit=1)
+        rest, end = get_agenda(1, after=cursor)
+    assert [t.title for t in page + rest] == ['soon low', 'later'] and end is None
+    assert b"soon low" in client.get('/agenda').data
+
+def test_calendar_feed_streams_and_revalidates(client):
+    """The token-only .ics feed lists pending deadlines and sessions, and 304s until the next write."""
+    from datetime import timedelta
+    from model.models import User, get_nzt_now
+    soon = (get_nzt_now() + timedelta(days=2)).strftime('%Y-%m-%d')
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Bio, Chem', 'color_id': 1})
+    client.post('/add_task', data={'title': 'lab report', 'subject_id': 1, 'priority_id': 1, 'due_date_str': soon})
+    client.post('/add_task', data={'title': 'undated', 'subject_id': 1, 'priority_id': 1})
+    client.post('/log_session/1', data={'duration': '45'})
+    client.post('/calendar/token')
+    with app.app_context():
+        token = User.query.filter_by(username='testuser').first().calendar_token
+    assert token and token.encode() in client.get('/plan').data
+
+    client.get('/logout')
+    rv = client.get(f'/calendar/{token}.ics')
+    assert rv.status_code == 200 and rv.mimetype == 'text/calendar'
+    body = rv.data.decode()
+    assert body.startswith('BEGIN:VCALENDAR\r\n') and body.endswith('END:VCALENDAR\r\n')
+    assert body.count('BEGIN:VTODO') == 1 and 'DUE;VALUE=DATE:' + soon.replace('-', '') in body
+    assert body.count('BEGIN:VEVENT') == 1 and 'DURATION:PT45M' in body
+    assert 'Bio\\, Chem' in body
+    assert client.get('/calendar/nope.ics').status_code == 404
+
+    etag = rv.headers['ETag']
+    assert not rv.headers['ETag'].startswith('W/')
+    with count_queries() as executed:
+        assert client.get(f'/calendar/{token}.ics', headers={'If-None-Match': etag}).status_code == 304
+    assert not [sql for sql, _ in executed if 'FROM task' in sql]
+
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.get('/complete_task/1')
+    fresh = client.get(f'/calendar/{token}.ics', headers={'If-None-Match': etag})
+    assert fresh.status_code == 200 and 'BEGIN:VTODO' not in fresh.data.decode()
+
+def test_study_plan_edf_and_incremental_cache(client):
+    """Plans fill days earliest deadline first and follow task writes without reloading."""
+    from datetime import timedelta
+    from model.models import get_nzt_now
+    from model.scheduler import plan_cache
+    from model.counters import bump_counters
+    soon = (get_nzt_now() + timedelta(days=1)).strftime('%Y-%m-%d')
+    later = (get_nzt_now() + timedelta(days=5)).strftime('%Y-%m-%d')
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Plan', 'color_id': 1})
+    client.post('/plan', data={'daily_hours': '1'})
+    client.post('/add_task', data={'title': 'later', 'subject_id': 1, 'priority_id': 1, 'due_date_str': later, 'estimated_minutes': '90'})
+    client.post('/add_task', data={'title': 'soon', 'subject_id': 1, 'priority_id': 1, 'due_date_str': soon, 'estimated_minutes': '30'})
+
+    plan = client.get('/plan.json').get_json()
+    assert plan['daily_minutes'] == 60
+    first, second = plan['days'][0]['blocks'], plan['days'][1]['blocks']
+    assert [(b['title'], b['minutes']) for b in first] == [('soon', 30), ('later', 30)]
+    assert [(b['title'], b['minutes']) for b in second] == [('later', 60)]
+
+    # Adding and completing tasks patches the cached items, no task reload
+    client.post('/add_task', data={'title': 'new', 'subject_id': 1, 'priority_id': 2})
+    with count_queries() as executed:
+        plan = client.get('/plan.json').get_json()
+    assert not [sql for sql, _ in executed if 'FROM task' in sql]
+    assert 'new' in [b['title'] for d in plan['days'] for b in d['blocks']]
+    client.get('/complete_task/2')
+    plan = client.get('/plan.json').get_json()
+    assert 'soon' not in [b['title'] for d in plan['days'] for b in d['blocks']]
+    builds = plan_cache.builds
+    client.get('/plan')
+    assert plan_cache.builds == builds
+
+    # A write this worker never saw (another process) still reaches the plan through the version stamp
+    with app.app_context():
+        db.session.execute(db.text("UPDATE task SET status_id = 2 WHERE title = 'new'"))
+        bump_counters(1)
+        db.session.commit()
+    plan = client.get('/plan.json').get_json()
+    assert 'new' not in [b['title'] for d in plan['days'] for b in d['blocks']]
+
+    # An estimate that isn't a plain number is left out, the planner uses its default
+    rv = client.post('/add_task', data={'title': 'odd', 'subject_id': 1, 'priority_id': 1, 'estimated_minutes': '²'})
+    assert rv.status_code == 302
+    with app.app_context():
+        assert Task.query.filter_by(title='odd').one().estimated_minutes is None
+
+def test_build_plan_scales():
+    """Thousands of tasks are planned well under a second."""
+    import time
+    from datetime import date, datetime, timedelta
+    from model.scheduler import PlanItem, build_plan
+    items = [PlanItem(i, f't{i}', 1, 's', datetime(2026, 1, 1) + timedelta(hours=i % 500), i % 3 + 1, 30)
+             for i in range(5000)]
+    started = time.perf_counter()
+    plan = build_plan(items, 240, date(2026, 1, 1), horizon=365)
+    assert time.perf_counter() - started < 1.0
+    scheduled = sum(b['minutes'] for d in plan['days'] for b in d['blocks'])
+    assert scheduled + sum(u['minutes'] for u in plan['unscheduled']) == 5000 * 30
+
+def _fill_subject(client, subject_id):
+    client.post('/add_task', data={'title': 'x', 'subject_id': subject_id, 'priority_id': 1, 'tag_ids': ['1', '2']})
+    client.post('/add_task', data={'title': 'y', 'subject_id': subject_id, 'priority_id': 1})
+    client.post(f'/send_message/{subject_id}', data={'content': 'note'})
+    client.post(f'/log_session/{subject_id}', data={'duration': '10'})
+
+def _child_rows(subject_id):
+    from model.models import Message, StudySession, task_tags
+    with app.app_context():
+        return (Task.query.filter_by(subject_id=subject_id).count()
+                + Message.query.filter_by(subject_id=subject_id).count()
+                + StudySession.query.filter_by(subject_id=subject_id).count()
+                + db.session.query(task_tags).count())
+
+def test_subject_delete_is_set_based(client):
+    """Small subjects lose every child row, including tag links, without ORM loading."""
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Gone', 'color_id': 1})
+    _fill_subject(client, 1)
+    with count_queries() as executed:
+        client.get('/delete_subject/1')
+    assert not [sql for sql, _ in executed if sql.startswith('SELECT') and 'FROM message' in sql]
+    assert _child_rows(1) == 0
+
+def test_large_subject_delete_runs_in_background(client):
+    """Large subjects vanish immediately and their rows are purged by a queued job."""
+    from jobs import job_queue
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Huge', 'color_id': 1})
+    _fill_subject(client, 1)
+    app.config['LARGE_SUBJECT_ROWS'] = 1
+    try:
+        rv = client.get('/delete_subject/1', follow_redirects=True)
+    finally:
+        app.config['LARGE_SUBJECT_ROWS'] = 5000
+    assert b"background" in rv.data
+    assert b"huge" not in client.get('/dashboard').data.lower()
+    assert _child_rows(1) > 0
+    # A new subject never takes the hidden id, so it can't see the leftovers or lose rows to the purge
+    client.post('/add_subject', data={'name': 'Fresh', 'color_id': 1})
+    with app.app_context():
+        fresh_id = Subject.query.filter_by(name='Fresh').one().subject_id
+    assert fresh_id != 1
+    client.post(f'/send_message/{fresh_id}', data={'content': 'mine'})
+    job_queue.run_pending()
+    assert _child_rows(1) == 0
+    assert _child_rows(fresh_id) == 1
+
+    # Study history counts towards the size too, a subject that only has sessions isn't cheap
+    client.post('/add_subject', data={'name': 'Sessions only', 'color_id': 1})
+    with app.app_context():
+        sessions_id = Subject.query.filter_by(name='Sessions only').one().subject_id
+    for _ in range(3):
+        client.post(f'/log_session/{sessions_id}', data={'duration': '10'})
+    app.config['LARGE_SUBJECT_ROWS'] = 3
+    try:
+        rv = client.get(f'/delete_subject/{sessions_id}', follow_redirects=True)
+    finally:
+        app.config['LARGE_SUBJECT_ROWS'] = 5000
+    assert b"background" in rv.data
+
+def test_job_queue_retries_batches_and_idempotency(client):
+    """Jobs are stored once per key, retried with backoff, failed after max_attempts and claimed in batches."""
+    from datetime import timedelta
+    from model.models import Job
+    from jobs import job_queue
+    calls = []
+
+    @job_queue.handler('test_flaky', max_attempts=2)
+    def flaky(payloads):
+        calls.append(('flaky', payloads))
+        if payloads[0].get('fail'):
+            raise RuntimeError("boom")
+
+    @job_queue.handler('test_batched', batch_size=2)
+    def batched(payloads):
+        calls.append(('batched', [p['n'] for p in payloads]))
+
+    job_queue.reset()
+    try:
+        with app.app_context():
+            job_queue.enqueue('test_flaky', {'fail': True}, key='once')
+            job_queue.enqueue('test_flaky', {'fail': True}, key='once')
+            for n in range(3):
+                job_queue.enqueue('test_batched', {'n': n})
+            db.session.commit()
+            assert Job.query.filter_by(kind='test_flaky').count() == 1
+
+            assert job_queue.run_pending() == 4
+            assert ('batched', [0, 1]) in calls and ('batched', [2]) in calls
+            flaky_job = Job.query.filter_by(kind='test_flaky').one()
+            assert (flaky_job.status, flaky_job.attempts) == ('queued', 1)
+            assert flaky_job.run_at >= flaky_job.started_at + timedelta(seconds=app.config['JOBS_BACKOFF_SECONDS'])
+            assert "RuntimeError: boom" in flaky_job.last_error
+            assert job_queue.run_pending() == 0  # not due yet
+
+            flaky_job.run_at = flaky_job.created_at
+            db.session.commit()
+            assert job_queue.run_pending() == 1
+            db.session.expire_all()
+            assert Job.query.filter_by(kind='test_flaky').one().status == 'failed'
+
+            stats = job_queue.stats()
+            assert stats['depth']['test_flaky'] == {'failed': 1}
+            assert stats['kinds']['test_flaky']['retried'] == 1 and stats['kinds']['test_flaky']['failed'] == 1
+            assert stats['kinds']['test_batched']['succeeded'] == 3
+            assert 'studyplanner_jobs_failed_total{kind="test_flaky"} 1' in job_queue.render_metrics()
+    finally:
+        del job_queue.handlers['test_flaky'], job_queue.handlers['test_batched']
+        job_queue.reset()
+
+def test_notifications_land_in_outbox(client):
+    """Invites, joins and notes are queued by the routes and written to the outbox by the notify job."""
+    from jobs import job_queue
+    outbox = app.config['JOBS_OUTBOX_DIR']
+    shutil.rmtree(outbox, ignore_errors=True)
+
+    def received(user_id):
+        folder = os.path.join(outbox, str(user_id))
+        files = sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+        return [[n['event'] for n in json.load(open(os.path.join(folder, f)))['notifications']] for f in files]
+
+    client.post('/signup', data={'username': 'friend', 'email': 'f@f.com', 'password': '123'})
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Team', 'color_id': 1})
+    client.post('/invite_user/1', data={'username': 'friend'})
+    assert received(2) == []  # nothing is written inside the request
+    job_queue.run_pending()
+    assert received(2) == [['invite']]
+
+    client.post('/signin', data={'username or email': 'friend', 'password': '123'})
+    with app.app_context():
+        membership_id = SubjectMember.query.filter_by(user_id=2, subject_id=1).one().id
+    client.get(f'/accept_invite/{membership_id}')
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/send_message/1', data={'content': 'first'})
+    client.post('/send_message/1', data={'content': 'second'})
+    job_queue.run_pending()
+    # One file per note, the sender hears nothing about their own notes
+    assert received(1) == [['joined']]
+    assert sorted(received(2)) == [['invite'], ['note'], ['note']]
+
+    # A retried notification landing in a different batch rewrites its own file, no duplicate
+    from model.notifications import deliver
+    with app.app_context():
+        payload = {'id': 'retry', 'user_id': 2, 'event': 'note', 'data': {}}
+        deliver([{'id': 'other', 'user_id': 2, 'event': 'note', 'data': {}}, payload])
+        deliver([payload])
+    assert len(received(2)) == 5
+
+def test_history_archive_moves_old_rows_and_pages_lazily(client):
+    """Old months move into compressed blocks, counts survive and view_subject pages back into them."""
+    from datetime import datetime
+    from sqlalchemy import func
+    from model.models import Message, StudySession, StudyRollup
+    from model.archive import archive_history, archive_stats
+    from model.analytics import backfill_rollups
+    from model.counters import rebuild_counters
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Old', 'color_id': 1})
+    for i in range(30):
+        client.post('/send_message/1', data={'content': f'ancient note number {i}'})
+    client.post('/log_session/1', data={'duration': '40'})
+    with app.app_context():
+        Message.query.update({'timestamp': datetime(2020, 1, 15, 9, 0)})
+        StudySession.query.update({'timestamp': datetime(2020, 2, 3, 9, 0)})
+        db.session.commit()
+    client.post('/send_message/1', data={'content': 'fresh note'})
+    client.post('/log_session/1', data={'duration': '5'})
+
+    with app.app_context():
+        report = archive_history(days=180)
+        assert (report['message'], report['session'], report['blocks']) == (30, 1, 2)
+        assert report['saved_bytes'] > 0 and archive_stats()['message']['rows'] == 30
+        assert Message.query.count() == 1 and StudySession.query.count() == 1
+        assert archive_history(days=180)['blocks'] == 0  # nothing left to move
+        # Counters and rollups still include the archived rows after a full rebuild
+        minutes = lambda: db.session.query(func.sum(StudyRollup.minutes)).filter_by(period='day').scalar()
+        before = minutes()
+        rebuild_counters()
+        backfill_rollups()
+        subject = db.session.get(Subject, 1)
+        assert (subject.message_count, subject.study_minutes, minutes()) == (31, 45, before)
+
+    # First page is live rows only, the archive opens when paging back
+    page = client.get('/subject/1').get_data(as_text=True)
+    assert 'fresh note' in page and 'ancient note' not in page and 'load older notes' in page
+    assert 'load older sessions' in page
+    import re
+    cursor = re.search(r'notes_before=([^&"]+)', page).group(1)
+    with count_queries() as executed:
+        older = client.get(f'/subject/1?notes_before={cursor}')
+    assert any('FROM archive_block' in sql for sql, _ in executed)
+    older = older.get_data(as_text=True)
+    assert older.count('ancient note number') == 30 and 'load older notes' not in older
+
+    export = client.get('/export.ndjson').get_data(as_text=True)
+    assert export.count('ancient note number') == 30 and '"duration": 40' in export
+
+def test_batch_task_operations(client):
+    """One POST completes, retags, reprioritizes or moves many tasks, skipping other people's."""
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'From', 'color_id': 1})
+    client.post('/add_subject', data={'name': 'To', 'color_id': 1})
+    for title in ('a', 'b', 'c'):
+        client.post('/add_task', data={'title': title, 'subject_id': 1, 'priority_id': 2})
+    assert b'name="task_ids"' in client.get('/subject/1').data
+
+    def batch(**form):
+        return client.post('/tasks/batch', data=form, headers={'Accept': 'application/json'}).get_json()
+
+    assert batch(action='complete', task_ids=['1', '2', '99']) == {'changed': 2, 'skipped': 1}
+    assert batch(action='complete', task_ids=['1'])['changed'] == 0
+    assert batch(action='reopen', task_ids=['2'])['changed'] == 1
+    assert batch(action='set_priority', task_ids=['1', '2', '3'], priority_id='3')['changed'] == 3
+    assert batch(action='add_tags', task_ids=['1', '3'], tag_ids=['1'])['changed'] == 2
+    assert batch(action='add_tags', task_ids=['1'], tag_ids=['1'])['changed'] == 1  # already linked, no error
+    assert batch(action='remove_tags', task_ids=['3'], tag_ids=['1'])['changed'] == 1
+    assert batch(action='move', task_ids=['2', '3'], target_subject_id='2')['changed'] == 2
+    assert batch(action='move', task_ids=['1'], target_subject_id='2')['changed'] == 1
+    assert batch(action='move', task_ids=['1'], target_subject_id='1')['changed'] == 1
+    assert 'error' in batch(action='explode', task_ids=['1'])
+
+    with app.app_context():
+        tasks = {t.title: t for t in Task.query.all()}
+        assert tasks['a'].status_id == 2 and tasks['b'].status_id == 1
+        assert {t.priority_id for t in tasks.values()} == {3}
+        assert [t.name for t in tasks['a'].tags] == ['urgent'] and tasks['c'].tags == []
+        assert tasks['b'].subject_id == tasks['c'].subject_id == 2
+        source, target = db.session.get(Subject, 1), db.session.get(Subject, 2)
+        assert (source.active_task_count, source.completed_task_count) == (0, 1)
+        assert (target.active_task_count, target.completed_task_count) == (2, 0)
+        # The completed task's rollups went to 'To' and came back with it
+        from model.models import StudyRollup
+        done = {(r.subject_id, r.period): r.tasks_completed for r in StudyRollup.query.all()}
+        assert done == {(1, 'day'): 1, (1, 'week'): 1, (2, 'day'): 0, (2, 'week'): 0}
+
+    # Ids that aren't plain numbers are dropped, not a 500
+    assert batch(action='complete', task_ids=['²']) == {'changed': 0, 'skipped': 0}
+    assert batch(action='set_priority', task_ids=['1'], priority_id='²') == {'error': 'Pick a priority.'}
+
+    # Another request flips task 3 between the batch's read and its UPDATE: only the guarded UPDATE's rows count
+    import model.batch
+    real_owned_rows = model.batch._owned_rows
+    def racing(status_id):
+        def owned_rows(user_id, task_ids):
+            rows = real_owned_rows(user_id, task_ids)
+            db.session.execute(db.text("UPDATE task SET status_id = :s WHERE task_id = 3"), {'s': status_id})
+            return rows
+        return owned_rows
+    try:
+        model.batch._owned_rows = racing(2)
+        assert batch(action='complete', task_ids=['3'])['changed'] == 0
+        model.batch._owned_rows = racing(1)
+        assert batch(action='reopen', task_ids=['3'])['changed'] == 0
+    finally:
+        model.batch._owned_rows = real_owned_rows
+    with app.app_context():
+        target = db.session.get(Subject, 2)
+        assert (target.active_task_count, target.completed_task_count) == (2, 0)
+        assert sum(r.tasks_completed for r in StudyRollup.query.filter_by(subject_id=2)) == 0
+
+    # Another user can't touch these tasks
+    client.post('/signup', data={'username': 'mallory', 'email': 'm@m.com', 'password': '123'})
+    client.post('/signin', data={'username or email': 'mallory', 'password': '123'})
+    assert batch(action='complete', task_ids=['2']) == {'changed': 0, 'skipped': 1}
+
+def test_export_import_round_trip(client):
+    """An export re-imports into another account with tags, priorities and counters intact."""
+    import io, json, time
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Bio', 'color_id': 2})
+    client.post('/add_task', data={'title': 'cells', 'subject_id': 1, 'priority_id': 1,
+                                   'tag_ids': ['1', '2'], 'due_date_str': '2026-05-01'})
+    client.post('/add_task', data={'title': 'plants', 'subject_id': 1, 'priority_id': 3})
+    client.get('/complete_task/2')
+    client.post('/send_message/1', data={'content': 'lab on friday'})
+    client.post('/log_session/1', data={'duration': '40'})
+
+    ndjson = client.get('/export.ndjson').get_data(as_text=True)
+    records = [json.loads(line) for line in ndjson.splitlines()]
+    assert [r['type'] for r in records] == ['subject', 'task', 'task', 'note', 'session']
+    assert records[1]['tags'] == 'urgent;exam' or records[1]['tags'] == 'exam;urgent'
+    csv_text = client.get('/export.csv').get_data(as_text=True)
+    assert csv_text.splitlines()[0].startswith('type,subject')
+
+    client.post('/signup', data={'username': 'copy', 'email': 'copy@c.com', 'password': '123'})
+    client.post('/signin', data={'username or email': 'copy', 'password': '123'})
+    report = client.post('/import', data={'file': (io.BytesIO(csv_text.encode()), 'backup.csv')},
+                         headers={'Accept': 'application/json'}, content_type='multipart/form-data').get_json()
+    assert report == {'subjects_created': 1, 'tasks': 2, 'notes': 1, 'sessions': 1}
+
+    with app.app_context():
+        copy = Subject.query.filter_by(user_id=2).one()
+        assert (copy.active_task_count, copy.completed_task_count, copy.study_minutes, copy.message_count) == (1, 1, 40, 1)
+        cells = Task.query.filter_by(subject_id=copy.subject_id, title='cells').one()
+        assert sorted(t.name for t in cells.tags) == ['exam', 'urgent']
+        assert cells.priority.level == 'high' and cells.due_date.year == 2026
+
+    # Bulk path: a large synthetic file goes in fast, bad rows are skipped not fatal
+    lines = [json.dumps({'type': 'task', 'subject': 'Bulk', 'title': f't{i}', 'tags': 'general', 'priority': 'low'})
+             for i in range(5000)] + ['not json', json.dumps({'type': 'task', 'subject': 'Bulk'})]
+    started = time.perf_counter()
+    report = client.post('/import', data={'file': (io.BytesIO("\n".join(lines).encode()), 'bulk.ndjson')},
+                         headers={'Accept': 'application/json'}, content_type='multipart/form-data').get_json()
+    assert time.perf_counter() - started < 10
+    assert report['tasks'] == 5000 and report['skipped'] == 2
+
+def test_import_rejects_unreadable_and_oversized_files(client):
+    """Bad bytes mid-file give a 400 with what got in before them, not a 500; huge uploads get a 413."""
+    import io
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    def post(body, name):
+        return client.post('/import', data={'file': (io.BytesIO(body), name)},
+                           headers={'Accept': 'application/json'}, content_type='multipart/form-data')
+
+    rv = post(b'\xff\xfe\x00garbage', 'x.csv')
+    assert rv.status_code == 400 and 'UTF-8' in rv.get_json()['error']
+    good = "type,subject,title\n" + "".join(f"task,Mixed,t{i}\n" for i in range(3000))
+    rv = post(good.encode() + b'task,Mixed,\xff\n', 'mixed.csv')
+    # Decoding runs a block ahead of the rows, so some rows before the bad line may be lost with it
+    assert rv.status_code == 400 and rv.get_json()['tasks'] > 2000
+    with app.app_context():
+        assert Task.query.count() == rv.get_json()['tasks']
+    rv = post(b'type,subject\nsubject,"' + b'a' * 200000 + b'"\n', 'huge_field.csv')  # over csv's field limit
+    assert rv.status_code == 400 and 'CSV' in rv.get_json()['error']
+
+    # NDJSON lines of the wrong shape are skipped or read as text, never a 500
+    lines = ['[1, 2]', '7', '{"type": "task", "subject": "Odd", "title": 5, "tags": ["a"], "due_date": 20260101,'
+             ' "estimated_minutes": "²", "priority": null, "status": {}}',
+             '{"type": "task", "subject": ["Odd"], "title": "no subject"}',
+             '{"type": "session", "subject": "Odd", "duration": "²"}',
+             '{"type": "note", "subject": 42, "content": 3.5, "timestamp": 1}']
+    rv = post("\n".join(lines).encode(), 'odd.ndjson')
+    assert rv.status_code == 200
+    assert rv.get_json() == {'subjects_created': 2, 'tasks': 1, 'notes': 1, 'skipped': 4}
+    with app.app_context():
+        task = Task.query.filter_by(title='5').one()
+        assert task.due_date is None and task.estimated_minutes is None and task.tags == []
+
+    app.config['MAX_CONTENT_LENGTH'] = 1024
+    try:
+        assert post(good.encode(), 'big.csv').status_code == 413
+    finally:
+        app.config['MAX_CONTENT_LENGTH'] = 20 * 1024 * 1024
+
+def test_benchmark_suite_seeds_times_and_compares(client):
+    """Synthetic data is deterministic, every benchmarked route answers, and regressions get flagged."""
+    import benchmark
+    from model.models import Message
+    small = {'subjects_per_user': 2, 'tasks_per_subject': 8, 'messages_per_subject': 5, 'sessions_per_subject': 3}
+    results = benchmark.run_benchmark(app, users=4, seed_value=7, iterations=2, ratios=small)
+    rows = results['meta']['rows']
+    assert rows['user'] == 4 and rows['subject'] == 8 and rows['task'] == 64 and rows['message'] == 40
+    with app.app_context():
+        first = [m.content for m in Message.query.order_by(Message.message_id).limit(5)]
+        benchmark.seed(app, 4, 7, small)
+        assert [m.content for m in Message.query.order_by(Message.message_id).limit(5)] == first
+
+    scenarios = results['scenarios']
+    assert {name for name, *_ in benchmark.SCENARIOS} == set(scenarios)
+    assert {n: m['statuses'] for n, m in scenarios.items() if max(m['statuses']) >= 400} == {}
+    assert scenarios['main.dashboard']['queries'] > 0
+
+    slower = json.loads(json.dumps(results))
+    slower['scenarios']['main.dashboard']['p50_ms'] += 50
+    slower['scenarios']['main.view_subject']['queries'] += 1
+    flagged = benchmark.compare(slower, results)
+    assert len(flagged) == 2 and flagged[0].startswith('main.dashboard: p50_ms')
+    assert benchmark.compare(results, results) == []
+
+def test_routes_stay_within_query_budgets(client):
+    """Pages keep a fixed query count no matter how many tasks/notes/members a subject has."""
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Budget', 'color_id': 1})
+    for i in range(5):
+        client.post('/add_task', data={'title': f'task {i}', 'subject_id': 1, 'priority_id': 1, 'tag_ids': [1, 2],
+                                       'due_date_str': '2030-01-01'})
+        client.post('/send_message/1', data={'content': f'note {i}'})
+    for path in QUERY_BUDGETS:
+        client.get(path)  # warm caches
+    for path, budget in QUERY_BUDGETS.items():
+        assert assert_query_budget(client, path, budget).status_code == 200
+
+def test_instrumentation_headers_metrics_and_slow_log(client, caplog):
+    """Opt-in timing adds Server-Timing, logs slow requests as JSON and aggregates /metrics."""
+    from instrumentation import instrumentation
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    assert 'Server-Timing' not in client.get('/dashboard').headers
+    assert client.get('/metrics').status_code == 404
+
+    app.config.update(INSTRUMENTATION_ENABLED=True, INSTRUMENTATION_SLOW_MS=0)
+    instrumentation.reset()
+    try:
+        with caplog.at_level('WARNING'):
+            rv = client.get('/dashboard')
+        timing = rv.headers['Server-Timing']
+        assert 'db;dur=' in timing and '"3 queries"' in timing and 'tpl;dur=' in timing and 'total;dur=' in timing
+        logged = json.loads(caplog.records[-1].getMessage().split(' ', 2)[2])
+        assert logged['endpoint'] == 'main.dashboard' and logged['queries'] == 3 and logged['slowest']
+
+        metrics = client.get('/metrics').data.decode()
+        assert 'studyplanner_requests_total{endpoint="main.dashboard",status="200"} 1' in metrics
+        assert 'studyplanner_db_queries_total{endpoint="main.dashboard"} 3' in metrics
+        assert 'studyplanner_request_duration_seconds_count{endpoint="main.dashboard"} 1' in metrics
+    finally:
+        app.config.update(INSTRUMENTATION_ENABLED=False, INSTRUMENTATION_SLOW_MS=500)
+
+def test_dashboard_and_workspace_revalidate_on_subject_version(client):
+    """Subject writes bump its version; pages 304 until then and reuse cached fragments after."""
+    from cache import fragment_cache
+    client.post('/signup', data={'username': 'friend', 'email': 'f@f.com', 'password': '123'})
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Chem', 'color_id': 1})
+    client.post('/add_task', data={'title': 'titration', 'subject_id': 1, 'priority_id': 1})
+
+    page = client.get('/subject/1')
+    home = client.get('/dashboard')
+    assert b'titration' in page.data and b'1 active tasks' in home.data
+    with count_queries() as executed:
+        assert client.get('/subject/1', headers={'If-None-Match': page.headers['ETag']}).status_code == 304
+        assert client.get('/dashboard', headers={'If-None-Match': home.headers['ETag']}).status_code == 304
+    assert not [sql for sql, _ in executed if 'FROM task' in sql or 'FROM message' in sql]
+
+    # Every write route moves the version, and with it the ETags
+    with app.app_context():
+        start = db.session.get(Subject, 1).version
+    client.post('/send_message/1', data={'content': 'buffer notes'})
+    client.post('/log_session/1', data={'duration': '20'})
+    client.get('/complete_task/1')
+    client.post('/invite_user/1', data={'username': 'friend'})
+    with app.app_context():
+        assert db.session.get(Subject, 1).version == start + 4
+    fresh = client.get('/subject/1', headers={'If-None-Match': page.headers['ETag']})
+    assert fresh.status_code == 200 and b'buffer notes' in fresh.data and b'20m' in fresh.data
+    home = client.get('/dashboard', headers={'If-None-Match': home.headers['ETag']})
+    assert home.status_code == 200 and b'0 active tasks' in home.data
+
+    # Unchanged subject, new request without validators: fragments are reused, no list queries
+    hits = fragment_cache.hits
+    with count_queries() as executed:
+        client.get('/subject/1')
+    assert fragment_cache.hits == hits + 3
+    assert not [sql for sql, _ in executed if 'FROM task' in sql or 'FROM message' in sql]
+
+    # The invitee's dashboard changes when they accept, and flash pages are never revalidated
+    client.post('/signin', data={'username or email': 'friend', 'password': '123'})
+    before = client.get('/dashboard')
+    client.get('/accept_invite/2')
+    after = client.get('/dashboard', headers={'If-None-Match': before.headers['ETag']})
+    assert after.status_code == 200 and b'chem' in after.data
+    client.post('/add_subject', data={'name': 'Chem', 'color_id': 1})
+    client.post('/add_subject', data={'name': 'Chem', 'color_id': 1})
+    flashed = client.get('/dashboard', headers={'If-None-Match': after.headers['ETag']})
+    assert flashed.status_code == 200 and 'ETag' not in flashed.headers
+
+def test_app_factory_profiles_and_db_only_apps():
+    """Profiles pick the defaults, overrides win, and CLI apps skip the blueprints."""
+    testing = create_app('testing')
+    assert testing.config['TESTING'] and testing.config['SQLALCHEMY_DATABASE_URI'] == 'sqlite://'
+    # No job workers, they would start polling the default database
+    assert create_app('production', {'SECRET_KEY': 'x', 'JOBS_WORKER_THREADS': 0}).config['SESSION_COOKIE_SECURE']
+
+    cli = create_app('testing', routes=False)
+    assert 'main' not in cli.blueprints and 'main' in testing.blueprints
+    with cli.app_context():
+        resetdb(cli)
+        lookup_data()
+        assert Priority.query.count() > 0
+    with pytest.raises(ValueError):
+        create_app('staging')
+    # Shared extensions take the settings of the last app built, hand them back to the test app
+    from passwords import password_hasher
+    from jobs import job_queue
+    password_hasher.init_app(app)
+    job_queue.init_app(app)
+
+
+def test_fingerprinted_assets_and_compressed_pages(client):
+    """Built assets get hashed, immutable URLs with precompressed variants; big pages go out gzipped."""
+    import gzip
+    from assets import assets, build
+    from compression import compressor
+    manifest, _ = build(app.static_folder, app.config['ASSETS_DIST_DIR'])
+    assets.reload()
+    with open(os.path.join(app.static_folder, 'style.css'), 'rb') as f:
+        css = f.read()
+
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    page = client.get('/dashboard', headers={'Accept-Encoding': 'gzip'})
+    assert page.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in page.headers['Vary']
+    url = f"/assets/{manifest['style.css']}"
+    assert url in gzip.decompress(page.data).decode()
+    assert compressor.stats()['main.dashboard']['saved_bytes'] > 0
+    # The ETag goes weak once compressed and still revalidates
+    assert page.headers['ETag'].startswith('W/')
+    assert client.get('/dashboard', headers={'If-None-Match': page.headers['ETag'],
+                                             'Accept-Encoding': 'gzip'}).status_code == 304
+
+    rv = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert rv.headers['Content-Encoding'] == 'gzip' and gzip.decompress(rv.data) == css
+    assert 'immutable' in rv.headers['Cache-Control'] and 'max-age=31536000' in rv.headers['Cache-Control']
+    assert client.get(url).data == css  # identity when the client doesn't ask
+    assert client.get('/assets/style.css').status_code == 404  # only built names are served
+    # Small bodies aren't worth compressing
+    assert 'Content-Encoding' not in client.get('/users/suggest?q=te', headers={'Accept-Encoding': 'gzip'}).headers
+
+def test_json_api_projects_pages_and_streams(client):
+    """The v1 API reads only the asked-for columns in one query per page, keyset paged, scoped to visible subjects."""
+    import gzip
+    assert client.get('/api/v1/tasks').status_code == 401
+    client.post('/signup', data={'username': 'other', 'email': 'o@o.com', 'password': '123'})
+    client.post('/signin', data={'username or email': 'other', 'password': '123'})
+    client.post('/add_subject', data={'name': 'Private', 'color_id': 1})
+    client.post('/add_task', data={'title': 'not yours', 'subject_id': 1, 'priority_id': 1})
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Mine', 'color_id': 1})
+    for i in range(3):
+        client.post('/add_task', data={'title': f'task {i}', 'subject_id': 2, 'priority_id': 1, 'tag_ids': ['1', '2'][:i]})
+        client.post('/send_message/2', data={'content': f'note {i}'})
+
+    titles, after = [], ''
+    while after is not None:
+        with count_queries() as executed:
+            rv = client.get(f'/api/v1/tasks?fields=title,tags&limit=2&after={after}')
+            page = rv.get_json()  # streamed, the query runs while the body is read
+        assert len(executed) == 1
+        assert all(set(row) == {'title', 'tags'} for row in page['data'])
+        titles += [(row['title'], sorted(row['tags'])) for row in page['data']]
+        after = page['next_cursor']
+    assert titles == [('task 0', []), ('task 1', ['urgent']), ('task 2', ['exam', 'urgent'])]
+
+    rv = client.get('/api/v1/notes?subject_id=2&fields=sender,content&limit=2', headers={'Accept-Encoding': 'gzip'})
+    assert rv.headers['Content-Encoding'] == 'gzip'
+    notes = json.loads(gzip.decompress(rv.data))
+    assert notes['data'] == [{'sender': 'testuser', 'content': 'note 2'}, {'sender': 'testuser', 'content': 'note 1'}]
+    older = client.get(f"/api/v1/notes?subject_id=2&limit=2&after={notes['next_cursor']}").get_json()
+    assert [n['content'] for n in older['data']] == ['note 0'] and older['next_cursor'] is None
+
+    assert client.get('/api/v1/tasks?fields=title,password_hash').status_code == 400
+    assert client.get('/api/v1/notes?after=garbage').status_code == 400
+    assert client.get('/api/v1/tasks?limit=²').status_code == 400
+    assert client.get('/api/v1/tasks?after=²').status_code == 400
+    assert client.get('/api/v1/tasks?subject_id=١').status_code == 400
+    assert client.get('/api/v1/tasks?limit=0').status_code == 400
+    assert client.get('/api/v1/tasks?subject_id=99999999999999999999').status_code == 400
+    assert client.get('/api/v1/tasks?subject_id=1').get_json()['data'] == []
+
+def test_recreated_subject_never_shows_cached_fragments_of_a_deleted_one(client):
+    """Delete, recreate as someone else, view: the old subject's cached notes must not come back."""
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Alice', 'color_id': 1})
+    client.post('/send_message/1', data={'content': 'ALICE SECRET NOTE'})
+    assert b'ALICE SECRET NOTE' in client.get('/subject/1').data  # notes fragment now cached
+    client.get('/delete_subject/1')
+
+    client.post('/signup', data={'username': 'bob', 'email': 'b@b.com', 'password': '123'})
+    client.post('/signin', data={'username or email': 'bob', 'password': '123'})
+    client.post('/add_subject', data={'name': 'Bob', 'color_id': 1})
+    with app.app_context():
+        subject_id = Subject.query.filter_by(name='Bob').one().subject_id
+    assert subject_id != 1
+    client.post(f'/send_message/{subject_id}', data={'content': 'bob note'})
+    page = client.get(f'/subject/{subject_id}').data
+    assert b'bob note' in page and b'ALICE SECRET NOTE' not in page
+    assert client.get('/subject/1').status_code == 404
+
+def test_numeric_inputs_only_take_ascii_digits(client):
+    """'²' passes str.isdigit() but not int(): every numeric form field/query arg must treat it as garbage, not 500."""
+    assert [parse_positive_int(v) for v in ('12', ' 7 ', 3, '0', '-4', '²', '١', '1.5', True, None, 2 ** 63)] == \
+        [12, 7, 3, None, None, None, None, None, None, None, None]
+    client.post('/signin', data={'username or email': 'testuser', 'password': 'password123'})
+    client.post('/add_subject', data={'name': 'Digits', 'color_id': 1})
+    assert client.post('/log_session/1', data={'duration': '²'}).status_code == 302
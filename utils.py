@@ -1,5 +1,6 @@
+import hashlib
 from functools import wraps
-from flask import session, flash, redirect, url_for
+from flask import session, flash, redirect, url_for, request, make_response
 from datetime import datetime
 
 """
@@ -29,4 +30,50 @@ def parse_date(date_str):
             return datetime.strptime(date_str, '%Y-%m-%d')
         except ValueError:
             return None
-    return None
\ No newline at end of file
+    return None
+
+# Largest value SQLite can store in an INTEGER column
+MAX_SQL_INT = 2 ** 63 - 1
+
+def parse_positive_int(raw, default=None):
+    """
+    Whole number above 0 from a form field, query arg or imported value, default when it isn't one.
+    Only ASCII digits count: str.isdigit() is also true for things like '²', which int() then rejects.
+    """
+    if isinstance(raw, str):
+        raw = raw.strip()
+        if not (raw.isascii() and raw.isdigit()):
+            return default
+        raw = int(raw)
+    elif not isinstance(raw, int) or isinstance(raw, bool):
+        return default
+    return raw if 0 < raw <= MAX_SQL_INT else default
+
+def make_etag(*parts):
+    """Stable ETag value from whatever the page depends on (ids, versions, query args)."""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+def not_modified(etag, last_modified=None):
+    """
+    Returns a bare 304 response when the client's If-None-Match/If-Modified-Since
+    still matches, so the caller can skip its queries. Otherwise None.
+    """
+    if request.if_none_match:
+        # Weak compare, compressed responses carry W/ versions of the same ETag
+        fresh = request.if_none_match.contains_weak(etag)
+    elif last_modified and request.if_modified_since:
+        fresh = last_modified.replace(microsecond=0) <= request.if_modified_since
+    else:
+        fresh = False
+    if not fresh:
+        return None
+    return set_validators(make_response('', 304), etag, last_modified)
+
+def set_validators(response, etag, last_modified=None):
+    """Attaches ETag/Last-Modified and asks clients to revalidate before reuse."""
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,45 @@
+import argparse
+import json
+import signal
+from run import create_app
+from extensions import db
+from jobs import job_queue, load_handlers
+
+"""
+Standalone job worker for W Notes+.
+Runs the durable job queue outside the web process (set JOBS_WORKER_THREADS = 0 on the web app).
+
+    python worker.py              # run until Ctrl+C / SIGTERM
+    python worker.py --threads 4
+    python worker.py --once       # run everything that's due, then exit
+    python worker.py --stats      # queue depth, latency and failures as JSON
+"""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run background jobs.")
+    parser.add_argument('--threads', type=int, help="worker threads (default JOBS_WORKER_THREADS, at least 1)")
+    parser.add_argument('--once', action='store_true', help="drain due jobs and exit")
+    parser.add_argument('--stats', action='store_true', help="print queue stats and exit")
+    args = parser.parse_args()
+
+    app = create_app(routes=False)
+    load_handlers()
+    with app.app_context():
+        if args.stats:
+            print(json.dumps(job_queue.stats(), indent=2))
+        elif args.once:
+            job_queue.sweep()
+            print(f"Ran {job_queue.run_pending()} jobs.")
+        else:
+            stopping = []
+            signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+            threads = max(args.threads or app.config['JOBS_WORKER_THREADS'], 1)
+            job_queue.start(app, threads=threads)
+            print(f"Worker running {threads} threads, Ctrl+C to stop.")
+            try:
+                while not stopping:
+                    signal.pause()
+            except KeyboardInterrupt:
+                pass
+            job_queue.stop()
+            db.session.remove()